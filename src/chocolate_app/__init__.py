@@ -59,6 +59,90 @@ parser.add_argument(
 )
 parser.add_argument("-c:a", "--audio-codec", help="Audio codec to use", default="aac")
 parser.add_argument("-f", "--ffmpeg-args", help="FFmpeg arguments to use", nargs="*")
+parser.add_argument(
+    "--segment-cache-size",
+    help="Maximum size of the transcoded segments cache (in MB)",
+    type=int,
+    default=10240,
+)
+parser.add_argument(
+    "--transcode-slots",
+    help="Maximum number of transcodes running at once (default: half of the CPU cores, at least 2)",
+    type=int,
+)
+parser.add_argument(
+    "--transcode-user-slots",
+    help="Maximum number of transcodes running at once for a single user",
+    type=int,
+    default=3,
+)
+parser.add_argument(
+    "--prefetch-segments",
+    help="Number of segments to transcode ahead of the playback (disabled by default)",
+    type=int,
+    default=0,
+)
+parser.add_argument(
+    "--playback-store",
+    help="Where the state of the playback sessions is kept, use database when running several workers",
+    choices=["memory", "database"],
+    default="memory",
+)
+parser.add_argument(
+    "--fast-start",
+    help="Use short segments at the start of the playback and at the resume position",
+    action="store_true",
+)
+parser.add_argument(
+    "--pretranscode-hours",
+    help="Hours during which the pre-transcode jobs run, as start-end in local time",
+    default="1-7",
+)
+parser.add_argument(
+    "--pretranscode-size",
+    help="Maximum size of the pre-transcoded segments (in MB)",
+    type=int,
+    default=51200,
+)
+parser.add_argument(
+    "--audio-cache-size",
+    help="Maximum size of the encoded audio tracks of the videos (in MB)",
+    type=int,
+    default=10240,
+)
+parser.add_argument(
+    "--track-cache-size",
+    help="Maximum size of the transcoded music tracks cache (in MB)",
+    type=int,
+    default=5120,
+)
+parser.add_argument(
+    "--live-restream",
+    help="Relay each live TV channel through the server, with one upstream connection for all its viewers",
+    action="store_true",
+)
+parser.add_argument(
+    "--live-timeshift",
+    help="Minutes of the relayed live TV channels kept to pause and rewind, implies --live-restream (disabled by default)",
+    type=int,
+    default=0,
+)
+parser.add_argument(
+    "--no-trickplay",
+    help="Disable the generation of the seek preview thumbnails",
+    action="store_true",
+)
+parser.add_argument(
+    "--tmdb-url",
+    help="Base URL of the TMDb API, to scan against a local stand-in",
+    default="https://api.themoviedb.org/3",
+)
+parser.add_argument(
+    "--scan-workers",
+    help="Workers of the scan stages, as STAGE=COUNT for parse (CPU processes), metadata and artwork (default: parse=CPU cores metadata=8 artwork=8)",
+    nargs="*",
+    metavar="STAGE=COUNT",
+)
 
 
 ARGUMENTS = parser.parse_args()
@@ -140,6 +224,40 @@ FFMPEG_ARGS: list = ARGUMENTS.ffmpeg_args or []
 if len(FFMPEG_ARGS) == 1:
     FFMPEG_ARGS = FFMPEG_ARGS[0].split(" ")
 
+SEGMENT_CACHE_SIZE: int = ARGUMENTS.segment_cache_size * 1024 * 1024
+
+TRANSCODE_SLOTS: int = ARGUMENTS.transcode_slots or max(2, (os.cpu_count() or 4) // 2)
+TRANSCODE_USER_SLOTS: int = ARGUMENTS.transcode_user_slots
+
+PREFETCH_SEGMENTS: int = ARGUMENTS.prefetch_segments
+
+PLAYBACK_STORE: str = ARGUMENTS.playback_store
+
+FAST_START: bool = ARGUMENTS.fast_start
+
+PRETRANSCODE_HOURS: tuple = tuple(
+    int(hour) for hour in ARGUMENTS.pretranscode_hours.split("-")
+)
+PRETRANSCODE_SIZE: int = ARGUMENTS.pretranscode_size * 1024 * 1024
+
+TRICKPLAY: bool = not ARGUMENTS.no_trickplay
+
+AUDIO_CACHE_SIZE: int = ARGUMENTS.audio_cache_size * 1024 * 1024
+
+TRACK_CACHE_SIZE: int = ARGUMENTS.track_cache_size * 1024 * 1024
+
+LIVE_TIMESHIFT: int = ARGUMENTS.live_timeshift * 60
+LIVE_RESTREAM: bool = ARGUMENTS.live_restream or LIVE_TIMESHIFT > 0
+
+SCAN_WORKERS: dict = {"parse": os.cpu_count() or 2, "metadata": 8, "artwork": 8}
+for stage_workers in ARGUMENTS.scan_workers or []:
+    stage, _, count = stage_workers.partition("=")
+    if stage not in SCAN_WORKERS or not count.isdigit() or int(count) < 1:
+        parser.error(f"invalid --scan-workers value: {stage_workers}")
+    SCAN_WORKERS[stage] = int(count)
+
+TMDB_URL: str = ARGUMENTS.tmdb_url.rstrip("/")
+
 
 def replace_path(path: str) -> str:
     return path.replace(
@@ -166,6 +284,8 @@ except PermissionError:
 
 VIDEO_CHUNK_LENGTH = 45
 AUDIO_CHUNK_LENGTH = 45
+# Seconds without any segment request before a transcode session is stopped
+TRANSCODE_SESSION_TIMEOUT = VIDEO_CHUNK_LENGTH * 3
 
 if os.getenv("NO_SCANS") == "true":
     ARGUMENTS.no_scans = True
@@ -250,7 +370,12 @@ def create_tmdb() -> TMDb:
     Returns:
         TMDb: The TMDb object
     """
-    tmdb = TMDb()
+    from .utils.tmdb_cache import TMDB_SESSION
+
+    # The session is shared by all the TMDb objects of tmdbv3api, its
+    # in-memory cache would bypass it
+    tmdb = TMDb(session=TMDB_SESSION)
+    tmdb.cache = False
     api_key_tmdb = config["APIKeys"]["TMDB"]
     if api_key_tmdb == "Empty":
         print(
@@ -27,6 +27,7 @@ from chocolate_app import (
     tmdb,
     config,
     ARGUMENTS,
+    TRICKPLAY,
     scans,
     get_language_file,
 )
@@ -39,6 +40,8 @@ from chocolate_app.tables import (
 )
 from chocolate_app.utils.utils import generate_log
 from chocolate_app.plugins_loader import events, routes
+from chocolate_app.transcode.pretranscode import PRETRANSCODER
+from chocolate_app.transcode.trickplay import TRICKPLAY_GENERATOR
 
 dir_path: str = get_dir_path()
 
@@ -221,6 +224,9 @@ def start_scanning_threads(app) -> None:
                 scanner = type_to_call[library["type"]]
                 scanner(library["name"])
 
+            if library["type"] in ["movies", "series", "others"]:
+                TRICKPLAY_GENERATOR.wake()
+
     class ScanEventHandler(FileSystemEventHandler):
 
         def __init__(self):
@@ -287,6 +293,12 @@ def start_chocolate() -> None:
     if not ARGUMENTS.no_scans and config["APIKeys"]["TMDB"] != "Empty":
         start_scanning_threads(app)
 
+    # Resume the pre-transcode jobs left by the previous run
+    PRETRANSCODER.start(app)
+
+    if TRICKPLAY:
+        TRICKPLAY_GENERATOR.start(app)
+
     app.run(host="0.0.0.0", port=SERVER_PORT)
     events.execute_event(events.Events.AFTER_START)
 
@@ -1,7 +1,11 @@
 import cv2
 import ffmpeg
 import mimetypes
-import os
+import subprocess
+
+from chocolate_app.utils.processes import PROCESSES, BACKGROUND_JOB
+
+RESIZE_TIMEOUT = 60 * 60
 
 
 def file_is_video(video_fn):
@@ -35,8 +39,13 @@ def resize(input, output, resize_width):
             stream = ffmpeg.filter(stream, "scale", w=resize_width, h="trunc(ow/a/2)*2")
         stream = ffmpeg.output(stream, output)
         try:
-            with open(os.devnull, "w") as devnull:
-                ffmpeg.run(stream, stdout=devnull, stderr=devnull)
+            PROCESSES.run(
+                ffmpeg.compile(stream),
+                BACKGROUND_JOB,
+                timeout=RESIZE_TIMEOUT,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
         except FileNotFoundError:
             raise Exception("ffmpeg not found, make sure ffmpeg is in the PATH")
     else:
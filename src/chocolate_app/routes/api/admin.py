@@ -0,0 +1,195 @@
+from typing import List, Tuple
+
+from flask import Blueprint, Response, current_app, request
+
+from chocolate_app import DB, PRETRANSCODE_HOURS, PRETRANSCODE_SIZE
+from chocolate_app.routes.api.auth import token_required
+from chocolate_app.routes.api.watch import get_media_library, get_media_slug
+from chocolate_app.tables import (
+    Episodes,
+    Libraries,
+    Movies,
+    OthersVideos,
+    PretranscodeJobs,
+    Series,
+)
+from chocolate_app.utils.utils import generate_response, Codes
+from chocolate_app.utils.http import HTTP
+from chocolate_app.utils.processes import PROCESSES
+from chocolate_app.utils.tmdb_cache import TMDB_CACHE
+from chocolate_app.transcode.probe import get_probe
+from chocolate_app.transcode.ladder import build_ladder, get_ladder
+from chocolate_app.transcode.pretranscode import (
+    OPTIMIZED_SEGMENTS,
+    PRETRANSCODER,
+    add_job,
+    delete_job,
+)
+
+admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
+
+# media type, media id, path
+MediaFile = Tuple[str, int, str]
+
+
+def get_library_files(library: Libraries) -> List[MediaFile] | None:
+    if library.type == "movies":
+        movies = Movies.query.filter_by(library_name=library.name).all()
+        return [("movie", movie.id, movie.slug) for movie in movies]
+    elif library.type == "series":
+        files = []
+        for serie in Series.query.filter_by(library_name=library.name).all():
+            episodes = Episodes.query.filter_by(serie_id=serie.tmdb_id).all()
+            files += [("show", episode.id, episode.slug) for episode in episodes]
+        return files
+    elif library.type == "others":
+        videos = OthersVideos.query.filter_by(library_name=library.name).all()
+        return [("other", video.id, video.slug) for video in videos]
+    return None
+
+
+def job_to_dict(job: PretranscodeJobs) -> dict:
+    return {
+        "id": job.id,
+        "media_type": job.media_type,
+        "media_id": job.media_id,
+        "quality": job.quality,
+        "status": job.status,
+        "progress": job.progress,
+        "total": job.total,
+        "error": job.error,
+    }
+
+
+@admin_bp.route("/pretranscode", methods=["GET"])
+@token_required
+def get_pretranscode_jobs(current_user) -> Response:
+    if not current_user.account_type == "Admin":
+        return generate_response(Codes.NOT_LOGGED_IN, True)
+
+    jobs = PretranscodeJobs.query.order_by(PretranscodeJobs.id).all()
+    start, end = PRETRANSCODE_HOURS
+
+    return generate_response(
+        Codes.SUCCESS,
+        False,
+        {
+            "jobs": [job_to_dict(job) for job in jobs],
+            "used_size": OPTIMIZED_SEGMENTS.total_size(),
+            "max_size": PRETRANSCODE_SIZE,
+            "idle_hours": f"{start}-{end}",
+        },
+    )
+
+
+@admin_bp.route("/pretranscode", methods=["POST"])
+@token_required
+def add_pretranscode_jobs(current_user) -> Response:
+    """
+    Queue the pre-transcode of a library or a single media. The body holds
+    either library_id or media_type and media_id, and optionally the
+    qualities to encode (the ladder of the library by default)
+    """
+    if not current_user.account_type == "Admin":
+        return generate_response(Codes.NOT_LOGGED_IN, True)
+
+    data = request.get_json(silent=True) or {}
+
+    if "library_id" in data:
+        library = Libraries.query.filter_by(id=data["library_id"]).first()
+        if not library:
+            return generate_response(Codes.LIBRARY_NOT_FOUND, True)
+        files = get_library_files(library)
+        if files is None:
+            return generate_response(Codes.INVALID_MEDIA_TYPE, True)
+        heights = get_ladder(library)
+    elif "media_type" in data and "media_id" in data:
+        path = get_media_slug(data["media_id"], data["media_type"])
+        if not path:
+            return generate_response(Codes.MEDIA_NOT_FOUND, True)
+        files = [(data["media_type"], int(data["media_id"]), path)]
+        heights = get_ladder(get_media_library(data["media_id"], data["media_type"]))
+    else:
+        return generate_response(Codes.MISSING_DATA, True)
+
+    if "qualities" in data:
+        heights = [int(quality) for quality in data["qualities"]]
+
+    jobs = []
+    for media_type, media_id, path in files:
+        # The same renditions as the master playlist, but the full size one
+        for rendition in build_ladder(get_probe(path), "default", heights)[:-1]:
+            jobs.append(add_job(media_type, media_id, path, rendition.quality))
+    DB.session.commit()
+
+    PRETRANSCODER.start(current_app._get_current_object())
+
+    return generate_response(Codes.SUCCESS, False, [job_to_dict(job) for job in jobs])
+
+
+@admin_bp.route("/pretranscode/<int:job_id>", methods=["DELETE"])
+@token_required
+def delete_pretranscode_job(current_user, job_id: int) -> Response:
+    if not current_user.account_type == "Admin":
+        return generate_response(Codes.NOT_LOGGED_IN, True)
+
+    job = PretranscodeJobs.query.filter_by(id=job_id).first()
+    if not job:
+        return generate_response(Codes.MISSING_DATA, True)
+
+    delete_job(job)
+    DB.session.commit()
+
+    return generate_response(Codes.SUCCESS)
+
+
+@admin_bp.route("/processes", methods=["GET"])
+@token_required
+def get_processes(current_user) -> Response:
+    if not current_user.account_type == "Admin":
+        return generate_response(Codes.NOT_LOGGED_IN, True)
+
+    return generate_response(Codes.SUCCESS, False, PROCESSES.get_processes())
+
+
+@admin_bp.route("/processes/<int:pid>", methods=["DELETE"])
+@token_required
+def kill_process(current_user, pid: int) -> Response:
+    if not current_user.account_type == "Admin":
+        return generate_response(Codes.NOT_LOGGED_IN, True)
+
+    # Only the processes started by the server can be killed
+    if not PROCESSES.kill_pid(pid):
+        return generate_response(Codes.MISSING_DATA, True)
+
+    return generate_response(Codes.SUCCESS)
+
+
+@admin_bp.route("/tmdb_cache", methods=["GET"])
+@token_required
+def get_tmdb_cache(current_user) -> Response:
+    if not current_user.account_type == "Admin":
+        return generate_response(Codes.NOT_LOGGED_IN, True)
+
+    return generate_response(Codes.SUCCESS, False, TMDB_CACHE.get_stats())
+
+
+@admin_bp.route("/tmdb_cache", methods=["DELETE"])
+@token_required
+def purge_tmdb_cache(current_user) -> Response:
+    if not current_user.account_type == "Admin":
+        return generate_response(Codes.NOT_LOGGED_IN, True)
+
+    # Only the responses of an endpoint with ?path=/movie/550
+    purged = TMDB_CACHE.purge(request.args.get("path"))
+
+    return generate_response(Codes.SUCCESS, False, {"purged": purged})
+
+
+@admin_bp.route("/http", methods=["GET"])
+@token_required
+def get_http_stats(current_user) -> Response:
+    if not current_user.account_type == "Admin":
+        return generate_response(Codes.NOT_LOGGED_IN, True)
+
+    return generate_response(Codes.SUCCESS, False, HTTP.get_stats())
@@ -17,6 +17,7 @@ auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
 ACCESS_TOKEN_EXPIRATION = 24 * 30  # 30 days
 REFRESH_TOKEN_EXPIRATION = 24 * 30 * 6  # approximatively 6 months
+URL_TOKEN_EXPIRATION = 12  # hours, long enough to finish a paused movie
 
 
 def image_to_base64(
@@ -74,6 +75,67 @@ def token_required(f):
     return decorated
 
 
+def sign_url(current_user, path: str) -> str:
+    """
+    Add a token to the url of a media, for the players that load it without
+    the Authorization header, like the video and audio elements. The token is
+    only valid for this url
+
+    Args:
+        current_user (Users): The user the url is for
+        path (str): The path of the url
+
+    Returns:
+        str: The url with its token
+    """
+    url_token = jwt.encode(
+        {
+            "id": current_user.id,
+            "path": path,
+            "exp": datetime.datetime.utcnow()
+            + datetime.timedelta(hours=URL_TOKEN_EXPIRATION),
+        },
+        current_app.config["SECRET_KEY"],
+    )
+    return f"{path}?token={url_token}"
+
+
+def url_token_required(f):
+    """
+    Like token_required, but the token can also be given in the url by
+    sign_url
+    """
+
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if "Authorization" in request.headers or "token" not in request.args:
+            return token_required(f)(*args, **kwargs)
+
+        try:
+            data = jwt.decode(
+                request.args["token"],
+                current_app.config["SECRET_KEY"],
+                algorithms=["HS256"],
+            )
+            current_user = Users.query.filter_by(id=data["id"]).first()
+        except Exception:
+            return generate_response(Codes.INVALID_TOKEN, True)
+
+        # The access tokens and the tokens of the other urls are refused
+        if data.get("path") != request.path:
+            return generate_response(Codes.INVALID_TOKEN, True)
+
+        if not current_user:
+            return generate_response(Codes.USER_NOT_FOUND, True)
+
+        if "current_user" in f.__code__.co_varnames:
+            return f(current_user, *args, **kwargs)
+        else:
+            return f(*args, **kwargs)
+
+    return decorated
+
+
 @auth_bp.route("/check", methods=["GET", "POST"])
 @token_required
 def check_auth(current_user):
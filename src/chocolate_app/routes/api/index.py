@@ -2,6 +2,7 @@ from flask import Blueprint
 
 
 from chocolate_app.routes.api.auth import auth_bp
+from chocolate_app.routes.api.admin import admin_bp
 from chocolate_app.routes.api.watch import watch_bp
 from chocolate_app.routes.api.libraries import lib_bp
 from chocolate_app.routes.api.profil import profil_bp
@@ -16,3 +17,4 @@ api_bp.register_blueprint(watch_bp)
 api_bp.register_blueprint(settings_bp)
 api_bp.register_blueprint(profil_bp)
 api_bp.register_blueprint(lib_bp)
+api_bp.register_blueprint(admin_bp)
@@ -29,17 +29,18 @@ def refresh(current_user, lib_id):
         "musics": scans.getMusics,
     }
 
+    # A manual refresh goes through every file again, not only the changes
     scanner = None
     if library["type"] == "movies":
         scanner = scans.MovieScanner()
         scanner.set_library_name(library["name"])
-        scanner.scan()
+        scanner.scan(full=True)
     elif library["type"] == "tv":
         scanner = scans.LiveTVScanner()
         scanner.set_library_name(library["name"])
         scanner.scan()
     else:
         scanner = type_to_call[library["type"]]
-        scanner(library["name"])
+        scanner(library["name"], full=True)
 
     return generate_response(Codes.SUCCESS, False, {"message": "Library refreshed"})
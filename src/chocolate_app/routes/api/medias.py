@@ -9,10 +9,11 @@ from PIL import Image
 from io import BytesIO
 from operator import itemgetter
 from typing import Any, Dict, List
-from chocolate_app import get_language_file
+from chocolate_app import get_language_file, LIVE_RESTREAM, LIVE_TIMESHIFT
 from chocolate_app.routes.api.auth import token_required
 from flask import Blueprint, request, Response, abort, send_file
 from chocolate_app.utils.utils import generate_response, Codes, translate
+from chocolate_app.utils.single_flight import SingleFlight
 
 from chocolate_app.tables import (
     TVChannels,
@@ -36,6 +37,9 @@ medias_bp = Blueprint("medias", __name__, url_prefix="/medias")
 
 LANGUAGE_FILE = get_language_file()
 
+# The covers of a page are requested by every client loading it at once
+RESIZE_FLIGHTS = SingleFlight()
+
 
 def extract_sibling_episodes(episode, main_season):
     previous = None
@@ -388,9 +392,15 @@ def tv_to_media(channel_id) -> Dict[str, Any] | None:
 
     previous, next = get_sibling_channels(channel_id)
 
+    source = channel.slug
+    if LIVE_RESTREAM:
+        source = f"/api/watch/live/{channel.id}.m3u8"
+
     media = {
         "id": f"{channel.id}",
-        "_source": channel.slug,
+        "_source": source,
+        # Seconds of the channel the player can seek back to
+        "_timeshift": LIVE_TIMESHIFT if LIVE_RESTREAM else 0,
         "_epg": get_current_program(channel_id),
         "title": channel.name,
         "alternatives_titles": [channel.name],
@@ -818,6 +828,27 @@ def get_tv_media(current_user) -> Response:
     return generate_response(Codes.SUCCESS, False, data)
 
 
+def resize_image(path: str, width: str | None, height: str | None) -> bytes:
+    """
+    Resize an image to a width, or else to a height, keeping its ratio
+
+    Returns:
+        bytes: The resized image, in WebP
+    """
+    image = Image.open(path)
+    if width:
+        wpercent = int(width) / float(image.size[0])
+        hsize = int((float(image.size[1]) * float(wpercent)))
+        image = image.resize((int(width), hsize), Image.ANTIALIAS)  # type: ignore
+    else:
+        hpercent = int(height) / float(image.size[1])
+        wsize = int((float(image.size[0]) * float(hpercent)))
+        image = image.resize((wsize, int(height)), Image.ANTIALIAS)  # type: ignore
+    img_io = BytesIO()
+    image.save(img_io, "WEBP")
+    return img_io.getvalue()
+
+
 @medias_bp.route("/images/<image_type>/<media_type>/<media_id>", methods=["GET"])
 def get_image(image_type: str, media_type: str, media_id: int) -> Response:
     image = None
@@ -918,26 +949,12 @@ def get_image(image_type: str, media_type: str, media_id: int) -> Response:
     }
 
     width = request.args.get("width")
-    if width:
-        image = Image.open(image)
-        wpercent = int(width) / float(image.size[0])
-        hsize = int((float(image.size[1]) * float(wpercent)))
-        image = image.resize((int(width), hsize), Image.ANTIALIAS)  # type: ignore
-        img_io = BytesIO()
-        image.save(img_io, "WEBP")
-        img_io.seek(0)
-        return send_file(img_io, mimetype=mime_type.get(extension, "image/webp"))
-
     height = request.args.get("height")
-    if height:
-        image = Image.open(image)
-        hpercent = int(height) / float(image.size[1])
-        wsize = int((float(image.size[0]) * float(hpercent)))
-        image = image.resize((wsize, int(height)), Image.ANTIALIAS)  # type: ignore
-        img_io = BytesIO()
-        image.save(img_io, "WEBP")
-        img_io.seek(0)
-        return send_file(img_io, mimetype=mime_type.get(extension, "image/webp"))
+    if width or height:
+        data = RESIZE_FLIGHTS.do(
+            (image, width, height), resize_image, image, width, height
+        )
+        return send_file(BytesIO(data), mimetype=mime_type.get(extension, "image/webp"))
 
     try:
         return send_file(image, mimetype=mime_type.get(extension, "image/jpeg"))
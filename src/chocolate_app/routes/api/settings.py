@@ -153,6 +153,7 @@ def handle_libraries_settings(method) -> Response:
                     "name": library.name,
                     "path": library.folder,
                     "type": library.type,
+                    "ladder": library.ladder,
                 }
             )
 
@@ -182,6 +183,17 @@ def handle_libraries_settings(method) -> Response:
         if "path" in data:
             library.folder = data["path"]
 
+        # The heights of the renditions, for example "480,720,1080"
+        if "ladder" in data:
+            heights = [
+                height.strip()
+                for height in str(data["ladder"] or "").split(",")
+                if height.strip()
+            ]
+            if not all(height.isdigit() for height in heights):
+                return generate_response(Codes.LIBRARY_NOT_UPDATED, True)
+            library.ladder = ",".join(heights) or None
+
         DB.session.commit()
 
         return generate_response(Codes.SUCCESS)
@@ -1,13 +1,20 @@
 import os
+import math
+import queue
 import datetime
 import pycountry
+import threading
 import subprocess
 
-from typing import Any, Dict
-from videoprops import get_video_properties
-from flask import Blueprint, make_response, request, Response, abort
+from functools import partial
+from typing import Any, Callable, Generator, List
+from flask import Blueprint, make_response, request, Response, abort, send_file
 
-from chocolate_app.routes.api.auth import token_required
+from chocolate_app.routes.api.auth import (
+    token_required,
+    url_token_required,
+    sign_url,
+)
 from chocolate_app.tables import (
     OthersVideos,
     Movies,
@@ -15,26 +22,86 @@ from chocolate_app.tables import (
     Games,
     Books,
     Episodes,
+    Libraries,
     MediaPlayed,
     Series,
     Seasons,
+    Tracks,
     TVChannels,
 )
 from chocolate_app import (
     DB,
-    VIDEO_CHUNK_LENGTH,
-    AUDIO_CHUNK_LENGTH,
-    FFMPEG_ARGS,
-    VIDEO_CODEC,
-    ARTEFACTS_PATH,
+    LIVE_RESTREAM,
+    PREFETCH_SEGMENTS,
 )
 from chocolate_app.utils.utils import (
     generate_response,
     Codes,
-    length_video,
     get_chunk_user_token,
     hash_string,
 )
+from chocolate_app.utils.processes import PROCESSES, PREFETCH_JOB
+from chocolate_app.utils.single_flight import SingleFlight
+from chocolate_app.transcode.segment_cache import SEGMENT_CACHE
+from chocolate_app.transcode.pretranscode import OPTIMIZED_SEGMENTS
+from chocolate_app.transcode.sessions import (
+    TRANSCODE_SESSIONS,
+    SEGMENT_WAIT_TIMEOUT,
+    STREAM_CHUNK_SIZE,
+    TranscodeSession,
+)
+from chocolate_app.transcode.scheduler import (
+    TRANSCODE_SCHEDULER,
+    TranscodeBusy,
+    TranscodeSlot,
+    RETRY_AFTER,
+    PREFETCH,
+)
+from chocolate_app.transcode.prefetch import PREFETCHER
+from chocolate_app.transcode.playback_state import PLAYBACK_STATES
+from chocolate_app.transcode.keyframes import get_segments, Segment
+from chocolate_app.transcode.ladder import build_ladder, get_ladder
+from chocolate_app.transcode.segmenter import (
+    video_segmenter_command,
+    video_cache_key,
+    audio_cache_key,
+    audio_chunk_command,
+)
+from chocolate_app.transcode.subtitles import get_subtitle_file, get_subtitle_segment
+from chocolate_app.transcode.live import LIVE_RELAYS
+from chocolate_app.transcode.audio_renditions import (
+    AUDIO_RENDITION_ENCODER,
+    AUDIO_CODEC,
+    get_audio_rendition,
+    get_chunk_tag,
+    read_rendition_segment,
+)
+from chocolate_app.transcode.tracks import (
+    TRACK_FORMATS,
+    get_track_format,
+    get_track_file,
+    get_next_tracks,
+    prefetch_tracks,
+)
+from chocolate_app.transcode.trickplay import (
+    get_trickplay,
+    get_trickplay_track,
+    get_sprite_path,
+)
+from chocolate_app.transcode.probe import (
+    get_probe,
+    get_duration,
+    get_audio_streams,
+    get_subtitle_streams,
+)
+from chocolate_app.transcode.decision import (
+    ClientCapabilities,
+    get_client_capabilities,
+    decide_playback,
+    decide_track_playback,
+    DIRECT_PLAY,
+    TRANSCODE,
+)
 from chocolate_app.routes.api.medias import (
     movie_to_media,
     episode_to_media,
@@ -45,17 +112,168 @@ from chocolate_app.routes.api.medias import (
 
 watch_bp = Blueprint("watch", __name__, url_prefix="/watch")
 
-LOG_LEVEL = "error"
+# The segments being encoded for a request, by cache key
+SEGMENT_FLIGHTS = SingleFlight()
 
 
-class PreviousLagInfo:
-    def __init__(self, lag: float | int, lag_id: int) -> None:
-        self.lag = lag
-        self.lag_id = lag_id
+@watch_bp.errorhandler(TranscodeBusy)
+def transcode_busy(error: TranscodeBusy) -> Response:
+    response = generate_response(Codes.TRANSCODE_BUSY, True)
+    response.status_code = 503
+    response.headers.set("Retry-After", str(RETRY_AFTER))
+    return response
+
 
+def get_session_group(media_type: str, media_id: int) -> str:
+    """
+    Identify a viewer watching a media, the same for the video and the audio
+    chunks of a player
+    """
+    token = get_chunk_user_token(request)
+    ip = request.remote_addr
+    user_agent = request.headers.get("User-Agent")
 
-VIDEO_PREVIOUS_LAG: Dict[str, PreviousLagInfo] = {}
-AUDIO_PREVIOUS_LAG: Dict[str, PreviousLagInfo] = {}
+    return hash_string(f"{token}-{ip}-{user_agent}-{media_type}-{media_id}")
+
+
+def get_transcode_owner() -> str:
+    """
+    Identify the user a transcode is made for, the chunk requests of a player
+    all carry the same token
+    """
+    return hash_string(request.headers.get("Authorization") or request.remote_addr)
+
+
+def cache_process(
+    pipe: subprocess.Popen,
+    first_chunk: bytes,
+    slot: TranscodeSlot,
+    cache_key: str,
+    chunks: queue.Queue,
+    on_cached: Callable[[], None] | None = None,
+) -> None:
+    """
+    Store the output of ffmpeg in the segment cache and pass it to the request
+    sending it, ending with None. on_cached is called once the segment is
+    cached, or once ffmpeg has failed
+    """
+    writer = SEGMENT_CACHE.writer(cache_key)
+    completed = False
+    try:
+        data = first_chunk
+        while data:
+            writer.write(data)
+            chunks.put(data)
+            data = pipe.stdout.read1(STREAM_CHUNK_SIZE)
+        completed = pipe.wait() == 0
+    finally:
+        PROCESSES.kill(pipe)
+        slot.release()
+        if completed:
+            writer.commit()
+        else:
+            writer.discard()
+        chunks.put(None)
+        if on_cached:
+            on_cached()
+
+
+def stream_process(
+    pipe: subprocess.Popen,
+    first_chunk: bytes,
+    slot: TranscodeSlot,
+    cache_key: str | None = None,
+    on_cached: Callable[[], None] | None = None,
+) -> Generator[bytes, None, None]:
+    """
+    Forward the output of ffmpeg as it is produced, its transcode slot is
+    released once it has exited
+
+    With a cache key, the output is stored in the segment cache by a thread,
+    at the pace of ffmpeg rather than of the client, and ffmpeg goes on if the
+    client disconnects. Without, ffmpeg is killed if the client disconnects
+    """
+    if cache_key:
+        chunks: queue.Queue = queue.Queue()
+        threading.Thread(
+            target=cache_process,
+            args=(pipe, first_chunk, slot, cache_key, chunks, on_cached),
+            daemon=True,
+        ).start()
+        while True:
+            data = chunks.get()
+            if data is None:
+                return
+            yield data
+
+    try:
+        data = first_chunk
+        while data:
+            yield data
+            data = pipe.stdout.read1(STREAM_CHUNK_SIZE)
+        pipe.wait()
+    finally:
+        PROCESSES.kill(pipe)
+        slot.release()
+
+
+def send_segment_once(
+    cache_key: str,
+    get_cached: Callable[[str], str | None],
+    mimetype: str,
+    encode: Callable[[Callable[[], None]], Response],
+) -> Response:
+    """
+    Send a segment that isn't cached yet, the players reaching the same segment
+    at once wait for a single encode and are sent its cached result as soon as
+    it is cached, while the first player may still be receiving it
+
+    Args:
+        cache_key (str): The cache key of the segment
+        get_cached (Callable[[str], str | None]): Get the cached segment
+        mimetype (str): The mimetype of the segment
+        encode (Callable[[Callable[[], None]], Response]): Encode the segment
+            and stream it, calling the given function once it is cached or
+            has failed
+
+    Returns:
+        Response: The segment
+    """
+    flight, leader = SEGMENT_FLIGHTS.join(cache_key)
+    if not leader:
+        flight.wait(SEGMENT_WAIT_TIMEOUT)
+        segment_path = get_cached(cache_key)
+        if segment_path:
+            return send_file(segment_path, mimetype=mimetype)
+        # The encode of the other request failed or was cancelled
+        return encode(lambda: None)
+
+    on_cached = partial(SEGMENT_FLIGHTS.finish, cache_key, flight=flight)
+    try:
+        return encode(on_cached)
+    except BaseException:
+        on_cached()
+        raise
+
+
+def cache_session_segment(
+    session: TranscodeSession,
+    idx: int,
+    cache_key: str,
+    on_cached: Callable[[], None],
+) -> None:
+    """
+    Store a segment of a session in the cache as soon as ffmpeg has written
+    it, whatever the pace of the client streaming it
+    """
+    try:
+        if session.wait_for_segment_end(idx, SEGMENT_WAIT_TIMEOUT):
+            SEGMENT_CACHE.put_file(cache_key, session.segment_path(idx))
+    except OSError:
+        # The session has been closed meanwhile
+        pass
+    finally:
+        on_cached()
 
 
 def set_media_played(
@@ -89,7 +307,7 @@ def set_media_played(
         media_played.serie_id = (
             Series.query.filter_by(tmdb_id=episode_data.serie_id).first().id
         )
-        media_duration = length_video(episode_data.slug)
+        media_duration = get_duration(episode_data.slug)
         if duration > media_duration * 0.9:
             # create a new entry in the table MediaPlayed for the next episode
             if not Episodes.query.filter_by(
@@ -128,6 +346,22 @@ def set_media_played(
     DB.session.commit()
 
 
+def get_start_position() -> float:
+    """
+    Get the position the playback starts at, it is passed from the master
+    playlist to the media playlists and the segments so they all share the
+    same segments
+    """
+    try:
+        return max(0.0, float(request.args.get("start", 0)))
+    except ValueError:
+        return 0.0
+
+
+def start_query(start: float) -> str:
+    return f"?start={start:g}" if start else ""
+
+
 def get_media_slug(media_id: int, media_type: str) -> str | None:
     if media_type == "show":
         return Episodes.query.filter_by(id=media_id).first().slug
@@ -144,7 +378,25 @@ def get_media_slug(media_id: int, media_type: str) -> str | None:
     return None
 
 
-def generate_m3u8(media: Any) -> Response:
+def get_media_library(media_id: int, media_type: str) -> Libraries | None:
+    media = None
+    if media_type == "show":
+        episode = Episodes.query.filter_by(id=media_id).first()
+        if not episode:
+            return None
+        # The episodes point to the TMDb id of their series
+        media = Series.query.filter_by(tmdb_id=episode.serie_id).first()
+    elif media_type == "movie":
+        media = Movies.query.filter_by(id=media_id).first()
+    elif media_type == "other":
+        media = OthersVideos.query.filter_by(id=media_id).first()
+    library_name = media.library_name if media else None
+    if not library_name:
+        return None
+    return Libraries.query.filter_by(name=library_name).first()
+
+
+def generate_m3u8(media: Any, capabilities: ClientCapabilities) -> Response:
     media_id = media["id"]
     media_type = media["type"]
 
@@ -153,46 +405,35 @@ def generate_m3u8(media: Any) -> Response:
     if not video_path:
         return generate_response(Codes.MEDIA_NOT_FOUND, True)
 
-    video_properties = get_video_properties(video_path)
-    height = int(video_properties["height"])
-    width = int(video_properties["width"])
+    probe = get_probe(video_path)
+    # The full quality variant copies the video stream when the client can read it
+    full_quality = "default"
+    if decide_playback(video_path, probe, capabilities) != TRANSCODE:
+        full_quality = "copy"
+    ladder = build_ladder(
+        probe, full_quality, get_ladder(get_media_library(media_id, media_type))
+    )
+    # The player resumes where the user left off
+    start = media.get("last_duration") or 0
+    if start >= (probe.duration or 0):
+        start = 0
+    query = start_query(start)
     m3u8_file = "#EXTM3U\n#EXT-X-VERSION:3\n"
 
-    m3u8_file += generate_caption_media(video_path, media_id, media_type) + "\n"
+    m3u8_file += generate_caption_media(video_path, media_id, media_type, query) + "\n"
     audio = "\n"
-    audio = generate_audio_streams_media(video_path, media_id, media_type)
+    audio = generate_audio_streams_media(video_path, media_id, media_type, query)
     audio += "\n"
     m3u8_file += audio
-    qualities = [144, 240, 360, 480, 720, 1080]
-    quality_to_codec = {
-        144: "avc1.6e000c",
-        240: "avc1.6e0015",
-        360: "avc1.6e001e",
-        480: "avc1.6e001f",
-        720: "avc1.6e0020",
-        1080: "avc1.6e0032",
-    }
 
     file = []
-    for quality in qualities:
-        if quality < height:
-            new_width = int(quality)
-            new_height = int(float(width) / float(height) * new_width)
-            new_height += new_height % 2
-            m3u8_line = f"#EXT-X-STREAM-INF:BANDWIDTH={int((new_width*new_height)/4)},"
-
-            m3u8_line += f'CODECS="{quality_to_codec[int(quality)]}",RESOLUTION={new_height}x{new_width},SUBTITLES="subs",AUDIO="audio"\n/api/watch/video_media/{quality}/{media_type}/{media_id}.m3u8\n'
-            file.append(m3u8_line)
-    last_line = f"#EXT-X-STREAM-INF:BANDWIDTH={int((width*height)/4)},"
-
-    codec = "avc1.6e0033"
-
-    if height in quality_to_codec:
-        codec = quality_to_codec[height]
-
-    last_line += f'CODECS="{codec}",RESOLUTION={width}x{height},SUBTITLES="subs",AUDIO="audio"\n/api/watch/video_media/default/{media_type}/{media_id}.m3u8'
-    file.append(last_line)
-    file_str = "".join(file)
+    for rendition in ladder:
+        m3u8_line = f"#EXT-X-STREAM-INF:BANDWIDTH={rendition.bandwidth},AVERAGE-BANDWIDTH={rendition.average_bandwidth},"
+        if probe.frame_rate:
+            m3u8_line += f"FRAME-RATE={probe.frame_rate:.3f},"
+        m3u8_line += f'CODECS="{rendition.codec},{AUDIO_CODEC}",RESOLUTION={rendition.width}x{rendition.height},SUBTITLES="subs",AUDIO="audio"\n/api/watch/video_media/{rendition.quality}/{media_type}/{media_id}.m3u8{query}'
+        file.append(m3u8_line)
+    file_str = "\n".join(file)
     m3u8_file += file_str
     response = make_response(m3u8_file)
 
@@ -208,63 +449,28 @@ def generate_m3u8(media: Any) -> Response:
 
 
 def generate_caption_media(
-    video_path: str, media_id: int | str, media_type: str
+    video_path: str, media_id: int | str, media_type: str, query: str = ""
 ) -> str:
-    caption_command = [
-        "ffprobe",
-        "-loglevel",
-        "error",
-        "-select_streams",
-        "s",
-        "-show_entries",
-        "stream=index:stream_tags=language",
-        "-of",
-        "csv=p=0",
-        video_path,
-    ]
-    caption_pipe = subprocess.Popen(caption_command, stdout=subprocess.PIPE)
-
-    if not caption_pipe or not caption_pipe.stdout:
-        abort(404)
-
-    caption_response = caption_pipe.stdout.read().decode("utf-8")
-    caption_response = caption_response.split("\n")
-
     all_captions = []
 
-    caption_response.pop()
-
-    for line in caption_response:
-        line = line.rstrip()
-        language = line.split(",")[1]
+    for stream in get_subtitle_streams(video_path):
+        index = stream["index"]
+        language = stream["language"] or "und"
         new_language = pycountry.languages.get(alpha_2=language)
-        index = line.split(",")[0]
-        try:
-            title_name = line.split(",")[2]
-
-            try:
-                title_name = title_name.split(" : ")[0]
-                subtitle_type = title_name.split(" : ")[1]
-            except Exception:
-                title_name = title_name
-                subtitle_type = "Unknown"
-
-        except Exception:
-            title_name = new_language
-        subtitle_type = "Unknown"
-        if subtitle_type.lower() != "pgs":
-            if not new_language:
-                new_language = language
-
-            all_captions.append(
-                {
-                    "index": index,
-                    "languageCode": language,
-                    "language": new_language,
-                    "url": f"/api/watch/caption/{media_id}_{media_type}_{index}.m3u8",
-                    "name": title_name,
-                }
-            )
+        if new_language is not None and new_language.name is not None:
+            new_language = new_language.name
+        else:
+            new_language = language
+
+        all_captions.append(
+            {
+                "index": index,
+                "languageCode": language,
+                "language": new_language,
+                "url": f"/api/watch/caption/{media_id}_{media_type}_{index}.m3u8{query}",
+                "name": stream["title"] or new_language,
+            }
+        )
 
     string = ""
     for caption in all_captions:
@@ -280,9 +486,16 @@ def caption(media_id: int, media_type: str, id: int) -> Response:
     if not video_path:
         return generate_response(Codes.MEDIA_NOT_FOUND, True)
 
-    movie_duration = length_video(video_path) + 1
+    start = get_start_position()
+    segments = get_segments(video_path, start)
+    query = start_query(start)
 
-    m3u8_content = f"#EXTM3U\n#EXT-X-TARGETDURATION:{movie_duration}\n#EXT-X-VERSION:3\n\n#EXT-X-PLAYLIST-TYPE:VOD\n#EXTINF:{movie_duration},\n/api/watch/chunk_caption/{media_id}_{media_type}_{id}.vtt\n#EXT-X-ENDLIST"
+    m3u8_content = f"#EXTM3U\n#EXT-X-TARGETDURATION:{target_duration(segments)}\n#EXT-X-VERSION:3\n#EXT-X-MEDIA-SEQUENCE:1\n#EXT-X-PLAYLIST-TYPE:VOD\n"
+
+    for idx, (segment_start, end) in enumerate(segments, start=1):
+        m3u8_content += f"#EXTINF:{round(end - segment_start, 6)},\n/api/watch/chunk_caption/{media_id}_{media_type}_{id}/{idx}.vtt{query}\n"
+
+    m3u8_content += "#EXT-X-ENDLIST"
 
     response = make_response(m3u8_content)
     response.headers.set("Content-Type", "vnd.apple.mpegURL")
@@ -299,89 +512,163 @@ def caption(media_id: int, media_type: str, id: int) -> Response:
 
 
 @watch_bp.route("/chunk_caption/<media_id>_<media_type>_<id>.vtt", methods=["GET"])
-def chunk_caption(media_id: int, media_type: str, id: int) -> Response:
+def full_caption(media_id: int, media_type: str, id: int) -> Response:
     video_path = get_media_slug(media_id, media_type)
 
-    command = [
-        "ffmpeg",
-        "-hide_banner",
-        "-loglevel",
-        LOG_LEVEL,
-        "-i",
-        video_path,
-        "-map",
-        f"0:{id}",
-        "-f",
-        "webvtt",
-        "-",
-    ]
-
-    pipe = subprocess.Popen(command, stdout=subprocess.PIPE)
-
-    if not pipe or not pipe.stdout:
+    if not video_path:
         abort(404)
 
-    data = pipe.stdout.read()
+    subtitle_path = get_subtitle_file(video_path, int(id), get_transcode_owner())
+    if not subtitle_path:
+        abort(404)
+
+    response = send_file(
+        subtitle_path,
+        mimetype="text/vtt",
+        download_name=f"{media_id}_{media_type}_{id}.vtt",
+        as_attachment=True,
+    )
+    response.headers.set("Access-Control-Allow-Origin", "*")
+
+    return response
 
-    response = make_response(data)
+
+@watch_bp.route(
+    "/chunk_caption/<media_id>_<media_type>_<id>/<int:idx>.vtt", methods=["GET"]
+)
+def chunk_caption(media_id: int, media_type: str, id: int, idx: int) -> Response:
+    video_path = get_media_slug(media_id, media_type)
+
+    if not video_path:
+        abort(404)
+
+    segments = get_segments(video_path, get_start_position())
+    if idx < 1 or idx > len(segments):
+        abort(404)
+
+    subtitle_path = get_subtitle_file(video_path, int(id), get_transcode_owner())
+    if not subtitle_path:
+        abort(404)
+
+    response = make_response(get_subtitle_segment(subtitle_path, segments[idx - 1]))
     response.headers.set("Content-Type", "text/vtt")
-    response.headers.set("Range", "bytes=0-4095")
-    response.headers.set("Accept-Encoding", "*")
     response.headers.set("Access-Control-Allow-Origin", "*")
     response.headers.set(
         "Content-Disposition",
         "attachment",
-        filename=f"{media_id}_{media_type}_{id}.vtt",
+        filename=f"{media_id}_{media_type}_{id}_{idx}.vtt",
     )
 
     return response
 
 
-def generate_audio_streams_media(
-    movie_path: str, media_id: int | str, media_type: str
-) -> str:
-    caption_command = [
-        "ffprobe",
-        "-loglevel",
-        "error",
-        "-show_streams",
-        "-select_streams",
-        "a",
-        "-show_entries",
-        "stream=index,codec_name,channels:stream_tags=language,title,handler_name,codec_name",
-        "-of",
-        "csv=p=0",
-        movie_path,
-    ]
-
-    audio_stream_pipe = subprocess.Popen(caption_command, stdout=subprocess.PIPE)
-
-    if not audio_stream_pipe or not audio_stream_pipe.stdout:
+@watch_bp.route("/trickplay/<media_type>/<int:media_id>.vtt", methods=["GET"])
+def trickplay_track(media_type: str, media_id: int) -> Response:
+    """The WebVTT thumbnail track of the seek preview"""
+    if media_type not in ["show", "movie", "other"]:
+        abort(404)
+
+    video_path = get_media_slug(media_id, media_type)
+
+    if not video_path:
+        abort(404)
+
+    # Generated in the background after the scans
+    manifest = get_trickplay(video_path)
+    if not manifest:
+        abort(404)
+
+    sprite_url = f"/api/watch/trickplay/{media_type}/{media_id}/{{}}.jpg"
+    response = make_response(get_trickplay_track(manifest, sprite_url))
+    response.headers.set("Content-Type", "text/vtt")
+    response.headers.set("Access-Control-Allow-Origin", "*")
+
+    return response
+
+
+@watch_bp.route(
+    "/trickplay/<media_type>/<int:media_id>/<int:sprite>.jpg", methods=["GET"]
+)
+def trickplay_sprite(media_type: str, media_id: int, sprite: int) -> Response:
+    if media_type not in ["show", "movie", "other"]:
+        abort(404)
+
+    video_path = get_media_slug(media_id, media_type)
+
+    if not video_path:
+        abort(404)
+
+    sprite_path = get_sprite_path(video_path, sprite)
+    if not os.path.exists(sprite_path):
         abort(404)
 
-    audio_stream_response = audio_stream_pipe.stdout.read().decode("utf-8")
-    audio_stream_response = audio_stream_response.split("\n")
-    audio_stream_response.pop()
+    response = send_file(sprite_path, mimetype="image/jpeg")
+    response.headers.set("Access-Control-Allow-Origin", "*")
+
+    return response
+
+
+@watch_bp.route("/live/<int:channel_id>.m3u8", methods=["GET"])
+def live_playlist(channel_id: int) -> Response:
+    """The rolling playlist of a live channel relayed by the server"""
+    if not LIVE_RESTREAM:
+        abort(404)
 
+    channel = TVChannels.query.filter_by(id=channel_id).first()
+    if not channel:
+        abort(404)
+
+    viewer = get_session_group("live-tv", channel_id)
+    relay = LIVE_RELAYS.join(channel_id, channel.slug, viewer)
+    if not relay:
+        abort(502)
+
+    playlist = relay.get_playlist(f"/api/watch/live/{channel_id}/{{}}")
+    if playlist is None:
+        abort(502)
+
+    response = make_response(playlist)
+    response.headers.set("Content-Type", "vnd.apple.mpegURL")
+    response.headers.set("Cache-Control", "no-cache")
+    response.headers.set("Access-Control-Allow-Origin", "*")
+
+    return response
+
+
+@watch_bp.route("/live/<int:channel_id>/<name>", methods=["GET"])
+def live_segment(channel_id: int, name: str) -> Response:
+    relay = LIVE_RELAYS.get_relay(channel_id)
+    if not relay:
+        abort(404)
+
+    relay.add_viewer(get_session_group("live-tv", channel_id))
+
+    segment_path = relay.segment_path(name)
+    if not segment_path or not os.path.exists(segment_path):
+        abort(404)
+
+    response = send_file(segment_path, mimetype="video/MP2T")
+    response.headers.set("Access-Control-Allow-Origin", "*")
+
+    return response
+
+
+def generate_audio_streams_media(
+    movie_path: str, media_id: int | str, media_type: str, query: str = ""
+) -> str:
     audio_streams = []
 
-    for line in audio_stream_response:
-        line = line.rstrip().split(",")
-        id = int(line[0]) - 1
-        codec = line[1]
-        channels = line[2]
-        language = line[-1]
+    for id, stream in enumerate(get_audio_streams(movie_path)):
+        language = stream["language"] or "und"
         new_language = pycountry.languages.get(alpha_2=language)
         if new_language is not None and new_language.name is not None:
             language = new_language.name
 
-        type = line[-2]
         audio_stream_object = {
             "id": id,
-            "codec": codec,
             "language": language,
-            "type": type,
-            "channels": channels,
+            "type": stream["title"] or "Unknown",
+            "channels": stream["channels"],
         }
         audio_streams.append(audio_stream_object)
 
@@ -389,18 +676,19 @@ def generate_audio_streams_media(
     for audio_stream in audio_streams:
         audio_stream_id = audio_stream["id"]
         audio_stream_language = audio_stream["language"]
-        audio_stream_codec = audio_stream["codec"]
         audio_stream_type = audio_stream["type"]
         # audio_stream_channels = audio_stream["channels"]
         audio_stream_channels = 2
-        audio_stream_url = (
-            f"/api/watch/audio_media/{audio_stream_id}/{media_type}/{media_id}.m3u8"
-        )
-        audio_stream_string += f'#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio",CHANNELS="{audio_stream_channels}",NAME="{audio_stream_language} ({audio_stream_type})",DEFAULT=NO,AUTOSELECT=YES,URI="{audio_stream_url}",LANGUAGE="{audio_stream_language}",CODECS="{audio_stream_codec}"\n'
+        audio_stream_url = f"/api/watch/audio_media/{audio_stream_id}/{media_type}/{media_id}.m3u8{query}"
+        audio_stream_string += f'#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio",CHANNELS="{audio_stream_channels}",NAME="{audio_stream_language} ({audio_stream_type})",DEFAULT=NO,AUTOSELECT=YES,URI="{audio_stream_url}",LANGUAGE="{audio_stream_language}",CODECS="{AUDIO_CODEC}"\n'
 
     return audio_stream_string
 
 
+def target_duration(segments: List[Segment]) -> int:
+    return math.ceil(max(end - start for start, end in segments))
+
+
 @watch_bp.route(
     "/video_media/<quality>/<media_type>/<int:media_id>.m3u8", methods=["GET"]
 )
@@ -410,18 +698,16 @@ def video_media(quality: str, media_type: str, media_id: int) -> Response:
     if not video_path:
         return generate_response(Codes.MEDIA_NOT_FOUND, True)
 
-    duration = length_video(video_path)
-
-    file = f"#EXTM3U\n#EXT-X-VERSION:3\n\n#EXT-X-TARGETDURATION:{VIDEO_CHUNK_LENGTH}\n#EXT-X-MEDIA-SEQUENCE:1\n#EXT-X-PLAYLIST-TYPE:VOD\n"
+    start = get_start_position()
+    segments = get_segments(video_path, start)
+    query = start_query(start)
 
-    for i in range(0, int(duration), int(VIDEO_CHUNK_LENGTH)):
-        extinf = float(VIDEO_CHUNK_LENGTH)
+    file = f"#EXTM3U\n#EXT-X-VERSION:3\n\n#EXT-X-TARGETDURATION:{target_duration(segments)}\n#EXT-X-MEDIA-SEQUENCE:1\n#EXT-X-PLAYLIST-TYPE:VOD\n"
+    if start:
+        file += f"#EXT-X-START:TIME-OFFSET={start:g},PRECISE=YES\n"
 
-        if (duration - i) < VIDEO_CHUNK_LENGTH:
-            extinf = duration - i
-
-        file += "#EXT-X-DISCONTINUITY\n"
-        file += f"#EXTINF:{extinf},\n/api/watch/video_chunk/{quality}/{media_type}/{media_id}/{(i // VIDEO_CHUNK_LENGTH) + 1}.ts\n"
+    for idx, (segment_start, end) in enumerate(segments, start=1):
+        file += f"#EXTINF:{round(end - segment_start, 6)},\n/api/watch/video_chunk/{quality}/{media_type}/{media_id}/{idx}.ts{query}\n"
 
     file += "#EXT-X-ENDLIST"
 
@@ -448,18 +734,20 @@ def audio_media(audio_id: int, media_type: str, media_id: int) -> Response:
     if not video_path:
         return generate_response(Codes.MEDIA_NOT_FOUND, True)
 
-    duration = length_video(video_path)
-
-    file = f"#EXTM3U\n#EXT-X-VERSION:3\n\n#EXT-X-TARGETDURATION:{AUDIO_CHUNK_LENGTH}\n#EXT-X-MEDIA-SEQUENCE:1\n#EXT-X-PLAYLIST-TYPE:VOD\n"
+    # The selected track is encoded once, its chunks are cut out of it
+    AUDIO_RENDITION_ENCODER.request(video_path, audio_id)
 
-    for i in range(0, int(duration), int(AUDIO_CHUNK_LENGTH)):
-        extinf = float(AUDIO_CHUNK_LENGTH)
+    start = get_start_position()
+    segments = get_segments(video_path, start)
+    query = start_query(start)
 
-        if (duration - i) < AUDIO_CHUNK_LENGTH:
-            extinf = duration - i
+    file = f"#EXTM3U\n#EXT-X-VERSION:3\n\n#EXT-X-TARGETDURATION:{target_duration(segments)}\n#EXT-X-MEDIA-SEQUENCE:1\n#EXT-X-PLAYLIST-TYPE:VOD\n"
+    if start:
+        file += f"#EXT-X-START:TIME-OFFSET={start:g},PRECISE=YES\n"
 
-        file += "#EXT-X-DISCONTINUITY\n"
-        file += f"#EXTINF:{extinf},\n/api/watch/audio_chunk/{media_type}/{media_id}/{audio_id}/{(i // AUDIO_CHUNK_LENGTH) + 1}.ts\n"
+    # The audio segments are raw AAC, their timestamps are in an ID3 tag
+    for idx, (segment_start, end) in enumerate(segments, start=1):
+        file += f"#EXTINF:{round(end - segment_start, 6)},\n/api/watch/audio_chunk/{media_type}/{media_id}/{audio_id}/{idx}.ts{query}\n"
 
     file += "#EXT-X-ENDLIST"
 
@@ -477,6 +765,100 @@ def audio_media(audio_id: int, media_type: str, media_id: int) -> Response:
     return response
 
 
+def get_video_segment(cache_key: str) -> str | None:
+    # The pre-transcoded segments go first, they are never evicted
+    return OPTIMIZED_SEGMENTS.get(cache_key) or SEGMENT_CACHE.get(cache_key)
+
+
+def prefetch_video_segments(
+    video_path: str,
+    quality: str,
+    segments: List[Segment],
+    idx: int,
+    session_key: str,
+    session_group: str,
+    owner: str,
+    build_command: Callable[[int, str], List[str]],
+) -> None:
+    """
+    Make sure the segmenter runs ahead of the playback when the next segments
+    aren't cached, the segmenter then produces all the following ones
+    """
+    last_idx = min(idx + PREFETCH_SEGMENTS, len(segments))
+    for next_idx in range(idx + 1, last_idx + 1):
+        cache_key = video_cache_key(video_path, quality, segments, next_idx)
+        if get_video_segment(cache_key):
+            continue
+
+        PREFETCHER.submit(
+            cache_key,
+            partial(
+                TRANSCODE_SESSIONS.start_session,
+                session_key,
+                session_group,
+                owner,
+                next_idx,
+                build_command,
+                PREFETCH,
+            ),
+        )
+        return
+
+
+def encode_audio_segment(
+    video_path: str,
+    audio_idx: int,
+    segment: Segment,
+    cache_key: str,
+    owner: str,
+    session_group: str,
+) -> None:
+    slot = TRANSCODE_SCHEDULER.acquire(owner, PREFETCH, group=session_group)
+    pipe = PROCESSES.popen(
+        audio_chunk_command(video_path, audio_idx, segment),
+        PREFETCH_JOB,
+        timeout=SEGMENT_WAIT_TIMEOUT,
+        owner=owner,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    first_chunk = get_chunk_tag(segment) + pipe.stdout.read1(STREAM_CHUNK_SIZE)
+    for _ in stream_process(pipe, first_chunk, slot, cache_key):
+        pass
+
+
+def prefetch_audio_segments(
+    video_path: str,
+    audio_idx: int,
+    segments: List[Segment],
+    idx: int,
+    owner: str,
+    session_group: str,
+) -> None:
+    # The chunks of an encoded track are cut without ffmpeg
+    if get_audio_rendition(video_path, audio_idx):
+        return
+
+    last_idx = min(idx + PREFETCH_SEGMENTS, len(segments))
+    for next_idx in range(idx + 1, last_idx + 1):
+        cache_key = audio_cache_key(video_path, audio_idx, segments, next_idx)
+        if SEGMENT_CACHE.get(cache_key):
+            continue
+
+        PREFETCHER.submit(
+            cache_key,
+            partial(
+                encode_audio_segment,
+                video_path,
+                audio_idx,
+                segments[next_idx - 1],
+                cache_key,
+                owner,
+                session_group,
+            ),
+        )
+
+
 @watch_bp.route(
     "/video_chunk/<quality>/<media_type>/<int:media_id>/<int:idx>.ts", methods=["GET"]
 )
@@ -489,102 +871,63 @@ def video_chunk(
     if not video_path:
         return generate_response(Codes.MEDIA_NOT_FOUND, True)
 
-    seconds = (idx - 1) * VIDEO_CHUNK_LENGTH
-
-    token = get_chunk_user_token(request)
-    ip = request.remote_addr
-    user_agent = request.headers.get("User-Agent")
-
-    key = hash_string(f"{token}-{ip}-{user_agent}-{media_id}")
-
-    if VIDEO_PREVIOUS_LAG.get(key) is None:
-        VIDEO_PREVIOUS_LAG[key] = PreviousLagInfo(0, 0)
-
-    time_start = str(datetime.timedelta(seconds=seconds + VIDEO_PREVIOUS_LAG[key].lag))
-    if seconds + VIDEO_PREVIOUS_LAG[key].lag < 0:
-        time_start = str(datetime.timedelta(seconds=0))
-
-    command = []
-
-    if quality == "default":
-        command = [
-            "ffmpeg",
-            *FFMPEG_ARGS,
-            "-hide_banner",
-            "-loglevel",
-            LOG_LEVEL,
-            "-ss",
-            time_start,
-            "-t",
-            str(VIDEO_CHUNK_LENGTH),
-            "-i",
-            video_path,
-            "-c:v",
-            VIDEO_CODEC,
-            "-an",
-            "-f",
-            "mpegts",
-            "-",
-        ]
-    else:
-        video_properties = get_video_properties(video_path)
-        width = video_properties["width"]
-        height = video_properties["height"]
-        new_width = int(float(quality))
-        new_height = round(float(width) / float(height) * new_width)
-        if (new_height % 2) != 0:
-            new_height += 1
-
-        command = [
-            "ffmpeg",
-            *FFMPEG_ARGS,
-            "-hide_banner",
-            "-loglevel",
-            LOG_LEVEL,
-            "-ss",
-            time_start,
-            "-t",
-            str(VIDEO_CHUNK_LENGTH),
-            "-i",
-            video_path,
-            "-c:v",
-            VIDEO_CODEC,
-            "-an",
-            "-vf",
-            f"scale={new_height}:{new_width}",
-            "-f",
-            "mpegts",
-            "-",
-        ]
-
-    pipe = subprocess.Popen(command, stdout=subprocess.PIPE)
-
-    if not pipe or not pipe.stdout:
+    segments = get_segments(video_path, get_start_position())
+    if idx < 1 or idx > len(segments):
         abort(404)
 
-    data = pipe.stdout.read()
+    session_group = get_session_group(media_type, media_id)
+    # The segments depend on the start position
+    session_key = hash_string(f"{session_group}-{quality}-{get_start_position()}")
+    owner = get_transcode_owner()
+    state = PLAYBACK_STATES.update(session_group, quality=quality, video_idx=idx)
 
-    temp_path = f"{ARTEFACTS_PATH}/{media_id}-{idx}.ts"
+    def build_command(start_idx: int, directory: str) -> List[str]:
+        return video_segmenter_command(
+            video_path, quality, segments, start_idx, directory
+        )
 
-    with open(temp_path, "wb") as file:
-        file.write(data)
+    cache_key = video_cache_key(video_path, quality, segments, idx)
+    segment_path = get_video_segment(cache_key)
 
-    duration = length_video(temp_path)
+    def encode_segment(on_cached: Callable[[], None]) -> Response:
+        session = TRANSCODE_SESSIONS.get_session(
+            session_key, session_group, owner, idx, build_command
+        )
 
-    if os.path.exists(temp_path):
-        os.remove(temp_path)
+        if not session:
+            abort(404)
 
-    VIDEO_PREVIOUS_LAG[key].lag = duration - (
-        VIDEO_CHUNK_LENGTH - VIDEO_PREVIOUS_LAG[key].lag
-    )
-    if VIDEO_PREVIOUS_LAG[key].lag_id == idx - 1:
-        VIDEO_PREVIOUS_LAG[key].lag = duration - (
-            VIDEO_CHUNK_LENGTH - VIDEO_PREVIOUS_LAG[key].lag
-        )
+        threading.Thread(
+            target=cache_session_segment,
+            args=(session, idx, cache_key, on_cached),
+            daemon=True,
+        ).start()
+        # The segment is sent while it is encoded
+        return Response(session.stream_segment(idx), mimetype="video/MP2T")
+
+    if segment_path:
+        response = send_file(segment_path, mimetype="video/MP2T")
     else:
-        VIDEO_PREVIOUS_LAG[key].lag = 0
+        response = send_segment_once(
+            cache_key, get_video_segment, "video/MP2T", encode_segment
+        )
 
-    VIDEO_PREVIOUS_LAG[key].lag_id = idx
+    if PREFETCH_SEGMENTS:
+        prefetch_video_segments(
+            video_path,
+            quality,
+            segments,
+            idx,
+            session_key,
+            session_group,
+            owner,
+            build_command,
+        )
+        # The audio track the viewer is listening to goes along
+        if state.get("audio_idx") is not None:
+            prefetch_audio_segments(
+                video_path, state["audio_idx"], segments, idx, owner, session_group
+            )
 
     current_time = request.headers.get("X-Current-Time")
 
@@ -593,8 +936,6 @@ def video_chunk(
             media_type, media_id, current_user.id, round(float(current_time))
         )
 
-    response = make_response(data)
-    response.headers.set("Content-Type", "video/MP2T")
     response.headers.set("Range", "bytes=0-4095")
     response.headers.set("Accept-Encoding", "*")
     response.headers.set("Access-Control-Allow-Origin", "*")
@@ -610,76 +951,71 @@ def video_chunk(
     methods=["GET"],
 )
 def audio_chunk(media_type: str, media_id: int, audio_idx: int, idx: int) -> Response:
-    global AUDIO_PREVIOUS_LAG
-
-    token = get_chunk_user_token(request)
-    ip = request.remote_addr
-    user_agent = request.headers.get("User-Agent")
-
-    key = hash_string(f"{token}-{ip}-{user_agent}-{media_id}")
-
-    if AUDIO_PREVIOUS_LAG.get(key) is None:
-        AUDIO_PREVIOUS_LAG[key] = PreviousLagInfo(0, 0)
-
     video_path = get_media_slug(media_id, media_type)
 
-    seconds = (idx - 1) * AUDIO_CHUNK_LENGTH
-
-    time_start = datetime.timedelta(seconds=seconds + AUDIO_PREVIOUS_LAG[key].lag)
-    if seconds + AUDIO_PREVIOUS_LAG[key].lag < 0:
-        time_start = datetime.timedelta(seconds=0)
-
-    command = [
-        "ffmpeg",
-        *FFMPEG_ARGS,
-        "-hide_banner",
-        "-loglevel",
-        LOG_LEVEL,
-        "-ss",
-        str(time_start),  # Start time of the segment
-        "-t",
-        str(AUDIO_CHUNK_LENGTH),  # End time of the segment
-        "-i",
-        video_path,  # Set output offset
-        "-map",
-        f"0:a:{audio_idx}",  # Select the audio stream
-        "-ac",
-        "2",  # Number of audio channels
-        "-vn",  # Disable video
-        "-f",
-        "mp2",  # Output format for HLS
-        "-",  # Send the result to stdout
-    ]
-
-    pipe = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if pipe is None or pipe.stdout is None:
-        abort(404)
+    if not video_path:
+        return generate_response(Codes.MEDIA_NOT_FOUND, True)
 
-    data = pipe.stdout.read()
+    segments = get_segments(video_path, get_start_position())
+    if idx < 1 or idx > len(segments):
+        abort(404)
 
-    temp_path = f"{ARTEFACTS_PATH}/{media_id}-{audio_idx}-{idx}.ts"
+    session_group = get_session_group(media_type, media_id)
+    owner = get_transcode_owner()
+    PLAYBACK_STATES.update(session_group, audio_idx=audio_idx, audio_segment=idx)
+
+    rendition_path = get_audio_rendition(video_path, audio_idx)
+    data = None
+    if rendition_path:
+        data = read_rendition_segment(rendition_path, segments[idx - 1])
+
+    cache_key = audio_cache_key(video_path, audio_idx, segments, idx)
+    segment_path = SEGMENT_CACHE.get(cache_key) if data is None else None
+
+    def encode_segment(on_cached: Callable[[], None]) -> Response:
+        # The chunk shares the slot of the video segmenter of the playback
+        slot = TRANSCODE_SCHEDULER.acquire(owner, group=session_group)
+        pipe = PROCESSES.popen(
+            audio_chunk_command(video_path, audio_idx, segments[idx - 1]),
+            timeout=SEGMENT_WAIT_TIMEOUT,
+            owner=owner,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
 
-    with open(temp_path, "wb") as f:
-        f.write(data)
+        if pipe is None or pipe.stdout is None:
+            slot.release()
+            abort(404)
 
-    duration = length_video(temp_path)
+        first_chunk = pipe.stdout.read1(STREAM_CHUNK_SIZE)
 
-    if os.path.exists(temp_path):
-        os.remove(temp_path)
+        if not first_chunk:
+            pipe.wait()
+            slot.release()
+            abort(404)
 
-    if AUDIO_PREVIOUS_LAG[key].lag < 0:
-        AUDIO_PREVIOUS_LAG[key].lag = duration - (
-            VIDEO_CHUNK_LENGTH - AUDIO_PREVIOUS_LAG[key].lag
+        first_chunk = get_chunk_tag(segments[idx - 1]) + first_chunk
+        return Response(
+            stream_process(pipe, first_chunk, slot, cache_key, on_cached),
+            mimetype="audio/aac",
         )
 
+    if data is not None:
+        response = make_response(data)
+        response.headers.set("Content-Type", "audio/aac")
+    elif segment_path:
+        response = send_file(segment_path, mimetype="audio/aac")
     else:
-        AUDIO_PREVIOUS_LAG[key].lag = 0
+        AUDIO_RENDITION_ENCODER.request(video_path, audio_idx)
+        response = send_segment_once(
+            cache_key, SEGMENT_CACHE.get, "audio/aac", encode_segment
+        )
 
-    AUDIO_PREVIOUS_LAG[key].lag_id = idx
+    if PREFETCH_SEGMENTS:
+        prefetch_audio_segments(
+            video_path, audio_idx, segments, idx, owner, session_group
+        )
 
-    response = make_response(data)
-    response.headers.set("Content-Type", "video/MP2T")
     response.headers.set("Range", "bytes=0-4095")
     response.headers.set("Accept-Encoding", "*")
     response.headers.set("Access-Control-Allow-Origin", "*")
@@ -747,6 +1083,103 @@ def watch_media(current_user, media_type: str, media_id: int) -> Response:
         return generate_response(Codes.MEDIA_NOT_FOUND, True)
 
     if media_type == "show" or media_type == "movie" or media_type == "other":
-        return generate_m3u8(media)
+        return generate_m3u8(media, get_client_capabilities(request.args))
 
     return generate_response(Codes.INVALID_MEDIA_TYPE, True)
+
+
+@watch_bp.route("/decision/<media_type>/<int:media_id>", methods=["GET"])
+@token_required
+def playback_decision(current_user, media_type: str, media_id: int) -> Response:
+    """Tell the client how to play a media, from its declared capabilities"""
+    if media_type not in ["show", "movie", "other"]:
+        return generate_response(Codes.INVALID_MEDIA_TYPE, True)
+
+    video_path = get_media_slug(media_id, media_type)
+
+    if not video_path:
+        return generate_response(Codes.MEDIA_NOT_FOUND, True)
+
+    method = decide_playback(
+        video_path, get_probe(video_path), get_client_capabilities(request.args)
+    )
+
+    if method == DIRECT_PLAY:
+        # The file is loaded by the video element, without the Authorization
+        # header
+        url = sign_url(current_user, f"/api/watch/direct/{media_type}/{media_id}")
+    else:
+        url = f"/api/watch/{media_type}/{media_id}"
+        if request.query_string:
+            url += f"?{request.query_string.decode('utf-8')}"
+
+    return generate_response(Codes.SUCCESS, False, {"method": method, "url": url})
+
+
+@watch_bp.route("/direct/<media_type>/<int:media_id>", methods=["GET"])
+@url_token_required
+def direct_play(current_user, media_type: str, media_id: int) -> Response:
+    """Send the original file, with support for range requests"""
+    if media_type not in ["show", "movie", "other"]:
+        return generate_response(Codes.INVALID_MEDIA_TYPE, True)
+
+    video_path = get_media_slug(media_id, media_type)
+
+    if not video_path:
+        return generate_response(Codes.MEDIA_NOT_FOUND, True)
+
+    return send_file(video_path, conditional=True)
+
+
+@watch_bp.route("/track_url/<int:track_id>", methods=["GET"])
+@token_required
+def track_url(current_user, track_id: int) -> Response:
+    """
+    Give the url of a music track, signed for the audio element that loads it
+    without the Authorization header. The query string is passed on
+    """
+    if not Tracks.query.filter_by(id=track_id).first():
+        return generate_response(Codes.MEDIA_NOT_FOUND, True)
+
+    url = sign_url(current_user, f"/api/watch/track/{track_id}")
+    if request.query_string:
+        url += f"&{request.query_string.decode('utf-8')}"
+
+    return generate_response(Codes.SUCCESS, False, {"url": url})
+
+
+@watch_bp.route("/track/<int:track_id>", methods=["GET"])
+@url_token_required
+def track_stream(current_user, track_id: int) -> Response:
+    """
+    Send a music track, as is when the client can play it, or transcoded once
+    and cached otherwise. With album_id or playlist_id, the next tracks are
+    transcoded ahead
+    """
+    track = Tracks.query.filter_by(id=track_id).first()
+
+    if not track or not os.path.exists(track.slug):
+        return generate_response(Codes.MEDIA_NOT_FOUND, True)
+
+    capabilities = get_client_capabilities(request.args)
+    track_format = get_track_format(capabilities)
+    owner = get_transcode_owner()
+
+    next_tracks = get_next_tracks(
+        track,
+        request.args.get("album_id", type=int),
+        request.args.get("playlist_id", type=int),
+    )
+    if next_tracks:
+        prefetch_tracks(next_tracks, track_format, owner)
+
+    method = decide_track_playback(track.slug, get_probe(track.slug), capabilities)
+    if method == DIRECT_PLAY:
+        return send_file(track.slug, conditional=True)
+
+    track_path = get_track_file(track.slug, track_format, owner)
+    if not track_path:
+        abort(500)
+
+    _, mimetype = TRACK_FORMATS[track_format]
+    return send_file(track_path, mimetype=mimetype, conditional=True)
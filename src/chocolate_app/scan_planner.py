@@ -0,0 +1,299 @@
+import os
+import time
+
+from typing import Dict, List, Set, Tuple
+
+from chocolate_app import DB
+from chocolate_app.tables import FileState
+from chocolate_app.utils.utils import log
+
+# is_directory, size, mtime, inode
+Stat = Tuple[bool, int, float, int]
+# The stats of a file whose scan failed, it's planned again by the next scan
+UNSCANNED = (-1, -1.0, -1)
+
+
+def normalize(path: str) -> str:
+    return os.path.normpath(path.replace("\\", "/"))
+
+
+class ScanPlan:
+    """
+    The files of a library that changed since its last scan
+
+    The paths are compared normalized, so the scanners can ask with the slugs
+    they build, whatever the separators they use.
+    """
+
+    def __init__(self, library_name: str, root: str, full: bool) -> None:
+        self.library_name = library_name
+        self.root = root
+        self.full = full
+        self.added: List[str] = []
+        self.changed: List[str] = []
+        self.removed: List[str] = []
+        # Every file known to exist, listed or in an unchanged directory
+        self.seen: Set[str] = set()
+        self.pending: Set[str] = set()
+        self.removed_files: Set[str] = set()
+        self.touched: Set[str] = set()
+        # The library couldn't be reached, nothing is scanned nor recorded
+        self.aborted = False
+        # The stats to record once the library has been scanned
+        self.inserts: Dict[str, Stat] = {}
+        self.updates: Dict[int, Tuple[str, Stat]] = {}
+        self.deletes: List[int] = []
+        # The path, kind and state of every file and directory listed
+        self.listed: Dict[str, Tuple[str, bool, int | None]] = {}
+
+    def is_empty(self) -> bool:
+        if self.aborted:
+            return True
+        return not self.full and not (self.added or self.changed or self.removed)
+
+    def needs_scan(self, path: str) -> bool:
+        """
+        Whether a file is new or has been modified since the last scan
+        """
+        return self.full or normalize(path) in self.pending
+
+    def touches(self, directory: str) -> bool:
+        """
+        Whether a file has been added, modified or removed under a directory
+        """
+        return self.full or normalize(directory) in self.touched
+
+    def is_removed(self, path: str) -> bool:
+        """
+        Whether the file of a media is gone, the files the planner doesn't know
+        are checked on the disk
+        """
+        path = normalize(path)
+        if path in self.removed_files:
+            return True
+        if path in self.seen:
+            return False
+        return not os.path.exists(path)
+
+    def finish(self) -> None:
+        self.pending = set(self.added + self.changed)
+        self.removed_files = set(self.removed)
+        root = normalize(self.root)
+        for path in self.added + self.changed + self.removed:
+            # The file and all the directories up to the library
+            while path not in self.touched:
+                self.touched.add(path)
+                if path == root or os.path.dirname(path) == path:
+                    break
+                path = os.path.dirname(path)
+
+    def fail(self, path: str) -> None:
+        """
+        Plan a file or a directory again, when its scan failed
+
+        Its stats and those of the directories above it aren't recorded, so
+        they are listed and scanned again by the next scan.
+        """
+        path = normalize(path)
+        keys = [path]
+        listed = self.listed.get(path)
+        if listed is not None and listed[1]:
+            prefix = os.path.join(path, "")
+            keys += [key for key in self.listed if key.startswith(prefix)]
+        root = normalize(self.root)
+        parent = path
+        while parent != root and os.path.dirname(parent) != parent:
+            parent = os.path.dirname(parent)
+            keys.append(parent)
+
+        for key in keys:
+            listed = self.listed.get(key)
+            if listed is None:
+                continue
+            raw_path, is_directory, state_id = listed
+            if state_id is None:
+                self.inserts.pop(raw_path, None)
+            else:
+                self.updates[state_id] = (raw_path, (is_directory, *UNSCANNED))
+
+    def discard(self) -> None:
+        """
+        Keep the stats of the last scan, when the scan of the changes failed,
+        so they are planned again by the next one
+        """
+        self.inserts.clear()
+        self.updates.clear()
+        self.deletes.clear()
+
+    def commit(self) -> None:
+        """
+        Record the stats of the library, once its changes have been scanned
+        """
+        if self.aborted:
+            return
+        now = time.time()
+        DB.session.bulk_insert_mappings(
+            FileState,  # type: ignore
+            [
+                state_mapping(path, stat, now, library_name=self.library_name)
+                for path, stat in self.inserts.items()
+            ],
+        )
+        DB.session.bulk_update_mappings(
+            FileState,  # type: ignore
+            [
+                state_mapping(path, stat, now, id=state_id)
+                for state_id, (path, stat) in self.updates.items()
+            ],
+        )
+        if self.deletes:
+            FileState.query.filter(FileState.id.in_(self.deletes)).delete(
+                synchronize_session=False
+            )
+        DB.session.commit()
+
+
+def state_mapping(path: str, stat: Stat, scanned_at: float, **columns) -> dict:
+    is_directory, size, mtime, inode = stat
+    return dict(
+        columns,
+        path=path,
+        is_directory=is_directory,
+        size=size,
+        mtime=mtime,
+        inode=inode,
+        scanned_at=scanned_at,
+    )
+
+
+def plan_scan(library_name: str, root: str, full: bool = False) -> ScanPlan:
+    """
+    Diff the files of a library against their stats of the last scan
+
+    A directory whose mtime hasn't changed had no entry added or removed, so
+    it isn't listed again and its files are taken as unchanged, only its
+    known subdirectories are visited. A file modified in place there is only
+    seen by a full scan.
+
+    A directory that can't be listed keeps its known files until the next
+    scan, and a library whose folder can't be reached is aborted, so a share
+    dropping out doesn't remove its medias.
+
+    Args:
+        library_name (str): The name of the library
+        root (str): The folder of the library
+        full (bool): List every directory, and hand every file to the scanner
+
+    Returns:
+        ScanPlan: The added, changed and removed files
+    """
+    plan = ScanPlan(library_name, root, full)
+    root = root.rstrip("/\\") or root
+
+    known: Dict[str, Tuple[int, Stat]] = {}
+    children: Dict[str, List[str]] = {}
+    rows = DB.session.query(
+        FileState.id,
+        FileState.path,
+        FileState.is_directory,
+        FileState.size,
+        FileState.mtime,
+        FileState.inode,
+    ).filter_by(library_name=library_name)
+    for state_id, path, is_directory, size, mtime, inode in rows:
+        known[path] = (state_id, (bool(is_directory), size, mtime, inode))
+        children.setdefault(os.path.dirname(path), []).append(path)
+
+    visited: Set[str] = set()
+    visited_inodes: Set[Tuple[int, int]] = set()
+
+    def record(path: str, stat: Stat) -> None:
+        visited.add(path)
+        state = known.get(path)
+        state_id = state[0] if state is not None else None
+        plan.listed[normalize(path)] = (path, stat[0], state_id)
+        if state is None:
+            plan.inserts[path] = stat
+        elif state[1] != stat:
+            plan.updates[state[0]] = (path, stat)
+
+    def keep(directory: str) -> None:
+        # The known entries of the directory are taken as they are
+        visited.add(directory)
+        for path in children.get(directory, []):
+            if known[path][1][0]:
+                directories.append(path)
+            else:
+                visited.add(path)
+                plan.seen.add(normalize(path))
+
+    directories = [root]
+    while directories:
+        directory = directories.pop()
+        try:
+            directory_stat = os.stat(directory)
+        except OSError as e:
+            if directory == root:
+                # The library is unreachable (an unmounted share), not empty
+                log("ERROR", "SCAN", f"Can't reach {root}, scan skipped: {e}")
+                plan.aborted = True
+                return plan
+            if not isinstance(e, FileNotFoundError):
+                log("ERROR", "SCAN", f"Can't reach {directory}: {e}")
+                keep(directory)
+            continue
+        # A symlink looping back to a parent directory
+        inode = (directory_stat.st_dev, directory_stat.st_ino)
+        if inode in visited_inodes:
+            continue
+        visited_inodes.add(inode)
+
+        stat: Stat = (True, 0, directory_stat.st_mtime, directory_stat.st_ino)
+        state = known.get(directory)
+        if not full and state is not None and state[1] == stat:
+            # Nothing was added or removed in the directory
+            keep(directory)
+            continue
+
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            # Its stat isn't recorded, so it's listed again by the next scan
+            log("ERROR", "SCAN", f"Can't list {directory}: {e}")
+            keep(directory)
+            continue
+        # The stat is taken before the listing, a file added meanwhile is
+        # found by the next scan
+        record(directory, stat)
+
+        for entry in entries:
+            path = f"{directory}/{entry.name}"
+            try:
+                if entry.is_dir():
+                    directories.append(path)
+                    continue
+                if not entry.is_file():
+                    continue
+                file_stat = entry.stat()
+            except OSError:
+                continue
+
+            stat = (False, file_stat.st_size, file_stat.st_mtime, file_stat.st_ino)
+            plan.seen.add(normalize(path))
+            if path not in known:
+                plan.added.append(path)
+            elif full or known[path][1] != stat:
+                plan.changed.append(path)
+            record(path, stat)
+
+    for path, (state_id, stat) in known.items():
+        if path in visited:
+            continue
+        plan.deletes.append(state_id)
+        if not stat[0]:
+            plan.removed.append(normalize(path))
+
+    plan.added = [normalize(path) for path in plan.added]
+    plan.changed = [normalize(path) for path in plan.changed]
+    plan.finish()
+    return plan
@@ -6,18 +6,21 @@ import os
 import ast
 import zlib
 import uuid
+import time
 import fitz
 import rarfile
 import zipfile
 import datetime
 import requests
 import subprocess
+import threading
 import sqlalchemy
 import deezer as deezer_main
 
 from tinytag import TinyTag
 from guessit import guessit
-from typing import Tuple, Dict
+from flask import current_app
+from typing import Tuple, Dict, List
 from m3u_parser import M3uParser
 from PIL import Image, ImageDraw
 from tmdbv3api.as_obj import AsObj
@@ -28,7 +31,14 @@ from concurrent.futures import ThreadPoolExecutor
 from tmdbv3api import TV, Episode, Movie, Person, Search, Group
 
 
-from chocolate_app import DB, get_dir_path, config, IMAGES_PATH
+from chocolate_app import (
+    DB,
+    get_dir_path,
+    config,
+    IMAGES_PATH,
+    SCAN_WORKERS,
+    TMDB_URL,
+)
 from chocolate_app.tables import (
     Libraries,
     Movies,
@@ -49,6 +59,8 @@ from chocolate_app.tables import (
 from chocolate_app.utils.utils import (
     path_join,
     save_image,
+    download_image,
+    convert_image,
     is_video_file,
     is_music_file,
     is_book_file,
@@ -58,18 +70,46 @@ from chocolate_app.utils.utils import (
     generate_b64_image,
 )
 from chocolate_app.plugins_loader import events, overrides
+from chocolate_app.transcode.probe import get_probe, get_duration
+from chocolate_app.scan_planner import ScanPlan, plan_scan
+from chocolate_app.utils.http import HTTP
+from chocolate_app.utils.pipeline import Pipeline
+from chocolate_app.utils.processes import PROCESSES, BACKGROUND_JOB
 
 dir_path = get_dir_path()
 
-deezer = deezer_main.Client()
 
-image_requests = requests.Session()
+class DeezerClient(deezer_main.Client):
+    """
+    The Deezer client keeps its own connections, its requests are only run
+    within the limits of the Deezer host of the shared HTTP client
+    """
+
+    def request(self, method, path, *args, **kwargs):
+        with HTTP.limited("api.deezer.com"):
+            return super().request(method, path, *args, **kwargs)
+
+
+deezer = DeezerClient()
+
+# The banner of the other videos is a frame from the middle of the file
+BANNER_TIMEOUT = 2 * 60
+# The new movies saved in a single commit
+MOVIES_BATCH_SIZE = 20
+
+IGDB_TOKEN_URL = "https://id.twitch.tv/oauth2/token"
+IGDB_GAMES_URL = "https://api.igdb.com/v4/games"
+IGDB_GAME_FIELDS = (
+    "name, cover.*, summary, total_rating, first_release_date, genres.*, platforms.*"
+)
+# A token is renewed a bit before it expires, not by a failing request
+IGDB_TOKEN_MARGIN = 60
 
 
 class Scanner:
     def __init__(self):
         self.library_name = ""
-        pass
+        self.plan: ScanPlan | None = None
 
     def set_library_name(self, library_name: str) -> None:
         self.library_name = library_name
@@ -175,140 +215,293 @@ class Scanner:
         pass
 
 
+def guess_movie(file_name: str) -> dict:
+    """
+    Parse the name of a movie file, in the process pool of the scan
+    """
+    guessed_data = guessit(file_name)
+    return {
+        key: guessed_data[key]
+        for key in ["title", "alternative_title", "part", "year"]
+        if key in guessed_data
+    }
+
+
+def prepare_artwork(
+    path: str, width: int | None, height: int | None
+) -> Tuple[str | None, str | None]:
+    """
+    Convert a downloaded image and make its thumbnail, in the process pool of
+    the scan
+    """
+    local_image_path = convert_image(path)
+    return local_image_path, generate_b64_image(
+        local_image_path, width=width, height=height
+    )
+
+
+class MovieScan:
+    """
+    A movie file going through the stages of the scan
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.guessed_data: dict = {}
+        self.result: dict = {}
+        self.details: AsObj | None = None
+        self.alternative_names: List[str] = []
+        # The TMDb paths of the cover, the banner and the logo
+        self.images: Dict[str, str | None] = {}
+        # The local path and the thumbnail of each image
+        self.artwork: Dict[str, Tuple[str | None, str | None]] = {}
+        self.actors: List[dict] = []
+        self.duration = ""
+
+
 class MovieScanner(Scanner):
-    def scan(self) -> None:
+    def __init__(self):
+        super().__init__()
+        self.pipeline: Pipeline | None = None
+
+    def scan(self, full: bool = False) -> None:
         library = self.get_library()
         if library is None:
             return
+        self.plan = plan_scan(self.library_name, library.folder, full)
+        if self.plan.is_empty():
+            self.plan.commit()
+            return
         self.clean_db()
 
         medias = self.get_medias(library.folder)
 
+        movie_paths = []
         for media in medias:
             if is_video_file(media):
-                self.scan_movie(media)
-            elif is_directory(media):
-                self.scan_directory(media)
+                if self.plan.needs_scan(media):
+                    movie_paths.append(media)
+            elif is_directory(media) and self.plan.touches(media):
+                movie_path = self.find_movie(media)
+                if movie_path:
+                    movie_paths.append(movie_path)
+
+        if not self.scan_movies(movie_paths):
+            # The movies that failed are tried again by the next scan
+            self.plan.discard()
         self.clean_db()
+        self.plan.commit()
 
-    def scan_directory(self, directory_path: str) -> None:
+    def find_movie(self, directory_path: str) -> str | None:
         files = os.listdir(directory_path)
         for file in files:
             file_path = path_join(directory_path, file)
             if is_video_file(file_path):
-                self.scan_movie(file_path)
-                return
+                return file_path
+        return None
 
-    def scan_movie(self, movie_path: str, use_alternative=False) -> None:
-        if not os.path.exists(movie_path):
-            print(f"File {movie_path} not found")
-            return
+    def scan_movie(self, movie_path: str) -> None:
+        self.scan_movies([movie_path])
 
-        if overrides.have_override("scan_movie"):
-            return overrides.execute_override(
-                "scan_movie", movie_path, self.library_name
-            )
+    def scan_movies(self, movie_paths: List[str]) -> bool:
+        """
+        Scan new movie files, through a pipeline of stages running at once:
+        the names are parsed in a process pool, TMDb and the images are
+        fetched by pools of threads, and the movies are saved in batches by a
+        single writer
 
-        movie_already_exists = (
-            Movies.query.filter_by(slug=movie_path).first() is not None
+        Args:
+            movie_paths (List[str]): The paths of the movie files
+
+        Returns:
+            bool: False if some movies couldn't be scanned
+        """
+        if overrides.have_override("scan_movie"):
+            for movie_path in movie_paths:
+                overrides.execute_override("scan_movie", movie_path, self.library_name)
+            return True
+
+        known_paths = {slug for (slug,) in DB.session.query(Movies.slug)}
+        movies = []
+        for movie_path in movie_paths:
+            if not os.path.exists(movie_path):
+                print(f"File {movie_path} not found")
+            elif movie_path not in known_paths:
+                movies.append(MovieScan(movie_path))
+        if not movies:
+            return True
+
+        self.pipeline = Pipeline(
+            current_app._get_current_object(), SCAN_WORKERS["parse"]
         )
-        if movie_already_exists:
-            return
+        self.pipeline.add_stage("parse", self.parse_movie, SCAN_WORKERS["parse"])
+        # The movies not found are tried again by the next scan
+        self.pipeline.add_stage(
+            "metadata", self.fetch_metadata, SCAN_WORKERS["metadata"], drop_fails=True
+        )
+        self.pipeline.add_stage("artwork", self.fetch_artwork, SCAN_WORKERS["artwork"])
+        self.pipeline.add_stage(
+            "database", self.save_movies, 1, batch_size=MOVIES_BATCH_SIZE
+        )
+        return self.pipeline.run(movies)
 
-        print(f"Scanning {movie_path}")
-
-        file_path, file_name = os.path.split(movie_path)
-        guessed_data = guessit(file_name)
-        if use_alternative:
-            title = self.get_alternative_title(guessed_data)
-        else:
-            title = self.get_title(guessed_data)
-        year = self.get_year(guessed_data)
+    def parse_movie(self, movie: MovieScan) -> MovieScan:
+        print(f"Scanning {movie.path}")
+        file_name = os.path.basename(movie.path)
+        movie.guessed_data = self.pipeline.run_in_process(guess_movie, file_name)
+        return movie
 
+    def fetch_metadata(self, movie: MovieScan) -> MovieScan | None:
+        title = self.get_title(movie.guessed_data)
+        year = self.get_year(movie.guessed_data)
         search = self.search_movie(title, year)
         if not search or not search.get("results"):
-            if not use_alternative:
-                self.scan_movie(movie_path, use_alternative=True)
-            if use_alternative:
-                print(f"Can't find {title} in TMDb")
-            return
+            title = self.get_alternative_title(movie.guessed_data)
+            search = self.search_movie(title, year)
+        if not search or not search.get("results"):
+            print(f"Can't find {title} in TMDb")
+            return None
 
         result = search["results"][0]
         movie_id = result["id"]
-
-        movie = Movie()
-        details = movie.details(movie_id)
-        note = result["vote_average"]
-        date = result["release_date"]
-        genres = ",".join([str(i) for i in result["genre_ids"]])
-        duration = str(datetime.timedelta(seconds=round(length_video(movie_path))))
-        cast = self.generate_cast(list(details.casts.cast)[:5], movie_id)
-        adult = result["adult"]
-
-        all_names = self.generate_alternative_names(
-            movie.alternative_titles(movie_id).titles
+        tmdb_movie = Movie()
+        movie.result = result
+        movie.details = tmdb_movie.details(movie_id)
+        movie.alternative_names = self.generate_alternative_names(
+            tmdb_movie.alternative_titles(movie_id).titles
         )
 
-        title = result["title"]
-        description = result["overview"]
-
-        all_images = movie.images(movie_id, include_image_language="null")
-
+        all_images = tmdb_movie.images(movie_id, include_image_language="null")
         if len(all_images["posters"]) > 0:
-            cover_path, cover_b64 = self.process_image(
-                all_images["posters"][0]["file_path"],
-                f"{movie_id}_Movie_Cover",
-                width=300,
-            )
+            movie.images["cover"] = all_images["posters"][0]["file_path"]
         else:
-            cover_path, cover_b64 = self.process_image(
-                result["poster_path"], f"{movie_id}_Movie_Cover", width=300
-            )
-
+            movie.images["cover"] = result["poster_path"]
         if len(all_images["backdrops"]) > 0:
-            banner_path, banner_b64 = self.process_image(
-                all_images["backdrops"][0]["file_path"], f"{movie_id}_Movie_Banner"
-            )
+            movie.images["banner"] = all_images["backdrops"][0]["file_path"]
         else:
-            banner_path, banner_b64 = self.process_image(
-                result["backdrop_path"], f"{movie_id}_Movie_Banner"
-            )
-
+            movie.images["banner"] = result["backdrop_path"]
         if len(all_images["logos"]) == 0:
-            all_images = movie.images(movie_id, include_image_language="en")
+            all_images = tmdb_movie.images(movie_id, include_image_language="en")
+        movie.images["logo"] = None
+        if len(all_images["logos"]) > 0:
+            movie.images["logo"] = all_images["logos"][0]["file_path"]
+
+        for actor in list(movie.details.casts.cast)[:5]:
+            actor_data = {"id": actor.id, "profile_path": actor.profile_path}
+            # The details are only needed for the actors not saved yet
+            if Actors.query.filter_by(tmdb_id=actor.id).first() is None:
+                person = Person().details(actor.id)
+                actor_data.update(
+                    name=actor.name,
+                    description=person.biography,
+                    birth_date=person.birthday,
+                    birth_place=person.place_of_birth,
+                )
+            movie.actors.append(actor_data)
 
-        logo_path, logo_b64 = None, None
+        movie.duration = str(
+            datetime.timedelta(seconds=round(get_duration(movie.path)))
+        )
+        return movie
 
-        if len(all_images["logos"]) > 0:
-            logo_path, logo_b64 = self.process_image(
-                all_images["logos"][0]["file_path"], f"{movie_id}_Movie_Logo"
-            )
+    def save_artwork(
+        self,
+        image_url: str | None,
+        filename: str,
+        width: int | None = None,
+        height: int | None = None,
+    ) -> Tuple[str | None, str | None]:
+        if not image_url:
+            return None, None
+        download_image(image_url, f"{IMAGES_PATH}/{filename}")
+        return self.pipeline.run_in_process(
+            prepare_artwork, f"{IMAGES_PATH}/{filename}", width, height
+        )
 
-        movie_object = Movies(
-            tmdb_id=movie_id,
-            title=title,
-            slug=movie_path,
-            description=description,
-            note=note,
-            date=date,
-            genre=genres,
-            duration=duration,
-            cast=cast,
-            adult=adult,
-            alternative_title=",".join(all_names),
-            cover=cover_path,
-            cover_b64=cover_b64,
-            banner=banner_path,
-            banner_b64=banner_b64,
-            logo=logo_path,
-            logo_b64=logo_b64,
-            library_name=self.library_name,
-            file_date=os.path.getmtime(movie_path),
+    def fetch_artwork(self, movie: MovieScan) -> MovieScan:
+        movie_id = movie.result["id"]
+        image_url = "https://image.tmdb.org/t/p/original{}"
+        movie.artwork["cover"] = self.save_artwork(
+            movie.images["cover"] and image_url.format(movie.images["cover"]),
+            f"{movie_id}_Movie_Cover",
+            width=300,
+        )
+        movie.artwork["banner"] = self.save_artwork(
+            movie.images["banner"] and image_url.format(movie.images["banner"]),
+            f"{movie_id}_Movie_Banner",
+        )
+        movie.artwork["logo"] = self.save_artwork(
+            movie.images["logo"] and image_url.format(movie.images["logo"]),
+            f"{movie_id}_Movie_Logo",
         )
 
-        DB.session.add(movie_object)
-        DB.session.commit()
-        events.execute_event(events.Events.NEW_MOVIE, movie_object)
+        for actor in movie.actors:
+            if "name" not in actor:
+                continue
+            actor["image"], actor["image_b64"] = self.save_artwork(
+                f"https://www.themoviedb.org/t/p/w600_and_h900_bestv2{actor['profile_path']}",
+                f"Actor_{actor['id']}",
+                width=300,
+            )
+        return movie
+
+    def save_movies(self, movies: List[MovieScan]) -> None:
+        movie_objects = []
+        try:
+            for movie in movies:
+                movie_id = movie.result["id"]
+                for actor in movie.actors:
+                    actor_object = Actors.query.filter_by(tmdb_id=actor["id"]).first()
+                    if actor_object:
+                        actor_object.programs = f"{actor_object.programs} {movie_id}"
+                    elif "name" in actor:
+                        DB.session.add(
+                            Actors(
+                                name=actor["name"],
+                                image=actor["image"],
+                                image_b64=actor["image_b64"],
+                                description=actor["description"],
+                                birth_date=actor["birth_date"],
+                                birth_place=actor["birth_place"],
+                                programs=f"{movie_id}",
+                                tmdb_id=actor["id"],
+                            )
+                        )
+
+                result = movie.result
+                cover_path, cover_b64 = movie.artwork["cover"]
+                banner_path, banner_b64 = movie.artwork["banner"]
+                logo_path, logo_b64 = movie.artwork["logo"]
+                movie_object = Movies(
+                    tmdb_id=movie_id,
+                    title=result["title"],
+                    slug=movie.path,
+                    description=result["overview"],
+                    note=result["vote_average"],
+                    date=result["release_date"],
+                    genre=",".join([str(i) for i in result["genre_ids"]]),
+                    duration=movie.duration,
+                    cast=",".join([str(actor["id"]) for actor in movie.actors]),
+                    adult=result["adult"],
+                    alternative_title=",".join(movie.alternative_names),
+                    cover=cover_path,
+                    cover_b64=cover_b64,
+                    banner=banner_path,
+                    banner_b64=banner_b64,
+                    logo=logo_path,
+                    logo_b64=logo_b64,
+                    library_name=self.library_name,
+                    file_date=os.path.getmtime(movie.path),
+                )
+                DB.session.add(movie_object)
+                movie_objects.append(movie_object)
+            DB.session.commit()
+        except Exception:
+            DB.session.rollback()
+            raise
+
+        for movie_object in movie_objects:
+            events.execute_event(events.Events.NEW_MOVIE, movie_object)
 
     def search_movie(self, title: str, year: int | None = None) -> dict:
         if year:
@@ -318,7 +511,7 @@ class MovieScanner(Scanner):
     def clean_db(self) -> None:
         movies = Movies.query.filter_by(library_name=self.library_name).all()
         for movie in movies:
-            if not os.path.exists(movie.slug):
+            if self.plan.is_removed(movie.slug):
                 DB.session.delete(movie)
                 DB.session.commit()
 
@@ -329,7 +522,7 @@ class LiveTVScanner(Scanner):
             r"^http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+$"
         )
         if regex_url.match(epg_source):
-            response = requests.get(epg_source)
+            response = HTTP.get(epg_source, timeout=(5, 120))
             response.raise_for_status()
             epg_data = io.BytesIO(response.content)
         else:
@@ -638,29 +831,6 @@ def transformToList(obj: AsObj | list) -> list:
     return obj.replace('"', '\\"')
 
 
-def length_video(path: str) -> float:
-    seconds = subprocess.run(
-        [
-            "ffprobe",
-            "-v",
-            "error",
-            "-show_entries",
-            "format=duration",
-            "-of",
-            "default=noprint_wrappers=1:nokey=1",
-            path,
-        ],
-        stdout=subprocess.PIPE,
-        text=True,
-    )
-    try:
-        return float(seconds.stdout)
-    except Exception as e:
-        log_message = f"Error while getting the length of the video {path}: {e}"
-        log("ERROR", "LENGTH VIDEO", log_message)
-        return 0
-
-
 def createArtist(artistName: str, lib: str) -> int:
     exists = Artists.query.filter_by(name=artistName).first() is not None
     if exists:
@@ -790,10 +960,13 @@ def generateImage(title: str, librairie: str, banner: str) -> None:
 
 
 def is_connected() -> bool:
+    """
+    Whether TMDb, where the metadata come from, can be reached
+    """
     try:
-        requests.get("https://ww.google.com/").status_code
+        HTTP.head(TMDB_URL, timeout=5, retries=0)
         return True
-    except Exception:
+    except requests.RequestException:
         return False
 
 
@@ -848,6 +1021,94 @@ def searchGame(game: str, console: str) -> dict | None:
     return IGDBRequest(url, console)
 
 
+class IGDBToken:
+    """
+    The Twitch token of the IGDB API, shared by the game scans until it
+    expires instead of being requested for each game
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.credentials: Tuple[str, str] | None = None
+        self.token: str | None = None
+        self.expires_at = 0.0
+
+    def get(self, client_id: str, client_secret: str) -> str | None:
+        with self.lock:
+            credentials = (client_id, client_secret)
+            if (
+                self.token
+                and self.credentials == credentials
+                and time.time() < self.expires_at
+            ):
+                return self.token
+
+            self.token = None
+            response = HTTP.request(
+                "POST",
+                IGDB_TOKEN_URL,
+                params={
+                    "client_id": client_id,
+                    "client_secret": client_secret,
+                    "grant_type": "client_credentials",
+                },
+            )
+            token = response.json()
+            if "message" in token and token["message"] == "invalid client secret":
+                print("Invalid client secret")
+                return None
+            if "access_token" not in token:
+                return None
+
+            self.credentials = credentials
+            self.token = token["access_token"]
+            expires_in = token.get("expires_in", 0)
+            self.expires_at = time.time() + expires_in - IGDB_TOKEN_MARGIN
+            return self.token
+
+    def expire(self, token: str) -> None:
+        """
+        Forget a token refused by IGDB, unless it has already been renewed
+        """
+        with self.lock:
+            if self.token == token:
+                self.token = None
+
+
+IGDB_TOKEN = IGDBToken()
+
+
+def getIGDBGames(game_ids: List[int], client_id: str, client_secret: str) -> Dict:
+    """
+    Get the details of games from IGDB, in a single request
+
+    Returns:
+        Dict: The games found, by id
+    """
+    if not game_ids:
+        return {}
+    ids = ", ".join(str(game_id) for game_id in game_ids)
+    body = f"fields {IGDB_GAME_FIELDS}; where id = ({ids}); limit {len(game_ids)};"
+
+    # A token revoked before its expiration is renewed once
+    for _ in range(2):
+        token = IGDB_TOKEN.get(client_id, client_secret)
+        if token is None:
+            return {}
+        headers = {
+            "Accept": "application/json",
+            "Authorization": f"Bearer {token}",
+            "Client-ID": client_id,
+        }
+        response = HTTP.request("POST", IGDB_GAMES_URL, headers=headers, data=body)
+        if response.status_code != 401:
+            break
+        IGDB_TOKEN.expire(token)
+
+    response.raise_for_status()
+    return {game["id"]: game for game in response.json()}
+
+
 def IGDBRequest(url: str, console: str) -> Dict | None:
     custom_headers = {
         "User-Agent": "Mozilla/5.0 (X11; UwUntu; Linux x86_64; rv:100.0) Gecko/20100101 Firefox/100.0",
@@ -863,40 +1124,23 @@ def IGDBRequest(url: str, console: str) -> Dict | None:
         "Pragma": "no-cache",
         "Cache-Control": "no-cache",
     }
-    response = requests.request("GET", url, headers=custom_headers)
+    response = HTTP.request("GET", url, headers=custom_headers)
+    response.raise_for_status()
 
     client_id = config.get("APIKeys", "IGDBID")
     client_secret = config.get("APIKeys", "IGDBSECRET")
 
     if response.status_code == 200 and client_id and client_secret:
-        grant_type = "client_credentials"
-        get_access_token = f"https://id.twitch.tv/oauth2/token?client_id={client_id}&client_secret={client_secret}&grant_type={grant_type}"
-        token_req = requests.request("POST", get_access_token)
-        token = token_req.json()
-        if "message" in token and token["message"] == "invalid client secret":
-            print("Invalid client secret")
-            return None
-        if "access_token" not in token:
-            return None
-        token = token["access_token"]
-
-        headers = {
-            "Accept": "application/json",
-            "Authorization": f"Bearer {token}",
-            "Client-ID": client_id,
-        }
-
-        games = response.json()["game_suggest"]
+        suggestions = response.json()["game_suggest"]
+        games = getIGDBGames(
+            [suggestion["id"] for suggestion in suggestions], client_id, client_secret
+        )
 
-        for i in games:
-            game = i
-            game_id = game["id"]
-            url = "https://api.igdb.com/v4/games"
-            body = f"fields name, cover.*, summary, total_rating, first_release_date, genres.*, platforms.*; where id = {game_id};"
-            response = requests.request("POST", url, headers=headers, data=body)
-            if len(response.json()) == 0:
+        # The suggestions are tried in their order, until one is on the console
+        for suggestion in suggestions:
+            if suggestion["id"] not in games:
                 break
-            game = response.json()[0]
+            game = games[suggestion["id"]]
             if "platforms" in game:
                 game_platforms = game["platforms"]
                 try:
@@ -967,7 +1211,7 @@ def IGDBRequest(url: str, console: str) -> Dict | None:
     return None
 
 
-def getSeries(library_name: str) -> None:
+def getSeries(library_name: str, full: bool = False) -> None:
     allSeriesPath = Libraries.query.filter_by(name=library_name).first().folder
 
     if overrides.have_override("scan_serie"):
@@ -976,6 +1220,11 @@ def getSeries(library_name: str) -> None:
     if not os.path.exists(allSeriesPath):
         return
 
+    plan = plan_scan(library_name, allSeriesPath, full)
+    if plan.is_empty():
+        plan.commit()
+        return
+
     allSeries = os.listdir(allSeriesPath)
     allSeriesName = []
     for dir in allSeries:
@@ -993,6 +1242,10 @@ def getSeries(library_name: str) -> None:
             continue
 
         seriePath = serie
+        # The TMDb lookups are only made for the series with new files
+        if not plan.touches(seriePath):
+            continue
+
         serieTitle = serie.split("/")[-1]
         originalSerieTitle = serieTitle
 
@@ -1019,12 +1272,15 @@ def getSeries(library_name: str) -> None:
         except TMDbException as e:
             log_message = f"Error while searching serie {serieTitle}: {e}"
             log("ERROR", "SERIE SEARCH", log_message)
+            plan.discard()
             break
 
         search = search.results
         search = transformToDict(search)
 
         if search == {}:
+            # Searched again by the next scan, TMDb may know it by then
+            plan.fail(seriePath)
             continue
 
         askForGoodSerie = "false"
@@ -1445,6 +1701,7 @@ def getSeries(library_name: str) -> None:
                                     except TMDbException as e:
                                         log_message = f"Error while getting episode {episodeIndex} of season {season_number} of serie {serieTitle}: {e}"
                                         log("ERROR", "SERIE SCAN", log_message)
+                                        plan.fail(slug)
                                         continue
                                     realEpisodeName = episodeDetails.name
                                     episodeInfo = showEpisode.details(
@@ -1497,6 +1754,7 @@ def getSeries(library_name: str) -> None:
                                         tmdb_id=season_id
                                     ).first()
                                     thisSeason.number_of_episode_in_folder += 1
+                                    get_probe(slug)
                                     try:
                                         DB.session.add(episodeData)
                                         DB.session.commit()
@@ -1521,6 +1779,8 @@ def getSeries(library_name: str) -> None:
         print_loading(allFiles, index, file)
 
         slug = path_join(allSeriesPath, file)
+        if not plan.needs_scan(slug):
+            continue
         exists = Episodes.query.filter_by(slug=slug).first() is not None
         if not exists:
             guess = guessit(file)
@@ -1854,6 +2114,7 @@ def getSeries(library_name: str) -> None:
                     )
                     thisSeason = Seasons.query.filter_by(tmdb_id=season_id).first()
                     thisSeason.number_of_episode_in_folder += 1
+                    get_probe(slug)
                     try:
                         DB.session.add(episodeData)
                         DB.session.commit()
@@ -1878,7 +2139,7 @@ def getSeries(library_name: str) -> None:
                 season_id = season.id
                 allEpisodes = Episodes.query.filter_by(id=season_id).all()
                 for episode_data in allEpisodes:
-                    if not os.path.exists(episode_data.slug):
+                    if plan.is_removed(episode_data.slug):
                         try:
                             DB.session.delete(episode_data)
                             DB.session.commit()
@@ -1908,13 +2169,20 @@ def getSeries(library_name: str) -> None:
                 DB.session.delete(Series.query.filter_by(tmdb_id=serie_id).first())
                 DB.session.commit()
 
+    plan.commit()
 
-def getGames(library_name: str) -> None:
+
+def getGames(library_name: str, full: bool = False) -> None:
     allGamesPath = Libraries.query.filter_by(name=library_name).first().folder
 
     if overrides.have_override("scan_game"):
         return overrides.execute_override("scan_game", allGamesPath, library_name)
 
+    plan = plan_scan(library_name, allGamesPath, full)
+    if plan.is_empty():
+        plan.commit()
+        return
+
     try:
         allConsoles = [
             name
@@ -2004,12 +2272,17 @@ def getGames(library_name: str) -> None:
             )
             break
 
+        if not plan.touches(f"{allGamesPath}/{console}"):
+            continue
+
         print_loading(allConsoles, index, console)
 
         allFiles = os.listdir(f"{allGamesPath}/{console}")
         index = 0
         for file in allFiles:
             index += 1
+            if not plan.needs_scan(f"{allGamesPath}/{console}/{file}"):
+                continue
             # get all games in the db
             allGamesInDB = Games.query.filter_by(
                 library_name=library_name, console=console
@@ -2039,7 +2312,12 @@ def getGames(library_name: str) -> None:
 
                     file, extension = os.path.splitext(file)
 
-                    gameIGDB = searchGame(file, console)
+                    try:
+                        gameIGDB = searchGame(file, console)
+                    except requests.RequestException as e:
+                        log("ERROR", "GAME SCAN", f"Can't search {file} on IGDB: {e}")
+                        plan.fail(f"{allGamesPath}/{console}/{newFileName}")
+                        continue
 
                     if gameIGDB is not None and gameIGDB != {} and not exists:
                         gameName = gameIGDB["title"]
@@ -2131,7 +2409,13 @@ def getGames(library_name: str) -> None:
                             os.remove(f"{allGamesPath}/{console}/{file}")
                         file, extension = os.path.splitext(file)
 
-                        gameIGDB = searchGame(file, console)
+                        try:
+                            gameIGDB = searchGame(file, console)
+                        except requests.RequestException as e:
+                            log_message = f"Can't search {file} on IGDB: {e}"
+                            log("ERROR", "GAME SCAN", log_message)
+                            plan.fail(f"{allGamesPath}/{console}/{newFileName}")
+                            continue
                         if gameIGDB is not None and gameIGDB != {}:
                             gameName = gameIGDB["title"]
                             gameRealTitle = newFileName
@@ -2178,18 +2462,36 @@ def getGames(library_name: str) -> None:
                 DB.session.delete(game)
                 DB.session.commit()
 
+    plan.commit()
 
-def getOthersVideos(library: str, allVideosPath: str | None = None) -> None:
+
+def getOthersVideos(
+    library: str, allVideosPath: str | None = None, full: bool = False
+) -> None:
     if not allVideosPath:
         allVideosPath = Libraries.query.filter_by(name=library).first().folder
-        try:
-            allVideos = os.listdir(allVideosPath)
-        except Exception as e:
-            log_message = f"Error while getting others videos in {allVideosPath} : {e}"
-            log("ERROR", "OTHER SCAN", log_message)
-            return
-    else:
-        allVideos = os.listdir(allVideosPath)
+    if not os.path.isdir(allVideosPath):
+        log_message = f"Error while getting others videos in {allVideosPath}"
+        log("ERROR", "OTHER SCAN", log_message)
+        return
+
+    plan = plan_scan(library, allVideosPath, full)
+    if plan.is_empty():
+        plan.commit()
+        return
+
+    scanOthersVideos(library, allVideosPath, plan)
+
+    for videoObj in OthersVideos.query.filter_by(library_name=library).all():
+        if plan.is_removed(videoObj.slug):
+            DB.session.delete(videoObj)
+            DB.session.commit()
+
+    plan.commit()
+
+
+def scanOthersVideos(library: str, allVideosPath: str, plan: ScanPlan) -> None:
+    allVideos = os.listdir(allVideosPath)
 
     allDirectories = [
         video for video in allVideos if os.path.isdir(f"{allVideosPath}/{video}")
@@ -2198,15 +2500,19 @@ def getOthersVideos(library: str, allVideosPath: str | None = None) -> None:
 
     for directory in allDirectories:
         directoryPath = f"{allVideosPath}/{directory}"
-        getOthersVideos(library, directoryPath)
+        if plan.touches(directoryPath):
+            scanOthersVideos(library, directoryPath, plan)
     index = 0
     for video in allVideos:
         index += 1
         title, extension = os.path.splitext(video)
 
+        slug = f"{allVideosPath}/{video}"
+        if not plan.needs_scan(slug):
+            continue
+
         print_loading(allVideos, index, title)
 
-        slug = f"{allVideosPath}/{video}"
         exists = OthersVideos.query.filter_by(slug=slug).first() is not None
         if not exists:
             with open(slug, "rb") as f:
@@ -2217,7 +2523,11 @@ def getOthersVideos(library: str, allVideosPath: str | None = None) -> None:
 
             # Récupération des 10 premiers caractères
             hash = video_hash_hex[:10]
-            videoDuration = length_video(slug)
+            videoDuration = get_duration(slug)
+            if not videoDuration:
+                # Not readable yet (still being copied), probed again next time
+                plan.fail(slug)
+                continue
             middle = videoDuration // 2
             banner = f"{IMAGES_PATH}/Other_Banner_{library}_{hash}.webp"
             command = [
@@ -2232,8 +2542,12 @@ def getOthersVideos(library: str, allVideosPath: str | None = None) -> None:
                 "-y",
             ]
             try:
-                subprocess.run(
-                    command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                PROCESSES.run(
+                    command,
+                    BACKGROUND_JOB,
+                    timeout=BANNER_TIMEOUT,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
                 )
                 if os.path.getsize(f"{banner}") == 0:
                     generateImage(title, library, f"{banner}")
@@ -2250,19 +2564,18 @@ def getOthersVideos(library: str, allVideosPath: str | None = None) -> None:
             DB.session.add(video)
             DB.session.commit()
 
-    for videoObj in OthersVideos.query.filter_by(library_name=library).all():
-        path = videoObj.slug
-        if not os.path.exists(path):
-            DB.session.delete(video)
-            DB.session.commit()
-
 
-def getMusics(library: str) -> None:
+def getMusics(library: str, full: bool = False) -> None:
     allMusicsPath = Libraries.query.filter_by(name=library).first().folder
 
     if overrides.have_override("scan_music"):
         return overrides.execute_override("scan_music", allMusicsPath, library)
 
+    plan = plan_scan(library, allMusicsPath, full)
+    if plan.is_empty():
+        plan.commit()
+        return
+
     allMusics = os.listdir(allMusicsPath)
 
     allArtists = [
@@ -2270,6 +2583,8 @@ def getMusics(library: str) -> None:
     ]
 
     for artist in allArtists:
+        if not plan.touches(f"{allMusicsPath}/{artist}"):
+            continue
         filesAndDirs = os.listdir(f"{allMusicsPath}/{artist}")
         allAlbums = [
             dire
@@ -2295,6 +2610,8 @@ def getMusics(library: str) -> None:
         index = 0
         for album in allAlbums:
             index += 1
+            if not plan.touches(f"{startPath}/{album}"):
+                continue
             albumGuessedData = guessit(album)
             if "title" in albumGuessedData:
                 albumName = albumGuessedData["title"]
@@ -2305,13 +2622,19 @@ def getMusics(library: str) -> None:
             allTracks = [track for track in allTracks if is_music_file(track)]
             try:
                 album_data = createAlbum(albumName, artist_id, allTracks, library)
-            except deezer_main.exceptions.DeezerErrorResponse:
+            except deezer_main.exceptions.DeezerAPIException as e:
+                log("ERROR", "MUSIC SCAN", f"Can't get the album {albumName}: {e}")
+                album_data = None
+            if album_data is None:
+                plan.fail(f"{startPath}/{album}")
                 continue
 
             album_id = album_data.id
 
             for track in allTracks:
                 slug = f"{startPath}/{album}/{track}"
+                if not plan.needs_scan(slug):
+                    continue
 
                 exists = Tracks.query.filter_by(slug=slug).first() is not None
                 if exists:
@@ -2373,6 +2696,8 @@ def getMusics(library: str) -> None:
         for track in allFiles:
             index += 1
             slug = f"{startPath}/{track}"
+            if not plan.needs_scan(slug):
+                continue
 
             exists = Tracks.query.filter_by(slug=slug).first() is not None
             if exists:
@@ -2432,7 +2757,7 @@ def getMusics(library: str) -> None:
     allTracks = Tracks.query.filter_by(library_name=library).all()
     for trackData in allTracks:
         path = trackData.slug
-        if not os.path.exists(path):
+        if plan.is_removed(path):
             DB.session.delete(trackData)
             DB.session.commit()
 
@@ -2454,22 +2779,25 @@ def getMusics(library: str) -> None:
             DB.session.commit()
             continue
 
+    plan.commit()
+
 
-def getBooks(library: str) -> None:
+def getBooks(library: str, full: bool = False) -> None:
     allBooksPath = Libraries.query.filter_by(name=library).first().folder
 
     if overrides.have_override("scan_book"):
         return overrides.execute_override("scan_book", allBooksPath, library)
 
-    allBooks = os.walk(allBooksPath)
-    books = []
-
-    for root, dirs, files in allBooks:
-        for file in files:
-            path = f"{root}/{file}".replace("\\", "/")
+    plan = plan_scan(library, allBooksPath, full)
+    if plan.is_empty():
+        plan.commit()
+        return
 
-            if is_book_file(file):
-                books.append(path)
+    books = [
+        path.replace("\\", "/")
+        for path in plan.added + plan.changed
+        if is_book_file(path)
+    ]
 
     imageFunctions = {
         ".pdf": getPDFCover,
@@ -2503,7 +2831,16 @@ def getBooks(library: str) -> None:
                 DB.session.add(book)
                 DB.session.commit()
                 book_id = book.id
-                book_cover, book_type = imageFunctions[extension](slug, name, book_id)
+                try:
+                    book_cover, book_type = imageFunctions[extension](
+                        slug, name, book_id
+                    )
+                except Exception as e:
+                    log("ERROR", "BOOK SCAN", f"Can't read the cover of {slug}: {e}")
+                    DB.session.delete(book)
+                    DB.session.commit()
+                    plan.fail(slug)
+                    continue
                 book.cover = book_cover
                 book.book_type = book_type
                 DB.session.commit()
@@ -2512,10 +2849,12 @@ def getBooks(library: str) -> None:
 
     allBooksInDb = Books.query.filter_by(library_name=library).all()
     for book in allBooksInDb:
-        if not os.path.exists(book.slug):
+        if plan.is_removed(book.slug):
             DB.session.delete(book)
             DB.session.commit()
 
+    plan.commit()
+
 
 def getPDFCover(path: str, name: str, id: int) -> Tuple[str, str]:
     pdfDoc = fitz.open(path)
@@ -596,6 +596,7 @@ class Libraries(DB.Model):  # type: ignore
     type : str
     folder : str
     available_for : str
+    ladder : str
     """
 
     id = DB.Column(DB.Integer, autoincrement=True, primary_key=True)
@@ -604,6 +605,7 @@ class Libraries(DB.Model):  # type: ignore
     type = DB.Column(DB.Text)
     folder = DB.Column(DB.Text)
     available_for = DB.Column(DB.Text)
+    ladder = DB.Column(DB.Text, nullable=True)
 
     def __init__(self, name, image, type, folder, available_for):
         self.name = name
@@ -732,3 +734,168 @@ class LibrariesMerge(DB.Model):  # type: ignore
 
     def __repr__(self) -> str:
         return f"<LibrariesMerge {self.parent_lib}>"
+
+
+class MediaKeyframes(DB.Model):  # type: ignore
+    """
+    MediaKeyframes model
+
+    This table is used to store the keyframes of the video files,
+    to cut the HLS segments on real keyframes without probing the file again
+
+    ...
+
+    Attributes
+    ----------
+    path : str
+    identity : str
+    keyframes : str
+    duration : float
+    """
+
+    id = DB.Column(DB.Integer, autoincrement=True, primary_key=True)
+    path = DB.Column(DB.Text, unique=True)
+    identity = DB.Column(DB.Text)
+    keyframes = DB.Column(DB.Text)
+    duration = DB.Column(DB.Float)
+
+    def __repr__(self) -> str:
+        return f"<MediaKeyframes {self.path}>"
+
+
+class MediaProbe(DB.Model):  # type: ignore
+    """
+    MediaProbe model
+
+    This table is used to store the result of ffprobe for the video files,
+    so the file is probed once instead of on every request
+
+    ...
+
+    Attributes
+    ----------
+    path : str
+    identity : str
+    duration : float
+    width : int
+    height : int
+    video_codec : str
+    video_profile : str
+    pixel_format : str
+    bitrate : int
+    video_bitrate : int
+    frame_rate : float
+    audio_streams : str
+    subtitle_streams : str
+    """
+
+    id = DB.Column(DB.Integer, autoincrement=True, primary_key=True)
+    path = DB.Column(DB.Text, unique=True)
+    identity = DB.Column(DB.Text)
+    duration = DB.Column(DB.Float)
+    width = DB.Column(DB.Integer)
+    height = DB.Column(DB.Integer)
+    video_codec = DB.Column(DB.String(255))
+    video_profile = DB.Column(DB.String(255))
+    pixel_format = DB.Column(DB.String(255))
+    bitrate = DB.Column(DB.Integer)
+    video_bitrate = DB.Column(DB.Integer)
+    frame_rate = DB.Column(DB.Float)
+    audio_streams = DB.Column(DB.Text)
+    subtitle_streams = DB.Column(DB.Text)
+
+    def __repr__(self) -> str:
+        return f"<MediaProbe {self.path}>"
+
+
+class PlaybackSessions(DB.Model):  # type: ignore
+    """
+    PlaybackSessions model
+
+    This table is used to share the state of the playback sessions
+    between the workers, when the playback store is the database
+
+    ...
+
+    Attributes
+    ----------
+    key : str
+    state : str
+    last_access : float
+    """
+
+    id = DB.Column(DB.Integer, autoincrement=True, primary_key=True)
+    key = DB.Column(DB.String(255), unique=True)
+    state = DB.Column(DB.Text)
+    last_access = DB.Column(DB.Float)
+
+    def __repr__(self) -> str:
+        return f"<PlaybackSessions {self.key}>"
+
+
+class PretranscodeJobs(DB.Model):  # type: ignore
+    """
+    PretranscodeJobs model
+
+    This table is used to keep the queue of the pre-transcode jobs, one per
+    media and quality, so the jobs resume after a restart
+
+    ...
+
+    Attributes
+    ----------
+    media_type : str
+    media_id : int
+    path : str
+    quality : str
+    status : str
+    progress : int
+    total : int
+    error : str
+    """
+
+    id = DB.Column(DB.Integer, autoincrement=True, primary_key=True)
+    media_type = DB.Column(DB.String(255))
+    media_id = DB.Column(DB.Integer)
+    path = DB.Column(DB.Text)
+    quality = DB.Column(DB.String(255))
+    status = DB.Column(DB.String(255))
+    progress = DB.Column(DB.Integer)
+    total = DB.Column(DB.Integer)
+    error = DB.Column(DB.Text)
+
+    def __repr__(self) -> str:
+        return f"<PretranscodeJobs {self.media_type} {self.media_id} {self.quality}>"
+
+
+class FileState(DB.Model):  # type: ignore
+    """
+    FileState model
+
+    This table is used to keep the stats of the files and directories of the
+    libraries at their last scan, so a rescan only goes through the changes
+
+    ...
+
+    Attributes
+    ----------
+    library_name : str
+    path : str
+    is_directory : bool
+    size : int
+    mtime : float
+    inode : int
+    scanned_at : float
+    """
+
+    id = DB.Column(DB.Integer, autoincrement=True, primary_key=True)
+    library_name = DB.Column(DB.String(255), index=True)
+    path = DB.Column(DB.Text)
+    is_directory = DB.Column(DB.Boolean)
+    size = DB.Column(DB.Integer)
+    mtime = DB.Column(DB.Float)
+    inode = DB.Column(DB.Integer)
+    scanned_at = DB.Column(DB.Float)
+
+    def __repr__(self) -> str:
+        return f"<FileState {self.path}>"
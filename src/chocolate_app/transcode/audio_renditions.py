@@ -0,0 +1,279 @@
+import os
+import mmap
+import time
+import uuid
+import queue
+import struct
+import threading
+import subprocess
+
+from array import array
+from functools import lru_cache
+from typing import Set, Tuple
+
+from chocolate_app import ARTEFACTS_PATH, AUDIO_CACHE_SIZE
+from chocolate_app.utils.utils import file_identity, log
+from chocolate_app.utils.processes import PROCESSES, BACKGROUND_JOB
+from chocolate_app.transcode.keyframes import Segment, MPEGTS_CLOCK, MPEGTS_OFFSET
+from chocolate_app.transcode.segment_cache import SegmentCache
+from chocolate_app.transcode.scheduler import (
+    BACKGROUND_SCHEDULER,
+    TranscodeBusy,
+    PREFETCH,
+)
+
+AUDIO_RENDITIONS = SegmentCache(f"{ARTEFACTS_PATH}/audio", AUDIO_CACHE_SIZE, "aac")
+RENDITION_OWNER = "audio-rendition"
+
+SAMPLE_RATE = 48000
+# Samples in an AAC frame
+FRAME_SAMPLES = 1024
+# The encoder starts with a frame of silence
+PRIMING_FRAMES = 1
+PRIMING_DURATION = PRIMING_FRAMES * FRAME_SAMPLES / SAMPLE_RATE
+# AAC-LC, for the CODECS of the playlists
+AUDIO_CODEC = "mp4a.40.2"
+TIMESTAMP_OWNER = b"com.apple.streaming.transportStreamTimestamp\x00"
+# The same format is used for the chunks encoded on the fly, so both kinds of
+# segments can be mixed in a playlist
+AUDIO_ARGUMENTS = [
+    "-ac",
+    "2",
+    "-ar",
+    str(SAMPLE_RATE),
+    "-c:a",
+    "aac",
+    "-b:a",
+    "192k",
+    "-f",
+    "adts",
+]
+
+# The whole file is read to encode the track
+RENDITION_TIMEOUT = 60 * 60
+RETRY_DELAY = 30
+MAX_RETRIES = 10
+MAX_PENDING = 64
+
+
+def rendition_key(path: str, audio_idx: int) -> str:
+    return SegmentCache.make_key(
+        "audio", file_identity(path), audio_idx, " ".join(AUDIO_ARGUMENTS)
+    )
+
+
+def get_audio_rendition(path: str, audio_idx: int) -> str | None:
+    """
+    Get the encoded version of an audio track of a file
+
+    Returns:
+        str | None: The path of the ADTS file, None if it isn't encoded yet
+    """
+    return AUDIO_RENDITIONS.get(rendition_key(path, audio_idx))
+
+
+def get_timestamp_tag(seconds: float) -> bytes:
+    """
+    Build the ID3 tag giving the timestamp of a segment of raw AAC, on the
+    90 kHz clock of the video segments, so the player lines the segments up
+    without a discontinuity
+
+    Args:
+        seconds (float): The time of the first frame of the segment in the file
+
+    Returns:
+        bytes: The tag, to put before the frames
+    """
+    timestamp = (round(seconds * MPEGTS_CLOCK) + MPEGTS_OFFSET) & (2**33 - 1)
+    data = TIMESTAMP_OWNER + struct.pack(">Q", timestamp)
+    # The sizes are below 128, so they don't need the ID3 synchsafe encoding
+    frame = b"PRIV" + struct.pack(">I", len(data)) + b"\x00\x00" + data
+    return b"ID3\x04\x00\x00" + struct.pack(">I", len(frame)) + frame
+
+
+def get_chunk_tag(segment: Segment) -> bytes:
+    """
+    Build the timestamp tag of a chunk encoded on the fly, which starts with
+    the priming frame of the encoder
+    """
+    return get_timestamp_tag(segment[0] - PRIMING_DURATION)
+
+
+def get_frame_offsets(rendition_path: str) -> array:
+    """
+    Index the frames of an ADTS file, each frame header holds its length
+
+    Args:
+        rendition_path (str): The path of the ADTS file
+
+    Returns:
+        array: The offset of each frame, and the size of the file last
+    """
+    # The mtime is the last access of the cache entry, a new file of the
+    # same path is told apart by its inode
+    stat = os.stat(rendition_path)
+    return index_frames(rendition_path, stat.st_ino, stat.st_size)
+
+
+@lru_cache(maxsize=16)
+def index_frames(rendition_path: str, inode: int, size: int) -> array:
+    offsets = array("Q")
+    if not size:
+        return array("Q", [0])
+
+    offset = 0
+    with open(rendition_path, "rb") as file:
+        # Only the headers are read, the file isn't loaded in memory
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            while offset + 7 <= size:
+                offsets.append(offset)
+                length = (
+                    ((data[offset + 3] & 0x03) << 11)
+                    | (data[offset + 4] << 3)
+                    | (data[offset + 5] >> 5)
+                )
+                if not length:
+                    break
+                offset += length
+    offsets.append(min(offset, size))
+    return offsets
+
+
+def frame_index(seconds: float) -> int:
+    return round(seconds * SAMPLE_RATE / FRAME_SAMPLES) + PRIMING_FRAMES
+
+
+def read_rendition_segment(rendition_path: str, segment: Segment) -> bytes | None:
+    """
+    Cut a segment out of an audio rendition, on the AAC frames, without ffmpeg
+
+    Args:
+        rendition_path (str): The path of the ADTS file
+        segment (Segment): The start and end of the segment
+
+    Returns:
+        bytes | None: The timestamp tag and the frames of the segment, None if
+        the rendition has been evicted meanwhile
+    """
+    start, end = segment
+    try:
+        offsets = get_frame_offsets(rendition_path)
+        last = len(offsets) - 1
+        first_frame = min(frame_index(start), last)
+        first_offset = offsets[first_frame]
+        end_offset = offsets[min(frame_index(end), last)]
+        with open(rendition_path, "rb") as file:
+            file.seek(first_offset)
+            data = file.read(end_offset - first_offset)
+    except OSError:
+        return None
+
+    seconds = (first_frame - PRIMING_FRAMES) * FRAME_SAMPLES / SAMPLE_RATE
+    return get_timestamp_tag(seconds) + data
+
+
+def encode_rendition(path: str, audio_idx: int) -> None:
+    key = rendition_key(path, audio_idx)
+    temp_path = f"{AUDIO_RENDITIONS.path}/{uuid.uuid4().hex}.tmp"
+    os.makedirs(AUDIO_RENDITIONS.path, exist_ok=True)
+
+    command = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        path,
+        "-map",
+        f"0:a:{audio_idx}",
+        "-vn",
+        # Pad or trim the start, so the frames line up with the video
+        "-af",
+        "aresample=async=1:first_pts=0",
+        *AUDIO_ARGUMENTS,
+        temp_path,
+    ]
+
+    slot = BACKGROUND_SCHEDULER.acquire(RENDITION_OWNER, PREFETCH, RETRY_DELAY)
+    try:
+        result = PROCESSES.run(
+            command,
+            BACKGROUND_JOB,
+            timeout=RENDITION_TIMEOUT,
+            owner=RENDITION_OWNER,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    finally:
+        slot.release()
+
+    try:
+        if result.returncode != 0:
+            log(
+                "ERROR",
+                "AUDIO",
+                f"Error while encoding the audio {audio_idx} of {path}",
+            )
+            return
+        AUDIO_RENDITIONS.put_file(key, temp_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class AudioRenditionEncoder:
+    """
+    Encode the selected audio tracks once per file, one at a time in a
+    background thread
+
+    The encode waits for the background slot, the chunks are encoded on the
+    fly until the rendition is ready. A track still waiting after MAX_RETRIES
+    tries is dropped, until the next time it's requested.
+    """
+
+    def __init__(self) -> None:
+        self.jobs: queue.Queue[Tuple[str, int, int]] = queue.Queue(MAX_PENDING)
+        self.pending: Set[str] = set()
+        self.failed: Set[str] = set()
+        self.lock = threading.Lock()
+        self.worker: threading.Thread | None = None
+
+    def request(self, path: str, audio_idx: int) -> None:
+        key = rendition_key(path, audio_idx)
+        with self.lock:
+            if key in self.pending or key in self.failed or self.jobs.full():
+                return
+            if AUDIO_RENDITIONS.get(key):
+                return
+            self.pending.add(key)
+            self.jobs.put((path, audio_idx, 0))
+
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, daemon=True)
+                self.worker.start()
+
+    def run(self) -> None:
+        while True:
+            path, audio_idx, retries = self.jobs.get()
+            key = rendition_key(path, audio_idx)
+            try:
+                encode_rendition(path, audio_idx)
+                if not AUDIO_RENDITIONS.get(key):
+                    # Not tried again until the file changes
+                    self.failed.add(key)
+            except TranscodeBusy:
+                if retries + 1 < MAX_RETRIES:
+                    time.sleep(RETRY_DELAY)
+                    try:
+                        self.jobs.put_nowait((path, audio_idx, retries + 1))
+                        continue
+                    except queue.Full:
+                        pass
+            except Exception as e:
+                log("ERROR", "AUDIO", f"Error while encoding an audio track: {e}")
+
+            with self.lock:
+                self.pending.discard(key)
+
+
+AUDIO_RENDITION_ENCODER = AudioRenditionEncoder()
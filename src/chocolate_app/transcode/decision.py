@@ -0,0 +1,148 @@
+import os
+import json
+
+from typing import List
+
+from chocolate_app.tables import MediaProbe
+
+DIRECT_PLAY = "direct"
+REMUX = "remux"
+TRANSCODE = "transcode"
+
+DEFAULT_VIDEO_CODECS = ["h264"]
+DEFAULT_AUDIO_CODECS = ["aac", "mp3"]
+DEFAULT_CONTAINERS = ["mp4"]
+
+# Video codecs that can be copied as is in the MPEG-TS segments
+REMUX_VIDEO_CODECS = ["h264"]
+
+# The profiles and the pixel formats the players decode, by video codec. H.264
+# is only decoded in 8 bits 4:2:0, not in High 10 (Hi10P), 4:2:2 or 4:4:4
+VIDEO_PROFILES = {"h264": ["constrained baseline", "baseline", "main", "high"]}
+PIXEL_FORMATS = {"h264": ["yuv420p", "yuvj420p"]}
+
+CONTAINER_EXTENSIONS = {
+    "mp4": "mp4",
+    "m4v": "mp4",
+    "mov": "mov",
+    "mkv": "mkv",
+    "webm": "webm",
+}
+
+# The audio files a browser can read, when it supports their codec
+AUDIO_EXTENSIONS = ["mp3", "m4a", "aac", "ogg", "oga", "opus", "flac", "wav"]
+
+
+class ClientCapabilities:
+    def __init__(
+        self, video_codecs: List[str], audio_codecs: List[str], containers: List[str]
+    ) -> None:
+        self.video_codecs = video_codecs
+        self.audio_codecs = audio_codecs
+        self.containers = containers
+
+
+def parse_list(value: str | None, default: List[str]) -> List[str]:
+    if not value:
+        return default
+    return [item.strip().lower() for item in value.split(",") if item.strip()]
+
+
+def get_client_capabilities(args) -> ClientCapabilities:
+    """
+    Read the capabilities declared by the client in the query string, for
+    example ?video_codecs=h264,hevc&audio_codecs=aac,opus&containers=mp4,mkv
+
+    Args:
+        args: The query string of the request
+
+    Returns:
+        ClientCapabilities: The capabilities of the client
+    """
+    return ClientCapabilities(
+        parse_list(args.get("video_codecs"), DEFAULT_VIDEO_CODECS),
+        parse_list(args.get("audio_codecs"), DEFAULT_AUDIO_CODECS),
+        parse_list(args.get("containers"), DEFAULT_CONTAINERS),
+    )
+
+
+def get_container(path: str) -> str | None:
+    extension = os.path.splitext(path)[1][1:].lower()
+    return CONTAINER_EXTENSIONS.get(extension)
+
+
+def is_video_supported(probe: MediaProbe, capabilities: ClientCapabilities) -> bool:
+    """
+    Check if the client can decode the video stream of a file, from its codec,
+    its profile and its pixel format
+    """
+    video_codec = (probe.video_codec or "").lower()
+    if video_codec not in capabilities.video_codecs:
+        return False
+
+    profile = (probe.video_profile or "").lower()
+    if profile and profile not in VIDEO_PROFILES.get(video_codec, [profile]):
+        return False
+
+    pixel_format = (probe.pixel_format or "").lower()
+    return not pixel_format or pixel_format in PIXEL_FORMATS.get(
+        video_codec, [pixel_format]
+    )
+
+
+def decide_playback(
+    path: str, probe: MediaProbe, capabilities: ClientCapabilities
+) -> str:
+    """
+    Choose how a media is sent to a client
+
+    Args:
+        path (str): The path of the file
+        probe (MediaProbe): The probe of the file
+        capabilities (ClientCapabilities): The capabilities of the client
+
+    Returns:
+        str: DIRECT_PLAY if the file can be sent as is, REMUX if the video
+        stream can be copied in the HLS segments, TRANSCODE otherwise
+    """
+    # A stream the client can't decode can't be copied in the segments either
+    if not is_video_supported(probe, capabilities):
+        return TRANSCODE
+
+    audio_streams = json.loads(probe.audio_streams or "[]")
+    audio_supported = not audio_streams or (
+        (audio_streams[0]["codec"] or "").lower() in capabilities.audio_codecs
+    )
+
+    if audio_supported and get_container(path) in capabilities.containers:
+        return DIRECT_PLAY
+
+    if (probe.video_codec or "").lower() in REMUX_VIDEO_CODECS:
+        return REMUX
+
+    return TRANSCODE
+
+
+def decide_track_playback(
+    path: str, probe: MediaProbe, capabilities: ClientCapabilities
+) -> str:
+    """
+    Choose how a music track is sent to a client
+
+    Args:
+        path (str): The path of the file
+        probe (MediaProbe): The probe of the file
+        capabilities (ClientCapabilities): The capabilities of the client
+
+    Returns:
+        str: DIRECT_PLAY if the file can be sent as is, TRANSCODE otherwise
+    """
+    audio_streams = json.loads(probe.audio_streams or "[]")
+    if not audio_streams:
+        return TRANSCODE
+
+    extension = os.path.splitext(path)[1][1:].lower()
+    audio_codec = (audio_streams[0]["codec"] or "").lower()
+    if extension in AUDIO_EXTENSIONS and audio_codec in capabilities.audio_codecs:
+        return DIRECT_PLAY
+    return TRANSCODE
@@ -0,0 +1,232 @@
+import time
+import bisect
+import threading
+import subprocess
+
+from typing import Dict, List, Tuple
+
+from chocolate_app import DB, FAST_START, VIDEO_CHUNK_LENGTH
+from chocolate_app.tables import MediaKeyframes
+from chocolate_app.utils.utils import file_identity
+from chocolate_app.utils.processes import PROCESSES
+from chocolate_app.utils.single_flight import SingleFlight
+from chocolate_app.transcode.probe import get_duration
+
+Segment = Tuple[float, float]
+
+# The mpegts muxer of ffmpeg delays the timestamps of the video segments by
+# 1.4 seconds, on its 90 kHz clock
+MPEGTS_CLOCK = 90000
+MPEGTS_OFFSET = 126000
+
+INDEX_LOCK = threading.Lock()
+# Reading the packets of a large remux takes a while
+KEYFRAMES_TIMEOUT = 15 * 60
+KEYFRAMES: Dict[str, Tuple[List[float], float]] = {}
+KEYFRAMES_FLIGHTS = SingleFlight()
+# A file that couldn't be indexed is tried again after this delay
+KEYFRAMES_RETRY_DELAY = 5 * 60
+FAILED_INDEXES: Dict[Tuple[str, str], float] = {}
+
+# The lengths of the first segments with the fast start
+FAST_START_LENGTHS = [4, 8, 16]
+
+
+def probe_keyframes(path: str) -> List[float]:
+    """
+    Read the timestamps of the keyframes of the first video stream, in one
+    demuxing pass (the packets are not decoded)
+
+    Args:
+        path (str): The path of the file
+
+    Returns:
+        List[float]: The keyframes, in seconds from the start of the file
+    """
+    command = [
+        "ffprobe",
+        "-loglevel",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "packet=pts_time,flags",
+        "-of",
+        "csv=p=0",
+        path,
+    ]
+    pipe = PROCESSES.popen(
+        command,
+        timeout=KEYFRAMES_TIMEOUT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    if not pipe or not pipe.stdout:
+        return []
+
+    keyframes = []
+    start = None
+    for line in pipe.stdout:
+        fields = line.decode("utf-8").strip().split(",")
+        if len(fields) < 2 or fields[0] in ("", "N/A"):
+            continue
+        pts = float(fields[0])
+        if start is None or pts < start:
+            start = pts
+        if "K" in fields[1]:
+            keyframes.append(pts)
+    pipe.wait()
+
+    if start is None:
+        return []
+
+    # ffmpeg seeks relatively to the start time of the file
+    return sorted(round(keyframe - start, 6) for keyframe in keyframes)
+
+
+def is_complete(index: MediaKeyframes | None, identity: str) -> bool:
+    return (
+        index is not None
+        and index.identity == identity
+        and bool(index.keyframes)
+        and bool(index.duration)
+    )
+
+
+def get_empty_index(path: str, identity: str, duration: float) -> MediaKeyframes:
+    return MediaKeyframes(path=path, identity=identity, keyframes="", duration=duration)
+
+
+def get_keyframe_index(path: str) -> MediaKeyframes:
+    """
+    Get the keyframe index of a file, building it on the first call
+
+    Args:
+        path (str): The path of the file
+
+    Returns:
+        MediaKeyframes: The keyframe index, an empty one that isn't stored if
+        the file couldn't be indexed
+    """
+    identity = file_identity(path)
+    index = MediaKeyframes.query.filter_by(path=path).first()
+    if is_complete(index, identity):
+        return index
+
+    failed_at = FAILED_INDEXES.get((path, identity))
+    if failed_at is not None and time.time() - failed_at < KEYFRAMES_RETRY_DELAY:
+        return get_empty_index(path, identity, get_duration(path))
+
+    # The other files are indexed meanwhile, the same one only once
+    keyframes = KEYFRAMES_FLIGHTS.do((path, identity), probe_keyframes, path)
+    duration = get_duration(path)
+    if not keyframes or not duration:
+        FAILED_INDEXES[(path, identity)] = time.time()
+        return get_empty_index(path, identity, duration)
+    FAILED_INDEXES.pop((path, identity), None)
+
+    with INDEX_LOCK:
+        # The index may have been stored by another request meanwhile
+        index = MediaKeyframes.query.filter_by(path=path).populate_existing().first()
+        if is_complete(index, identity):
+            return index
+
+        if not index:
+            index = MediaKeyframes(path=path)
+            DB.session.add(index)
+        index.identity = identity
+        index.keyframes = ",".join(str(keyframe) for keyframe in keyframes)
+        index.duration = duration
+        DB.session.commit()
+        return index
+
+
+def compute_segments(
+    keyframes: List[float], duration: float, start: float = 0.0
+) -> List[Segment]:
+    """
+    Cut the file on the first keyframe after every VIDEO_CHUNK_LENGTH seconds,
+    or on a fixed grid if the keyframes are unknown
+
+    With the fast start, the first segments of the file are shorter, so the
+    player gets its first frames sooner. The segment holding the start
+    position is split the same way, the other segments stay those of a
+    playback from the start, so they share its cached segments.
+
+    Returns:
+        List[Segment]: The start and end of each segment
+    """
+    # Without the keyframes, the file is cut on whole seconds
+    points = keyframes or [float(seconds) for seconds in range(int(duration))]
+    lengths = FAST_START_LENGTHS if FAST_START else []
+
+    boundaries = [0.0]
+    ramp = 0
+    for point in points:
+        if point >= duration:
+            break
+        if point <= boundaries[-1]:
+            continue
+        length = lengths[ramp] if ramp < len(lengths) else VIDEO_CHUNK_LENGTH
+        if point - boundaries[-1] >= length:
+            boundaries.append(point)
+            ramp += 1
+
+    if lengths and start > 0:
+        boundaries = split_start_segment(boundaries, points, start, duration)
+
+    return list(zip(boundaries, boundaries[1:] + [duration]))
+
+
+def split_start_segment(
+    boundaries: List[float], points: List[float], start: float, duration: float
+) -> List[float]:
+    """
+    Cut the segment holding the start position on the keyframe before it,
+    and in segments of FAST_START_LENGTHS from there
+    """
+    restart = max((point for point in points if point <= start), default=0.0)
+    index = bisect.bisect_right(boundaries, restart)
+    end = boundaries[index] if index < len(boundaries) else duration
+
+    cuts = [] if restart == boundaries[index - 1] else [restart]
+    last = restart
+    lengths = iter(FAST_START_LENGTHS)
+    length = next(lengths)
+    for point in points:
+        if point >= end:
+            break
+        if point - last < length:
+            continue
+        cuts.append(point)
+        last = point
+        length = next(lengths, None)
+        if length is None:
+            break
+
+    return boundaries[:index] + cuts + boundaries[index:]
+
+
+def get_segments(path: str, start: float = 0.0) -> List[Segment]:
+    """
+    Get the segments of a file, the index of a segment in the playlists is
+    its position in this list plus one
+
+    Args:
+        path (str): The path of the file
+        start (float): The position the playback starts at
+
+    Returns:
+        List[Segment]: The start and end of each segment
+    """
+    identity = file_identity(path)
+    if identity in KEYFRAMES:
+        keyframes, duration = KEYFRAMES[identity]
+        return compute_segments(keyframes, duration, start)
+
+    index = get_keyframe_index(path)
+    keyframes = [float(keyframe) for keyframe in index.keyframes.split(",") if keyframe]
+    # Without the index, the file is cut on the grid until it's indexed again
+    if keyframes and index.duration:
+        KEYFRAMES[identity] = (keyframes, index.duration)
+    return compute_segments(keyframes, index.duration or 0.0, start)
@@ -0,0 +1,139 @@
+from typing import List
+
+from chocolate_app.tables import Libraries, MediaProbe
+
+# The heights of the renditions below the full quality one
+DEFAULT_LADDER = [144, 240, 360, 480, 720, 1080]
+
+# Bits per pixel of a good quality h264 encode
+BITS_PER_PIXEL = 0.1
+DEFAULT_FRAME_RATE = 24.0
+# The bitrate of the most complex segments over the average bitrate
+PEAK_FACTOR = 1.5
+# A rendition needs at most this share of the bitrate of the rendition above
+MAX_BITRATE_SHARE = 0.7
+# The audio segments are stereo AAC, see audio_renditions
+AUDIO_BITRATE = 192000
+
+CODECS = {
+    144: "avc1.6e000c",
+    240: "avc1.6e0015",
+    360: "avc1.6e001e",
+    480: "avc1.6e001f",
+    720: "avc1.6e0020",
+    1080: "avc1.6e0032",
+}
+DEFAULT_CODEC = "avc1.6e0033"
+
+
+class Rendition:
+    def __init__(
+        self, quality: str, width: int, height: int, bitrate: int, codec: str
+    ) -> None:
+        self.quality = quality
+        self.width = width
+        self.height = height
+        self.bitrate = bitrate
+        self.codec = codec
+
+    @property
+    def peak_bitrate(self) -> int:
+        return int(self.bitrate * PEAK_FACTOR)
+
+    @property
+    def bandwidth(self) -> int:
+        return self.peak_bitrate + AUDIO_BITRATE
+
+    @property
+    def average_bandwidth(self) -> int:
+        return self.bitrate + AUDIO_BITRATE
+
+
+def get_ladder(library: Libraries | None) -> List[int]:
+    """
+    Get the heights of the renditions configured for a library
+
+    Args:
+        library (Libraries | None): The library of the media
+
+    Returns:
+        List[int]: The heights, from the lowest to the highest
+    """
+    if library is None or not library.ladder:
+        return DEFAULT_LADDER
+    return sorted(int(height) for height in library.ladder.split(",") if height)
+
+
+def estimate_bitrate(width: int, height: int, frame_rate: float) -> int:
+    return int(width * height * frame_rate * BITS_PER_PIXEL)
+
+
+def get_source_bitrate(probe: MediaProbe) -> int:
+    if probe.video_bitrate:
+        return probe.video_bitrate
+    if probe.bitrate:
+        return probe.bitrate
+    return estimate_bitrate(
+        probe.width or 0, probe.height or 0, probe.frame_rate or DEFAULT_FRAME_RATE
+    )
+
+
+def get_rendition(probe: MediaProbe, quality: str) -> Rendition:
+    """
+    Get the size and the bitrate of a rendition of a file
+
+    Args:
+        probe (MediaProbe): The probe of the file
+        quality (str): The height of the rendition, "default" for a transcode
+            in the size of the source, "copy" for the source video stream
+
+    Returns:
+        Rendition: The rendition
+    """
+    width = probe.width or 0
+    height = probe.height or 0
+    source_bitrate = get_source_bitrate(probe)
+    codec = CODECS.get(height, DEFAULT_CODEC)
+
+    if quality == "copy":
+        return Rendition(quality, width, height, source_bitrate, codec)
+
+    frame_rate = probe.frame_rate or DEFAULT_FRAME_RATE
+    if quality != "default":
+        new_height = int(quality)
+        width = round(width / height * new_height) if height else 0
+        width += width % 2
+        height = new_height
+        codec = CODECS.get(height, DEFAULT_CODEC)
+
+    # Encoding over the bitrate of the source doesn't bring anything back
+    bitrate = min(estimate_bitrate(width, height, frame_rate), source_bitrate)
+    return Rendition(quality, width, height, bitrate, codec)
+
+
+def build_ladder(
+    probe: MediaProbe, full_quality: str, heights: List[int]
+) -> List[Rendition]:
+    """
+    Build the renditions of a file, the ones that wouldn't save enough
+    bandwidth over the rendition above are dropped
+
+    Args:
+        probe (MediaProbe): The probe of the file
+        full_quality (str): "copy" or "default", the quality of the full size
+            rendition
+        heights (List[int]): The heights of the renditions below the full size
+
+    Returns:
+        List[Rendition]: The renditions, from the lowest to the highest
+    """
+    ladder = [get_rendition(probe, full_quality)]
+    for height in sorted(heights, reverse=True):
+        if height >= (probe.height or 0):
+            continue
+        rendition = get_rendition(probe, str(height))
+        if rendition.bitrate > ladder[-1].bitrate * MAX_BITRATE_SHARE:
+            continue
+        ladder.append(rendition)
+
+    return ladder[::-1]
@@ -0,0 +1,217 @@
+import os
+import re
+import math
+import time
+import shutil
+import threading
+import subprocess
+
+from typing import Dict
+
+from chocolate_app import ARTEFACTS_PATH, LIVE_TIMESHIFT
+from chocolate_app.utils.processes import PROCESSES, PLAYBACK_JOB
+
+# The rolling window is rewritten every few seconds, keep it in memory, but
+# the timeshift buffer is too large for it
+if os.path.isdir("/dev/shm") and not LIVE_TIMESHIFT:
+    LIVE_PATH = "/dev/shm/chocolate/live"
+else:
+    LIVE_PATH = f"{ARTEFACTS_PATH}/live"
+
+PLAYLIST_NAME = "index.m3u8"
+LIVE_SEGMENT_LENGTH = 4
+LIVE_WINDOW = 6
+# The segments kept by ffmpeg, the oldest one is deleted as each new one is
+# written, so the buffer of a channel never grows however long it's tuned
+BUFFER_SEGMENTS = max(LIVE_WINDOW, math.ceil(LIVE_TIMESHIFT / LIVE_SEGMENT_LENGTH))
+# The players start this far from the live edge of the timeshift buffer
+LIVE_EDGE_OFFSET = LIVE_SEGMENT_LENGTH * 3
+# The players reload the playlist every segment, a viewer that didn't for
+# this long has left
+VIEWER_TIMEOUT = 30
+PLAYLIST_WAIT_TIMEOUT = 20
+
+SEGMENT_NAME = re.compile(r"^\d+\.ts$")
+
+
+class LiveRelay:
+    """
+    A single upstream connection to a live channel, remuxed into a rolling
+    HLS window shared by all the viewers of the channel
+
+    With the timeshift, the window is a ring buffer of LIVE_TIMESHIFT seconds
+    on disk the viewers can pause and rewind in.
+    """
+
+    def __init__(self, channel_id: int, url: str) -> None:
+        self.channel_id = channel_id
+        self.url = url
+        self.directory = f"{LIVE_PATH}/{channel_id}"
+        self.process: subprocess.Popen | None = None
+        self.viewers: Dict[str, float] = {}
+
+    def start(self) -> None:
+        self.stop()
+        os.makedirs(self.directory, exist_ok=True)
+
+        command = ["ffmpeg", "-hide_banner", "-loglevel", "error"]
+        if self.url.startswith("http"):
+            # The IPTV providers drop the long-lived connections now and then
+            command += ["-reconnect", "1", "-reconnect_streamed", "1"]
+        command += [
+            "-i",
+            self.url,
+            "-map",
+            "0:v:0?",
+            "-map",
+            "0:a?",
+            "-c",
+            "copy",
+            "-f",
+            "hls",
+            "-hls_time",
+            str(LIVE_SEGMENT_LENGTH),
+            "-hls_list_size",
+            str(BUFFER_SEGMENTS),
+            # The segments that just left the window may still be downloaded
+            "-hls_delete_threshold",
+            str(LIVE_WINDOW),
+            "-hls_flags",
+            # The dates let the players match the buffer with the programs
+            "delete_segments+temp_file+program_date_time",
+            "-hls_segment_filename",
+            f"{self.directory}/%d.ts",
+            f"{self.directory}/{PLAYLIST_NAME}",
+        ]
+        self.process = PROCESSES.popen(
+            command,
+            PLAYBACK_JOB,
+            owner=f"live-{self.channel_id}",
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def stop(self) -> None:
+        if self.process:
+            PROCESSES.kill(self.process)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def add_viewer(self, viewer: str) -> None:
+        self.viewers[viewer] = time.time()
+
+    def has_viewers(self) -> bool:
+        now = time.time()
+        for viewer, last_seen in list(self.viewers.items()):
+            if now - last_seen > VIEWER_TIMEOUT:
+                del self.viewers[viewer]
+        return bool(self.viewers)
+
+    def wait_for_playlist(self, timeout: float) -> bool:
+        """
+        Wait until ffmpeg has written the first segments of the window
+
+        Returns:
+            bool: False if the upstream failed or timed out before
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if os.path.exists(f"{self.directory}/{PLAYLIST_NAME}"):
+                return True
+            if not self.is_running():
+                return False
+            time.sleep(0.1)
+        return False
+
+    def get_playlist(self, segment_url: str) -> str | None:
+        """
+        Get the playlist of the current window
+
+        Args:
+            segment_url (str): The url of the segments, with {} for their name
+
+        Returns:
+            str | None: The playlist, None if it hasn't been written yet
+        """
+        try:
+            with open(f"{self.directory}/{PLAYLIST_NAME}", "r") as file:
+                lines = file.read().splitlines()
+        except OSError:
+            return None
+
+        if LIVE_TIMESHIFT and lines:
+            # A live playlist as long as the buffer lets the players seek back
+            # in it. It isn't an event playlist, ffmpeg trims its head and
+            # moves the media sequence on once the buffer is full
+            lines[1:1] = [f"#EXT-X-START:TIME-OFFSET=-{LIVE_EDGE_OFFSET}"]
+        return "\n".join(
+            line if line.startswith("#") or not line else segment_url.format(line)
+            for line in lines
+        )
+
+    def segment_path(self, name: str) -> str | None:
+        if not SEGMENT_NAME.match(name):
+            return None
+        return f"{self.directory}/{name}"
+
+
+class LiveRelayManager:
+    """
+    Keep one relay per watched live channel, started by its first viewer and
+    stopped once its last viewer has left, so a channel never opens more than
+    one upstream connection
+    """
+
+    def __init__(self) -> None:
+        self.relays: Dict[int, LiveRelay] = {}
+        self.lock = threading.Lock()
+        self.reaper: threading.Thread | None = None
+        shutil.rmtree(LIVE_PATH, ignore_errors=True)
+
+    def join(self, channel_id: int, url: str, viewer: str) -> LiveRelay | None:
+        """
+        Get the relay of a channel for a viewer, connecting to the upstream if
+        the channel isn't relayed yet or its upstream has dropped
+
+        Returns:
+            LiveRelay | None: The relay, None if the upstream couldn't be read
+        """
+        with self.lock:
+            self.start_reaper()
+            relay = self.relays.get(channel_id)
+            if relay is None or relay.url != url:
+                if relay is not None:
+                    relay.stop()
+                relay = LiveRelay(channel_id, url)
+                self.relays[channel_id] = relay
+            if not relay.is_running():
+                relay.start()
+            relay.add_viewer(viewer)
+
+        if not relay.wait_for_playlist(PLAYLIST_WAIT_TIMEOUT):
+            return None
+        return relay
+
+    def get_relay(self, channel_id: int) -> LiveRelay | None:
+        with self.lock:
+            return self.relays.get(channel_id)
+
+    def start_reaper(self) -> None:
+        if self.reaper is not None:
+            return
+        self.reaper = threading.Thread(target=self.reap_idle_relays, daemon=True)
+        self.reaper.start()
+
+    def reap_idle_relays(self) -> None:
+        while True:
+            time.sleep(5)
+            with self.lock:
+                for channel_id, relay in list(self.relays.items()):
+                    if not relay.has_viewers():
+                        relay.stop()
+                        del self.relays[channel_id]
+
+
+LIVE_RELAYS = LiveRelayManager()
@@ -0,0 +1,139 @@
+import time
+import json
+import threading
+import sqlalchemy
+
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+from chocolate_app import DB, PLAYBACK_STORE
+from chocolate_app.tables import PlaybackSessions
+
+PLAYBACK_STATE_TTL = 60 * 60
+PLAYBACK_STATE_MAX_SIZE = 1000
+# Every segment request updates the state, the database is written less often
+EXPIRE_INTERVAL = 60
+ACCESS_WRITE_INTERVAL = 5
+
+PlaybackState = Dict[str, Any]
+
+
+class MemoryPlaybackStore:
+    """
+    Keep the state of the playback sessions in the process
+
+    A session expires after ttl seconds without any update, and the least
+    recently used sessions are dropped above max_size.
+    """
+
+    def __init__(self, ttl: float, max_size: int) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.states: OrderedDict[str, Tuple[float, PlaybackState]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def expire(self, now: float) -> None:
+        while self.states:
+            key, (last_access, _) = next(iter(self.states.items()))
+            if now - last_access <= self.ttl and len(self.states) <= self.max_size:
+                break
+            del self.states[key]
+
+    def get(self, key: str) -> PlaybackState | None:
+        with self.lock:
+            self.expire(time.time())
+            if key not in self.states:
+                return None
+            return dict(self.states[key][1])
+
+    def update(self, key: str, **values: Any) -> PlaybackState:
+        """
+        Update the state of a playback session, creating it if needed
+
+        Args:
+            key (str): The key of the playback session
+            **values: The values to set
+
+        Returns:
+            PlaybackState: The updated state
+        """
+        now = time.time()
+        with self.lock:
+            state = self.states.pop(key, (now, {}))[1]
+            state.update(values)
+            self.states[key] = (now, state)
+            self.expire(now)
+            return dict(state)
+
+
+class DatabasePlaybackStore:
+    """
+    Keep the state of the playback sessions in the database, so every worker
+    serving a session sees the same state
+
+    The expired sessions are deleted every EXPIRE_INTERVAL seconds, and an
+    update that doesn't change the state only writes the last access every
+    ACCESS_WRITE_INTERVAL seconds.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self.last_expire = 0.0
+
+    def expire(self, now: float) -> None:
+        if now - self.last_expire < EXPIRE_INTERVAL:
+            return
+        self.last_expire = now
+        PlaybackSessions.query.filter(
+            PlaybackSessions.last_access < now - self.ttl
+        ).delete()
+
+    def get(self, key: str) -> PlaybackState | None:
+        session = PlaybackSessions.query.filter_by(key=key).first()
+        if not session or time.time() - session.last_access > self.ttl:
+            return None
+        return json.loads(session.state)
+
+    def update(self, key: str, **values: Any) -> PlaybackState:
+        """
+        Update the state of a playback session, creating it if needed
+
+        Args:
+            key (str): The key of the playback session
+            **values: The values to set
+
+        Returns:
+            PlaybackState: The updated state
+        """
+        now = time.time()
+        self.expire(now)
+
+        try:
+            return self.write(key, now, values)
+        except sqlalchemy.exc.IntegrityError:
+            # Another worker created the session meanwhile, it's updated instead
+            DB.session.rollback()
+            return self.write(key, now, values)
+
+    def write(self, key: str, now: float, values: Dict[str, Any]) -> PlaybackState:
+        session = PlaybackSessions.query.filter_by(key=key).first()
+        state = {}
+        if session:
+            state = json.loads(session.state)
+        else:
+            session = PlaybackSessions(key=key, state="{}", last_access=0.0)
+            DB.session.add(session)
+
+        previous = dict(state)
+        state.update(values)
+        if state != previous or now - session.last_access >= ACCESS_WRITE_INTERVAL:
+            session.state = json.dumps(state)
+            session.last_access = now
+        DB.session.commit()
+        return state
+
+
+if PLAYBACK_STORE == "database":
+    PLAYBACK_STATES = DatabasePlaybackStore(PLAYBACK_STATE_TTL)
+else:
+    PLAYBACK_STATES = MemoryPlaybackStore(PLAYBACK_STATE_TTL, PLAYBACK_STATE_MAX_SIZE)
@@ -0,0 +1,73 @@
+import time
+import queue
+import threading
+
+from typing import Callable, Set, Tuple
+
+from flask import Flask, current_app
+
+from chocolate_app.utils.utils import log
+from chocolate_app.transcode.scheduler import TranscodeBusy
+
+MAX_PENDING = 64
+MAX_ATTEMPTS = 3
+BACKOFF = 2
+
+Job = Callable[[], None]
+
+
+class Prefetcher:
+    """
+    Run the prefetch jobs one at a time in a background thread
+
+    A job is dropped if the same key is already pending. When all the transcode
+    slots are busy, the job is retried later with an exponential backoff, and
+    dropped after MAX_ATTEMPTS, so the prefetch never delays the playback.
+    """
+
+    def __init__(self) -> None:
+        self.jobs: queue.Queue[Tuple[str, Flask, Job, int]] = queue.Queue(MAX_PENDING)
+        self.pending: Set[str] = set()
+        self.lock = threading.Lock()
+        self.worker: threading.Thread | None = None
+
+    def submit(self, key: str, job: Job) -> None:
+        """
+        Queue a prefetch job
+
+        Args:
+            key (str): The key of the prefetched segment
+            job (Job): The function producing the segment
+        """
+        with self.lock:
+            if key in self.pending or self.jobs.full():
+                return
+            self.pending.add(key)
+            self.jobs.put((key, current_app._get_current_object(), job, 0))
+
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, daemon=True)
+                self.worker.start()
+
+    def run(self) -> None:
+        while True:
+            key, app, job, attempt = self.jobs.get()
+            try:
+                with app.app_context():
+                    job()
+            except TranscodeBusy:
+                if attempt + 1 < MAX_ATTEMPTS:
+                    time.sleep(BACKOFF**attempt)
+                    try:
+                        self.jobs.put_nowait((key, app, job, attempt + 1))
+                        continue
+                    except queue.Full:
+                        pass
+            except Exception as e:
+                log("ERROR", "PREFETCH", f"Error while prefetching a segment: {e}")
+
+            with self.lock:
+                self.pending.discard(key)
+
+
+PREFETCHER = Prefetcher()
@@ -0,0 +1,254 @@
+import os
+import time
+import datetime
+import threading
+
+from typing import List
+
+from flask import Flask
+
+from chocolate_app import DB, ARTEFACTS_PATH, PRETRANSCODE_HOURS, PRETRANSCODE_SIZE
+from chocolate_app.tables import PretranscodeJobs
+from chocolate_app.utils.utils import log
+from chocolate_app.utils.processes import BACKGROUND_JOB
+from chocolate_app.transcode.probe import get_probe
+from chocolate_app.transcode.ladder import get_rendition
+from chocolate_app.transcode.keyframes import Segment, get_segments
+from chocolate_app.transcode.segment_cache import SegmentCache
+from chocolate_app.transcode.segmenter import video_segmenter_command, video_cache_key
+from chocolate_app.transcode.sessions import TranscodeSession
+from chocolate_app.transcode.scheduler import (
+    TRANSCODE_SCHEDULER,
+    TranscodeBusy,
+    PREFETCH,
+)
+
+PRETRANSCODE_OWNER = "pretranscode"
+POLL_INTERVAL = 60
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+# Stopped by the disk budget, queued again once some space is freed
+DEFERRED = "deferred"
+BUDGET_REACHED = "The disk budget is reached"
+
+# Never evicted by the worker, it stops before going over the disk budget
+OPTIMIZED_SEGMENTS = SegmentCache(f"{ARTEFACTS_PATH}/optimized", PRETRANSCODE_SIZE)
+
+
+def in_idle_hours() -> bool:
+    start, end = PRETRANSCODE_HOURS
+    hour = datetime.datetime.now().hour
+    if start <= end:
+        return start <= hour < end
+    # The idle hours go over midnight
+    return hour >= start or hour < end
+
+
+def get_job_keys(job: PretranscodeJobs) -> List[str]:
+    segments = get_segments(job.path)
+    return [
+        video_cache_key(job.path, job.quality, segments, idx)
+        for idx in range(1, len(segments) + 1)
+    ]
+
+
+def get_segment_size(job: PretranscodeJobs, segment: Segment) -> int:
+    """
+    The expected size of a segment of a job, at the peak bitrate of its
+    rendition
+    """
+    start, end = segment
+    rendition = get_rendition(get_probe(job.path), job.quality)
+    return int(rendition.peak_bitrate / 8 * (end - start))
+
+
+def requeue_deferred_jobs() -> None:
+    PretranscodeJobs.query.filter_by(status=DEFERRED).update(
+        {"status": QUEUED, "error": None}
+    )
+
+
+def add_job(
+    media_type: str, media_id: int, path: str, quality: str
+) -> PretranscodeJobs:
+    """
+    Queue a media to be pre-transcoded in a quality, the existing job is kept
+
+    Returns:
+        PretranscodeJobs: The job
+    """
+    job = PretranscodeJobs.query.filter_by(
+        media_type=media_type, media_id=media_id, quality=quality
+    ).first()
+    if job:
+        if job.status == FAILED:
+            job.status = QUEUED
+            job.error = None
+        return job
+
+    job = PretranscodeJobs(
+        media_type=media_type,
+        media_id=media_id,
+        path=path,
+        quality=quality,
+        status=QUEUED,
+        progress=0,
+        total=0,
+    )
+    DB.session.add(job)
+    return job
+
+
+def delete_job(job: PretranscodeJobs) -> None:
+    """
+    Delete a job and the segments it produced
+    """
+    if os.path.exists(job.path):
+        for key in get_job_keys(job):
+            OPTIMIZED_SEGMENTS.remove(key)
+    DB.session.delete(job)
+    requeue_deferred_jobs()
+
+
+class Pretranscoder:
+    """
+    Pre-encode the queued medias into the segments of the HLS ladder, during
+    the idle hours and within the disk budget
+
+    The jobs only take a transcode slot when one is free, a job stopped by the
+    end of the idle hours or by a restart resumes on its first missing
+    segment. A job stopped by the disk budget waits for a job to be deleted,
+    or for a restart with a larger budget.
+    """
+
+    def __init__(self) -> None:
+        self.worker: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+    def start(self, app: Flask) -> None:
+        with self.lock:
+            if self.worker is not None:
+                return
+            self.worker = threading.Thread(target=self.run, args=(app,), daemon=True)
+            self.worker.start()
+
+    def run(self, app: Flask) -> None:
+        with app.app_context():
+            requeue_deferred_jobs()
+            DB.session.commit()
+
+        while True:
+            worked = False
+            with app.app_context():
+                try:
+                    worked = self.run_next_job()
+                except Exception as e:
+                    log("ERROR", "PRETRANSCODE", f"Error while pre-transcoding: {e}")
+            if not worked:
+                time.sleep(POLL_INTERVAL)
+
+    def run_next_job(self) -> bool:
+        if not in_idle_hours() or OPTIMIZED_SEGMENTS.total_size() >= PRETRANSCODE_SIZE:
+            return False
+
+        job = (
+            PretranscodeJobs.query.filter(
+                PretranscodeJobs.status.in_([QUEUED, RUNNING])
+            )
+            .order_by(PretranscodeJobs.id)
+            .first()
+        )
+        if not job:
+            return False
+
+        try:
+            return self.run_job(job)
+        finally:
+            DB.session.commit()
+
+    def run_job(self, job: PretranscodeJobs) -> bool:
+        """
+        Produce the missing segments of a job
+
+        Returns:
+            bool: False if the job has been stopped before its end
+        """
+        if not os.path.exists(job.path):
+            job.status = FAILED
+            job.error = "The file doesn't exist anymore"
+            return True
+
+        segments = get_segments(job.path)
+        keys = get_job_keys(job)
+        stored = {
+            idx for idx, key in enumerate(keys, start=1) if OPTIMIZED_SEGMENTS.get(key)
+        }
+        job.total = len(keys)
+        job.progress = len(stored)
+        if len(stored) == len(keys):
+            job.status = DONE
+            return True
+
+        start_idx = min(set(range(1, len(keys) + 1)) - stored)
+        size = OPTIMIZED_SEGMENTS.total_size()
+        if size + get_segment_size(job, segments[start_idx - 1]) > PRETRANSCODE_SIZE:
+            job.status = DEFERRED
+            job.error = BUDGET_REACHED
+            return True
+
+        try:
+            slot = TRANSCODE_SCHEDULER.acquire(PRETRANSCODE_OWNER, PREFETCH)
+        except TranscodeBusy:
+            return False
+
+        session = TranscodeSession(
+            f"pretranscode-{job.id}", PRETRANSCODE_OWNER, BACKGROUND_JOB
+        )
+        session.start(
+            start_idx,
+            video_segmenter_command(
+                job.path, job.quality, segments, start_idx, session.directory
+            ),
+            slot,
+        )
+        job.status = RUNNING
+        job.error = None
+        DB.session.commit()
+
+        try:
+            while True:
+                # Read before the segment list, so the last segment isn't missed
+                running = session.is_running()
+                for idx in session.completed_segments():
+                    if idx in stored:
+                        continue
+                    segment_path = session.segment_path(idx)
+                    size = OPTIMIZED_SEGMENTS.total_size()
+                    if size + os.path.getsize(segment_path) > PRETRANSCODE_SIZE:
+                        job.status = DEFERRED
+                        job.error = BUDGET_REACHED
+                        return True
+                    OPTIMIZED_SEGMENTS.put_file(keys[idx - 1], segment_path)
+                    stored.add(idx)
+                    job.progress = len(stored)
+                    DB.session.commit()
+
+                if len(stored) == len(keys):
+                    job.status = DONE
+                    return True
+                if not running:
+                    job.status = FAILED
+                    job.error = "ffmpeg exited before the end of the file"
+                    return True
+                if not in_idle_hours():
+                    job.status = QUEUED
+                    return False
+                time.sleep(1)
+        finally:
+            session.close()
+
+
+PRETRANSCODER = Pretranscoder()
@@ -0,0 +1,202 @@
+import json
+import time
+import threading
+import subprocess
+
+from typing import Any, Dict, List, Tuple
+
+from chocolate_app import DB
+from chocolate_app.tables import MediaProbe
+from chocolate_app.utils.utils import file_identity, log
+from chocolate_app.utils.processes import PROCESSES
+from chocolate_app.utils.single_flight import SingleFlight
+
+PROBE_LOCK = threading.Lock()
+PROBE_TIMEOUT = 60
+PROBE_FLIGHTS = SingleFlight()
+# A file ffprobe failed on isn't probed again before this delay, the failed
+# probes aren't stored so they don't pass for the probe of the file
+PROBE_RETRY_DELAY = 5 * 60
+FAILED_PROBES: Dict[Tuple[str, str], float] = {}
+
+# Subtitles that can't be converted to WebVTT
+IMAGE_SUBTITLE_CODECS = ["hdmv_pgs_subtitle", "dvd_subtitle", "dvb_subtitle", "xsub"]
+
+
+def run_ffprobe(path: str) -> Dict[str, Any] | None:
+    """
+    Probe the format and the streams of a file, in a single ffprobe run
+
+    Args:
+        path (str): The path of the file
+
+    Returns:
+        Dict[str, Any] | None: The output of ffprobe, None if it failed
+    """
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-show_format",
+        "-show_streams",
+        "-of",
+        "json",
+        path,
+    ]
+    result = PROCESSES.run(
+        command, timeout=PROBE_TIMEOUT, stdout=subprocess.PIPE, text=True
+    )
+    try:
+        if result.returncode == 0:
+            return json.loads(result.stdout)
+    except ValueError:
+        pass
+    log("ERROR", "MEDIA PROBE", f"Error while probing the file {path}")
+    return None
+
+
+def to_int(value: Any) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_frame_rate(value: Any) -> float:
+    try:
+        numerator, denominator = str(value).split("/")
+        return float(numerator) / float(denominator)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def fill_probe(probe: MediaProbe, data: Dict[str, Any]) -> None:
+    media_format = data.get("format", {})
+    streams = data.get("streams", [])
+
+    try:
+        probe.duration = float(media_format.get("duration", 0))
+    except ValueError:
+        probe.duration = 0.0
+    probe.bitrate = to_int(media_format.get("bit_rate"))
+
+    video = next(
+        (
+            stream
+            for stream in streams
+            if stream.get("codec_type") == "video"
+            and not stream.get("disposition", {}).get("attached_pic")
+        ),
+        {},
+    )
+    probe.width = to_int(video.get("width"))
+    probe.height = to_int(video.get("height"))
+    probe.video_codec = video.get("codec_name")
+    # Empty when unknown, None is left for the probes made before the columns
+    probe.video_profile = video.get("profile") or ""
+    probe.pixel_format = video.get("pix_fmt") or ""
+    probe.video_bitrate = to_int(video.get("bit_rate"))
+    # 0 when unknown, None is left for the probes made before the column
+    probe.frame_rate = to_frame_rate(video.get("avg_frame_rate")) or to_frame_rate(
+        video.get("r_frame_rate")
+    )
+
+    audio_streams = []
+    subtitle_streams = []
+    for stream in streams:
+        tags = stream.get("tags", {})
+        stream_info = {
+            "index": stream.get("index"),
+            "codec": stream.get("codec_name"),
+            "language": tags.get("language"),
+            "title": tags.get("title") or tags.get("handler_name"),
+        }
+        if stream.get("codec_type") == "audio":
+            stream_info["channels"] = to_int(stream.get("channels"))
+            audio_streams.append(stream_info)
+        elif stream.get("codec_type") == "subtitle":
+            subtitle_streams.append(stream_info)
+
+    probe.audio_streams = json.dumps(audio_streams)
+    probe.subtitle_streams = json.dumps(subtitle_streams)
+
+
+def is_fresh(probe: MediaProbe | None, identity: str) -> bool:
+    return (
+        probe is not None
+        and probe.identity == identity
+        and probe.frame_rate is not None
+        and probe.pixel_format is not None
+    )
+
+
+def get_probe(path: str) -> MediaProbe:
+    """
+    Get the probe of a file, ffprobe is only run if the file is new or has
+    changed since the last probe
+
+    Args:
+        path (str): The path of the file
+
+    Returns:
+        MediaProbe: The probe of the file, empty and not stored if ffprobe
+        failed
+    """
+    identity = file_identity(path)
+    probe = MediaProbe.query.filter_by(path=path).first()
+    if is_fresh(probe, identity):
+        return probe
+
+    failed_at = FAILED_PROBES.get((path, identity))
+    if failed_at is not None and time.time() - failed_at < PROBE_RETRY_DELAY:
+        return get_empty_probe(path)
+
+    # A new file is often requested by several players at once, it's probed once
+    data = PROBE_FLIGHTS.do((path, identity), run_ffprobe, path)
+    if data is None:
+        FAILED_PROBES[(path, identity)] = time.time()
+        return get_empty_probe(path)
+    FAILED_PROBES.pop((path, identity), None)
+
+    with PROBE_LOCK:
+        # The probe may have been stored by another request meanwhile
+        probe = MediaProbe.query.filter_by(path=path).populate_existing().first()
+        if is_fresh(probe, identity):
+            return probe
+
+        if not probe:
+            probe = MediaProbe(path=path)
+            DB.session.add(probe)
+        probe.identity = identity
+        fill_probe(probe, data)
+        DB.session.commit()
+        return probe
+
+
+def get_empty_probe(path: str) -> MediaProbe:
+    probe = MediaProbe(path=path)
+    fill_probe(probe, {})
+    return probe
+
+
+def get_duration(path: str) -> float:
+    return get_probe(path).duration or 0.0
+
+
+def get_audio_streams(path: str) -> List[Dict[str, Any]]:
+    """
+    Get the audio streams of a file, in the order of the file, so the position
+    of a stream in the list is its index for the "0:a:<index>" mapping
+    """
+    return json.loads(get_probe(path).audio_streams or "[]")
+
+
+def get_subtitle_streams(path: str) -> List[Dict[str, Any]]:
+    """
+    Get the text subtitle streams of a file, image based subtitles are skipped
+    """
+    return [
+        stream
+        for stream in json.loads(get_probe(path).subtitle_streams or "[]")
+        if stream["codec"] not in IMAGE_SUBTITLE_CODECS
+    ]
@@ -0,0 +1,149 @@
+import time
+import itertools
+import threading
+
+from typing import Dict, List, Tuple
+
+from chocolate_app import TRANSCODE_SLOTS, TRANSCODE_USER_SLOTS
+
+# Lower is served first
+PLAYBACK = 0
+PREFETCH = 1
+
+QUEUE_TIMEOUT = 10
+RETRY_AFTER = 5
+
+Ticket = Tuple[int, int, str]
+
+
+class TranscodeBusy(Exception):
+    """Raised when no transcode slot could be acquired in time"""
+
+
+class TranscodeSlot:
+    def __init__(
+        self, scheduler: "TranscodeScheduler", owner: str, group: str | None = None
+    ) -> None:
+        self.scheduler = scheduler
+        self.owner = owner
+        self.group = group
+        self.released = False
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        self.scheduler.release(self.owner, self.group)
+
+
+class TranscodeScheduler:
+    """
+    Bound the number of ffmpeg transcodes running at once, globally and for
+    each owner
+
+    Requests over the limits wait in a queue ordered by priority, then by
+    arrival, so the segments needed by the playback go before the prefetch.
+
+    The transcodes of one playback (its segmenter and the audio chunks encoded
+    along) share a single slot, given with the group of the playback: the
+    segmenter holds its slot while it runs ahead, the audio of the same
+    playback must not queue behind it.
+    """
+
+    def __init__(self, slots: int, user_slots: int) -> None:
+        self.slots = slots
+        self.user_slots = user_slots
+        self.total = 0
+        self.running: Dict[str, int] = {}
+        self.groups: Dict[str, int] = {}
+        self.waiting: List[Ticket] = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def can_run(self, ticket: Ticket) -> bool:
+        if self.total >= self.slots:
+            return False
+        # The first waiting ticket whose owner is under its cap goes first
+        for waiting in sorted(self.waiting):
+            if self.running.get(waiting[2], 0) < self.user_slots:
+                return waiting == ticket
+        return False
+
+    def acquire(
+        self,
+        owner: str,
+        priority: int = PLAYBACK,
+        timeout: float | None = None,
+        group: str | None = None,
+    ) -> TranscodeSlot:
+        """
+        Acquire a transcode slot, waiting for one to be released if needed
+
+        Args:
+            owner (str): The user the transcode is made for
+            priority (int): PLAYBACK or PREFETCH
+            timeout (float | None): The maximum time to wait in the queue,
+                QUEUE_TIMEOUT by default for the playback, the prefetch
+                doesn't wait
+            group (str | None): The playback the transcode is part of, it
+                joins the slot the playback already holds
+
+        Raises:
+            TranscodeBusy: If no slot has been released in time
+
+        Returns:
+            TranscodeSlot: The slot, to release once ffmpeg has exited
+        """
+        if timeout is None:
+            timeout = QUEUE_TIMEOUT if priority == PLAYBACK else 0
+
+        deadline = time.time() + timeout
+        with self.condition:
+            if group in self.groups:
+                return self.join(owner, group)
+
+            ticket = (priority, next(self.counter), owner)
+            self.waiting.append(ticket)
+            try:
+                while not self.can_run(ticket):
+                    # Another transcode of the playback got a slot meanwhile
+                    if group in self.groups:
+                        return self.join(owner, group)
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise TranscodeBusy()
+                    self.condition.wait(remaining)
+
+                self.total += 1
+                self.running[owner] = self.running.get(owner, 0) + 1
+                if group is not None:
+                    self.groups[group] = 1
+                return TranscodeSlot(self, owner, group)
+            finally:
+                self.waiting.remove(ticket)
+                self.condition.notify_all()
+
+    def join(self, owner: str, group: str) -> TranscodeSlot:
+        self.groups[group] += 1
+        return TranscodeSlot(self, owner, group)
+
+    def release(self, owner: str, group: str | None = None) -> None:
+        with self.condition:
+            if group is not None:
+                # The slot is freed once every transcode of the playback is done
+                self.groups[group] -= 1
+                if self.groups[group]:
+                    return
+                del self.groups[group]
+            self.total -= 1
+            self.running[owner] -= 1
+            if not self.running[owner]:
+                del self.running[owner]
+            self.condition.notify_all()
+
+
+TRANSCODE_SCHEDULER = TranscodeScheduler(TRANSCODE_SLOTS, TRANSCODE_USER_SLOTS)
+# The long encodes made in the background, over whole files, have their own
+# slot and never hold one of the playback
+BACKGROUND_SLOTS = 1
+BACKGROUND_SCHEDULER = TranscodeScheduler(BACKGROUND_SLOTS, BACKGROUND_SLOTS)
@@ -0,0 +1,211 @@
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+
+from collections import OrderedDict
+
+from chocolate_app import ARTEFACTS_PATH, SEGMENT_CACHE_SIZE
+
+# A temporary file may belong to an encode still running in another process,
+# the longest ones time out after an hour. An older file has been left behind
+# by a process that was killed.
+STALE_TEMP_AGE = 6 * 60 * 60
+
+
+class SegmentCache:
+    """
+    Content addressed on-disk cache for transcoded segments
+
+    Entries are evicted in least recently used order as soon as the total size
+    of the cache goes over max_size. The last access time of an entry is kept
+    in the mtime of its file, so the order survives a restart.
+    """
+
+    def __init__(self, path: str, max_size: int, extension: str = "ts") -> None:
+        self.path = path
+        self.max_size = max_size
+        self.extension = extension
+        self.size = 0
+        self.entries: OrderedDict[str, int] | None = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """
+        Build a cache key from everything that changes the content of a segment
+
+        Returns:
+            str: The key of the segment
+        """
+        return hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return f"{self.path}/{key[:2]}/{key}.{self.extension}"
+
+    def load(self) -> None:
+        if self.entries is not None:
+            return
+
+        files = []
+        now = time.time()
+        if os.path.isdir(self.path):
+            for root, _, names in os.walk(self.path):
+                for name in names:
+                    path = f"{root}/{name}".replace("\\", "/")
+                    try:
+                        stat = os.stat(path)
+                        if name.endswith(".tmp"):
+                            if now - stat.st_mtime > STALE_TEMP_AGE:
+                                os.remove(path)
+                            continue
+                    except OSError:
+                        # Committed or discarded by its writer meanwhile
+                        continue
+                    files.append((stat.st_mtime, path, stat.st_size))
+
+        files.sort()
+        self.entries = OrderedDict((path, size) for _, path, size in files)
+        self.size = sum(self.entries.values())
+
+    def get(self, key: str) -> str | None:
+        """
+        Get the path of a cached segment
+
+        Args:
+            key (str): The key of the segment
+
+        Returns:
+            str | None: The path of the segment, None if it is not cached
+        """
+        path = self.entry_path(key)
+        with self.lock:
+            self.load()
+            if path not in self.entries:
+                return None
+            if not os.path.exists(path):
+                self.size -= self.entries.pop(path)
+                return None
+            self.entries.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def put(self, key: str, data: bytes) -> str:
+        """
+        Store a segment in the cache
+
+        Args:
+            key (str): The key of the segment
+            data (bytes): The content of the segment
+
+        Returns:
+            str: The path of the cached segment
+        """
+        writer = self.writer(key)
+        writer.write(data)
+        return writer.commit()
+
+    def writer(self, key: str) -> "SegmentWriter":
+        """
+        Store a segment in the cache while it is produced, the segment is only
+        visible in the cache once the writer is committed
+
+        Args:
+            key (str): The key of the segment
+
+        Returns:
+            SegmentWriter: The writer of the segment
+        """
+        return SegmentWriter(self, key)
+
+    def put_file(self, key: str, source: str) -> str:
+        """
+        Store an already encoded file in the cache, the source file is kept
+
+        Args:
+            key (str): The key of the segment
+            source (str): The path of the file to store
+
+        Returns:
+            str: The path of the cached segment
+        """
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, path)
+        self.add(path, os.path.getsize(path))
+        return path
+
+    def remove(self, key: str) -> None:
+        path = self.entry_path(key)
+        with self.lock:
+            self.load()
+            if path in self.entries:
+                self.size -= self.entries.pop(path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def total_size(self) -> int:
+        with self.lock:
+            self.load()
+            return self.size
+
+    def add(self, path: str, size: int) -> None:
+        with self.lock:
+            self.load()
+            if path in self.entries:
+                self.size -= self.entries.pop(path)
+            self.entries[path] = size
+            self.size += size
+            self.evict()
+
+    def evict(self) -> None:
+        # The newest entry is never evicted, the caller is about to serve it
+        while self.size > self.max_size and len(self.entries) > 1:
+            path, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class SegmentWriter:
+    def __init__(self, cache: SegmentCache, key: str) -> None:
+        self.cache = cache
+        self.path = cache.entry_path(key)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.temp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        self.file = open(self.temp_path, "wb")
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self.file.write(data)
+        self.size += len(data)
+
+    def commit(self) -> str:
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+        self.cache.add(self.path, self.size)
+        return self.path
+
+    def discard(self) -> None:
+        self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+
+SEGMENT_CACHE = SegmentCache(f"{ARTEFACTS_PATH}/segments", SEGMENT_CACHE_SIZE)
@@ -0,0 +1,135 @@
+import math
+
+from typing import List
+
+from chocolate_app import FFMPEG_ARGS, VIDEO_CODEC
+from chocolate_app.utils.utils import file_identity
+from chocolate_app.transcode.keyframes import Segment
+from chocolate_app.transcode.probe import get_probe
+from chocolate_app.transcode.ladder import get_rendition
+from chocolate_app.transcode.segment_cache import SEGMENT_CACHE
+from chocolate_app.transcode.audio_renditions import AUDIO_ARGUMENTS
+from chocolate_app.transcode.sessions import SEGMENT_LIST
+
+LOG_LEVEL = "error"
+
+
+def video_segmenter_command(
+    video_path: str,
+    quality: str,
+    segments: List[Segment],
+    start_idx: int,
+    directory: str,
+) -> List[str]:
+    seconds = segments[start_idx - 1][0]
+    # The cut points, relative to the start of the session. The timestamps
+    # start at 0 until the segment muxer has cut them, and are only then moved
+    # to the timeline of the file with -initial_offset, so the cuts, the
+    # forced keyframes and the timestamps seen by the muxer share one origin
+    cuts = ",".join(str(round(start - seconds, 6)) for start, _ in segments[start_idx:])
+
+    command = [
+        "ffmpeg",
+        *FFMPEG_ARGS,
+        "-hide_banner",
+        "-loglevel",
+        LOG_LEVEL,
+        "-ss",
+        str(seconds),
+        "-i",
+        video_path,
+        "-c:v",
+        "copy" if quality == "copy" else VIDEO_CODEC,
+        "-an",
+    ]
+
+    if quality != "copy":
+        rendition = get_rendition(get_probe(video_path), quality)
+        # The bitrate advertised in the master playlist
+        command += [
+            "-b:v",
+            str(rendition.bitrate),
+            "-maxrate",
+            str(rendition.peak_bitrate),
+            "-bufsize",
+            str(rendition.peak_bitrate * 2),
+        ]
+        if quality != "default":
+            command += ["-vf", f"scale={rendition.width}:{rendition.height}"]
+
+    # Every segment starts on a keyframe, so they can be cut by the muxer.
+    # The segments are already cut on the keyframes of the source when the
+    # video stream is copied
+    if cuts and quality == "copy":
+        command += ["-segment_times", cuts]
+    elif cuts:
+        command += ["-force_key_frames", cuts, "-segment_times", cuts]
+    else:
+        command += ["-segment_time", str(math.ceil(segments[-1][1]))]
+
+    command += [
+        "-f",
+        "segment",
+        "-segment_format",
+        "mpegts",
+        "-segment_start_number",
+        str(start_idx),
+        "-segment_list",
+        f"{directory}/{SEGMENT_LIST}",
+        "-segment_list_type",
+        "csv",
+        "-initial_offset",
+        str(seconds),
+        f"{directory}/%d.ts",
+    ]
+
+    return command
+
+
+def video_cache_key(
+    video_path: str, quality: str, segments: List[Segment], idx: int
+) -> str:
+    # Keyed by the bounds of the segment rather than its index, which moves
+    # with the fast start segments of a resumed playback
+    return SEGMENT_CACHE.make_key(
+        file_identity(video_path),
+        quality,
+        VIDEO_CODEC,
+        " ".join(FFMPEG_ARGS),
+        *segments[idx - 1],
+    )
+
+
+def audio_cache_key(
+    video_path: str, audio_idx: int, segments: List[Segment], idx: int
+) -> str:
+    return SEGMENT_CACHE.make_key(
+        file_identity(video_path),
+        " ".join(AUDIO_ARGUMENTS),
+        " ".join(FFMPEG_ARGS),
+        audio_idx,
+        *segments[idx - 1],
+    )
+
+
+def audio_chunk_command(video_path: str, audio_idx: int, segment: Segment) -> List[str]:
+    start, end = segment
+
+    return [
+        "ffmpeg",
+        *FFMPEG_ARGS,
+        "-hide_banner",
+        "-loglevel",
+        LOG_LEVEL,
+        "-ss",
+        str(start),  # Start time of the segment
+        "-t",
+        str(round(end - start, 6)),  # Duration of the segment
+        "-i",
+        video_path,  # Set output offset
+        "-map",
+        f"0:a:{audio_idx}",  # Select the audio stream
+        "-vn",  # Disable video
+        *AUDIO_ARGUMENTS,  # Stereo AAC, like the encoded audio tracks
+        "-",  # Send the result to stdout
+    ]
@@ -0,0 +1,312 @@
+import os
+import time
+import shutil
+import threading
+import subprocess
+
+from typing import Callable, Dict, Generator, List
+
+from chocolate_app import ARTEFACTS_PATH, TRANSCODE_SESSION_TIMEOUT
+from chocolate_app.utils.processes import PROCESSES, PLAYBACK_JOB
+from chocolate_app.transcode.scheduler import (
+    TRANSCODE_SCHEDULER,
+    TranscodeSlot,
+    PLAYBACK,
+    PREFETCH,
+)
+
+SESSIONS_PATH = f"{ARTEFACTS_PATH}/sessions"
+SEGMENT_LIST = "segments.csv"
+SEGMENT_WAIT_TIMEOUT = 120
+STREAM_CHUNK_SIZE = 64 * 1024
+
+CommandBuilder = Callable[[int, str], List[str]]
+
+
+class TranscodeSession:
+    """
+    A long-lived ffmpeg segmenter producing the segments of one media,
+    for one viewer and one quality, ahead of the playback
+
+    ffmpeg writes the segments in the session directory and appends a line to
+    the segment list each time a segment is complete. The transcode slot of the
+    session is released as soon as ffmpeg exits, the produced segments stay
+    available without it.
+    """
+
+    def __init__(self, key: str, group: str, job_class: str = PLAYBACK_JOB) -> None:
+        self.key = key
+        self.group = group
+        self.job_class = job_class
+        self.slot: TranscodeSlot | None = None
+        self.start_idx = 0
+        self.directory = f"{SESSIONS_PATH}/{key}"
+        self.process: subprocess.Popen | None = None
+        self.last_access = time.time()
+        self.lock = threading.Lock()
+
+    def start(
+        self, start_idx: int, command: List[str], slot: TranscodeSlot | None
+    ) -> bool:
+        """
+        (Re)start the segmenter, with a new slot or the one the session holds
+
+        Returns:
+            bool: False if there is no slot to run the segmenter with
+        """
+        with self.lock:
+            if slot is None and self.slot is None:
+                return False
+            self.stop()
+            if slot is not None:
+                self.release_slot()
+                self.slot = slot
+            self.start_idx = start_idx
+            os.makedirs(self.directory, exist_ok=True)
+            self.process = PROCESSES.popen(
+                command,
+                self.job_class,
+                owner=self.group,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            threading.Thread(
+                target=self.wait_process, args=(self.process,), daemon=True
+            ).start()
+            return True
+
+    def wait_process(self, process: subprocess.Popen) -> None:
+        process.wait()
+        with self.lock:
+            # The session may have been restarted with another process meanwhile
+            if self.process is process:
+                self.release_slot()
+
+    def stop(self) -> None:
+        if self.process:
+            PROCESSES.kill(self.process)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def release_slot(self) -> None:
+        if self.slot is not None:
+            self.slot.release()
+            self.slot = None
+
+    def close(self) -> None:
+        self.stop()
+        self.release_slot()
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def segment_path(self, idx: int) -> str:
+        return f"{self.directory}/{idx}.ts"
+
+    def completed_segments(self) -> List[int]:
+        segment_list = f"{self.directory}/{SEGMENT_LIST}"
+        if not os.path.exists(segment_list):
+            return []
+
+        segments = []
+        with open(segment_list, "r") as file:
+            for line in file:
+                name = line.split(",")[0]
+                if name.endswith(".ts"):
+                    segments.append(int(name[:-3]))
+        return segments
+
+    def last_completed(self) -> int:
+        segments = self.completed_segments()
+        if not segments:
+            return self.start_idx - 1
+        return max(segments)
+
+    def covers(self, idx: int, ahead: bool = False) -> bool:
+        """
+        Check if a segment is already produced, or is the one being encoded.
+        With ahead, the segments the segmenter will reach later are covered too
+        """
+        if idx < self.start_idx:
+            return False
+        if idx <= self.last_completed():
+            return os.path.exists(self.segment_path(idx))
+        if ahead:
+            return self.is_running()
+        return self.is_running() and idx == self.last_completed() + 1
+
+    def wait_for_segment_start(self, idx: int, timeout: float) -> bool:
+        """
+        Wait until ffmpeg starts to write a segment
+
+        Returns:
+            bool: False if ffmpeg stopped or timed out before
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if os.path.exists(self.segment_path(idx)):
+                return True
+            if not self.is_running():
+                return False
+            time.sleep(0.05)
+        return False
+
+    def wait_for_segment_end(self, idx: int, timeout: float) -> bool:
+        """
+        Wait until ffmpeg has written a whole segment
+
+        Returns:
+            bool: False if ffmpeg stopped or timed out before
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if idx in self.completed_segments():
+                return True
+            if not self.is_running():
+                # The segment may have been completed meanwhile
+                return idx in self.completed_segments()
+            time.sleep(0.05)
+        return False
+
+    def stream_segment(self, idx: int) -> Generator[bytes, None, bool]:
+        """
+        Read a segment while ffmpeg is still writing it
+
+        Returns:
+            bool: True if the whole segment has been read
+        """
+        with open(self.segment_path(idx), "rb") as file:
+            while True:
+                data = file.read(STREAM_CHUNK_SIZE)
+                if data:
+                    yield data
+                    continue
+
+                completed = idx in self.completed_segments()
+                if completed or not self.is_running():
+                    # The end of the segment may have been written meanwhile
+                    data = file.read()
+                    if data:
+                        yield data
+                    return completed or idx in self.completed_segments()
+
+                time.sleep(0.05)
+
+
+class TranscodeSessionManager:
+    """
+    Keep one segmenter per session key, restart it only when the requested
+    segment is outside of its window, and stop it once it has been idle for
+    TRANSCODE_SESSION_TIMEOUT seconds
+
+    Sessions of the same group (a viewer watching a media) replace each other,
+    so switching the quality doesn't leave the previous segmenter running.
+    """
+
+    def __init__(self) -> None:
+        self.sessions: Dict[str, TranscodeSession] = {}
+        self.lock = threading.Lock()
+        self.reaper: threading.Thread | None = None
+        shutil.rmtree(SESSIONS_PATH, ignore_errors=True)
+
+    def get_session(
+        self, key: str, group: str, owner: str, idx: int, build_command: CommandBuilder
+    ) -> TranscodeSession | None:
+        """
+        Get the session producing a segment, starting the segmenter if needed
+
+        Args:
+            key (str): The key of the session
+            group (str): The key of the viewer and the media
+            owner (str): The user the session is for
+            idx (int): The index of the segment
+            build_command (CommandBuilder): Build the ffmpeg command from the
+                index of the first segment and the output directory
+
+        Raises:
+            TranscodeBusy: If there is no transcode slot for a new session
+
+        Returns:
+            TranscodeSession | None: The session, None if ffmpeg failed before
+            writing the segment
+        """
+        session = self.start_session(key, group, owner, idx, build_command)
+
+        if not session.wait_for_segment_start(idx, SEGMENT_WAIT_TIMEOUT):
+            return None
+        return session
+
+    def start_session(
+        self,
+        key: str,
+        group: str,
+        owner: str,
+        idx: int,
+        build_command: CommandBuilder,
+        priority: int = PLAYBACK,
+    ) -> TranscodeSession:
+        """
+        Make sure a segmenter is producing a segment, without waiting for it
+
+        Raises:
+            TranscodeBusy: If there is no transcode slot for a new session
+
+        Returns:
+            TranscodeSession: The session
+        """
+        slot = None
+        try:
+            while True:
+                with self.lock:
+                    self.start_reaper()
+                    self.close_group(group, key)
+                    session = self.sessions.get(key)
+
+                    # The prefetch never restarts a segmenter going that way
+                    ahead = priority == PREFETCH
+                    if session is not None and session.covers(idx, ahead):
+                        break
+
+                    # Seeking outside of the produced window restarts the
+                    # segmenter, a new slot is only needed if it had exited
+                    if session is None and slot is not None:
+                        session = TranscodeSession(key, group)
+                        self.sessions[key] = session
+                    if session is not None and session.start(
+                        idx, build_command(idx, session.directory), slot
+                    ):
+                        slot = None
+                        break
+
+                # Wait for a slot outside of the lock, the other sessions go on
+                slot = TRANSCODE_SCHEDULER.acquire(owner, priority, group=group)
+        finally:
+            if slot is not None:
+                slot.release()
+
+        session.last_access = time.time()
+        return session
+
+    def close_group(self, group: str, key: str) -> None:
+        for other in list(self.sessions.values()):
+            if other.group == group and other.key != key:
+                other.close()
+                del self.sessions[other.key]
+
+    def start_reaper(self) -> None:
+        if self.reaper is not None:
+            return
+        self.reaper = threading.Thread(target=self.reap_idle_sessions, daemon=True)
+        self.reaper.start()
+
+    def reap_idle_sessions(self) -> None:
+        while True:
+            time.sleep(10)
+            now = time.time()
+            with self.lock:
+                for key, session in list(self.sessions.items()):
+                    if now - session.last_access > TRANSCODE_SESSION_TIMEOUT:
+                        session.close()
+                        del self.sessions[key]
+
+
+TRANSCODE_SESSIONS = TranscodeSessionManager()
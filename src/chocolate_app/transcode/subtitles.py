@@ -0,0 +1,183 @@
+import os
+import re
+import shutil
+import threading
+import subprocess
+
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from chocolate_app import ARTEFACTS_PATH
+from chocolate_app.utils.utils import file_identity, hash_string, log
+from chocolate_app.utils.processes import PROCESSES
+from chocolate_app.transcode.probe import get_subtitle_streams
+from chocolate_app.transcode.scheduler import TRANSCODE_SCHEDULER
+from chocolate_app.transcode.keyframes import Segment, MPEGTS_OFFSET
+
+SUBTITLES_PATH = f"{ARTEFACTS_PATH}/subtitles"
+
+TIMESTAMP_MAP = f"X-TIMESTAMP-MAP=MPEGTS:{MPEGTS_OFFSET},LOCAL:00:00:00.000"
+
+TIMING = re.compile(r"^\s*((?:\d+:)?\d+:\d+\.\d+)\s+-->\s+((?:\d+:)?\d+:\d+\.\d+)")
+
+Cue = Tuple[float, float, str]
+
+# The whole file is read to extract the subtitles
+EXTRACT_TIMEOUT = 60 * 60
+
+EXTRACT_LOCKS: Dict[str, threading.Lock] = {}
+EXTRACT_LOCKS_LOCK = threading.Lock()
+
+
+def subtitles_directory(path: str) -> str:
+    """
+    Get the directory of the extracted subtitles of the current version of a
+    file
+
+    Args:
+        path (str): The path of the video file
+
+    Returns:
+        str: The directory of the WebVTT files
+    """
+    return f"{SUBTITLES_PATH}/{hash_string(path)}/{hash_string(file_identity(path))}"
+
+
+def extract_subtitles(path: str, owner: str) -> None:
+    """
+    Extract every text subtitle track of a file to WebVTT, reading the file
+    only once
+
+    Args:
+        path (str): The path of the video file
+        owner (str): The user the extraction is made for
+    """
+    directory = subtitles_directory(path)
+    indexes = [
+        stream["index"]
+        for stream in get_subtitle_streams(path)
+        if not os.path.exists(f"{directory}/{stream['index']}.vtt")
+    ]
+    if not indexes:
+        return
+
+    # The subtitles of the previous versions of the file are useless now
+    parent = os.path.dirname(directory)
+    if os.path.isdir(parent):
+        for name in os.listdir(parent):
+            if f"{parent}/{name}" != directory:
+                shutil.rmtree(f"{parent}/{name}", ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+    command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", path]
+    for index in indexes:
+        command += ["-map", f"0:{index}", "-f", "webvtt", f"{directory}/{index}.tmp"]
+
+    slot = TRANSCODE_SCHEDULER.acquire(owner)
+    try:
+        result = PROCESSES.run(
+            command,
+            timeout=EXTRACT_TIMEOUT,
+            owner=owner,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    finally:
+        slot.release()
+
+    if result.returncode != 0:
+        log("ERROR", "SUBTITLES", f"Error while extracting the subtitles of {path}")
+
+    for index in indexes:
+        temp_path = f"{directory}/{index}.tmp"
+        if result.returncode == 0 and os.path.exists(temp_path):
+            os.replace(temp_path, f"{directory}/{index}.vtt")
+        elif os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def get_subtitle_file(path: str, index: int, owner: str) -> str | None:
+    """
+    Get the WebVTT file of a subtitle track, extracting the subtitles of the
+    file on the first call
+
+    Args:
+        path (str): The path of the video file
+        index (int): The index of the subtitle stream
+        owner (str): The user the extraction is made for
+
+    Raises:
+        TranscodeBusy: If there is no transcode slot for the extraction
+
+    Returns:
+        str | None: The path of the WebVTT file, None if the track couldn't be
+        extracted
+    """
+    subtitle_path = f"{subtitles_directory(path)}/{index}.vtt"
+    if os.path.exists(subtitle_path):
+        return subtitle_path
+
+    with EXTRACT_LOCKS_LOCK:
+        lock = EXTRACT_LOCKS.setdefault(path, threading.Lock())
+    with lock:
+        extract_subtitles(path, owner)
+
+    if os.path.exists(subtitle_path):
+        return subtitle_path
+    return None
+
+
+def parse_timestamp(timestamp: str) -> float:
+    seconds = 0.0
+    for part in timestamp.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+@lru_cache(maxsize=32)
+def get_cues(subtitle_path: str) -> List[Cue]:
+    """
+    Read the cues of a WebVTT file, the path changes with the version of the
+    video file so the cues can be kept
+
+    Args:
+        subtitle_path (str): The path of the WebVTT file
+
+    Returns:
+        List[Cue]: The start, end and text of each cue
+    """
+    with open(subtitle_path, "r", encoding="utf-8") as file:
+        blocks = file.read().replace("\r\n", "\n").split("\n\n")
+
+    cues = []
+    for block in blocks:
+        lines = block.strip("\n").split("\n")
+        for line in lines:
+            timing = TIMING.match(line)
+            if timing:
+                start = parse_timestamp(timing.group(1))
+                end = parse_timestamp(timing.group(2))
+                cues.append((start, end, "\n".join(lines)))
+                break
+    return cues
+
+
+def get_subtitle_segment(subtitle_path: str, segment: Segment) -> str:
+    """
+    Build the WebVTT segment aligned with a video segment, the cues keep the
+    timestamps of the file and are mapped on the timestamps of the video
+    segments
+
+    Args:
+        subtitle_path (str): The path of the WebVTT file
+        segment (Segment): The start and end of the video segment
+
+    Returns:
+        str: The WebVTT segment
+    """
+    start, end = segment
+    content = f"WEBVTT\n{TIMESTAMP_MAP}\n\n"
+    for cue_start, cue_end, cue in get_cues(subtitle_path):
+        if cue_start < end and cue_end > start:
+            content += f"{cue}\n\n"
+    return content
@@ -0,0 +1,156 @@
+import os
+import uuid
+import subprocess
+
+from functools import partial
+from typing import List
+
+from chocolate_app import ARTEFACTS_PATH, TRACK_CACHE_SIZE
+from chocolate_app.tables import Albums, Playlists, Tracks
+from chocolate_app.utils.utils import file_identity, log
+from chocolate_app.utils.processes import PROCESSES, PREFETCH_JOB, PLAYBACK_JOB
+from chocolate_app.utils.single_flight import SingleFlight
+from chocolate_app.transcode.prefetch import PREFETCHER
+from chocolate_app.transcode.segment_cache import SegmentCache
+from chocolate_app.transcode.decision import ClientCapabilities
+from chocolate_app.transcode.scheduler import TRANSCODE_SCHEDULER, PLAYBACK, PREFETCH
+
+TRACK_CACHE = SegmentCache(f"{ARTEFACTS_PATH}/tracks", TRACK_CACHE_SIZE, "audio")
+
+# ffmpeg arguments and mimetype of the transcoded tracks
+TRACK_FORMATS = {
+    "aac": (
+        ["-c:a", "aac", "-b:a", "256k", "-movflags", "+faststart", "-f", "mp4"],
+        "audio/mp4",
+    ),
+    "opus": (["-c:a", "libopus", "-b:a", "160k", "-f", "ogg"], "audio/ogg"),
+}
+
+# The next tracks of the album or the playlist encoded ahead, so the player
+# can go from one to the other without a gap
+PREFETCH_TRACKS = 2
+TRACK_TIMEOUT = 10 * 60
+
+TRACK_FLIGHTS = SingleFlight()
+
+
+def get_track_format(capabilities: ClientCapabilities) -> str:
+    # Opus is smaller for the same quality, but not every browser reads it
+    if "opus" in capabilities.audio_codecs:
+        return "opus"
+    return "aac"
+
+
+def track_cache_key(path: str, track_format: str) -> str:
+    return SegmentCache.make_key("track", path, file_identity(path), track_format)
+
+
+def get_track_file(
+    path: str, track_format: str, owner: str, priority: int = PLAYBACK
+) -> str | None:
+    """
+    Get the transcoded version of a track, encoding it on the first call only
+
+    Args:
+        path (str): The path of the track
+        track_format (str): "aac" or "opus"
+        owner (str): The user the transcode is made for
+        priority (int): PLAYBACK or PREFETCH
+
+    Raises:
+        TranscodeBusy: If there is no transcode slot for the encode
+
+    Returns:
+        str | None: The path of the encoded track, None if ffmpeg failed
+    """
+    key = track_cache_key(path, track_format)
+    cached = TRACK_CACHE.get(key)
+    if cached:
+        return cached
+
+    # The requests arriving while the track is encoded wait for that encode
+    return TRACK_FLIGHTS.do(key, encode_track, path, track_format, owner, priority)
+
+
+def encode_track(path: str, track_format: str, owner: str, priority: int) -> str | None:
+    key = track_cache_key(path, track_format)
+    # Encoded by another request right before this one
+    cached = TRACK_CACHE.get(key)
+    if cached:
+        return cached
+
+    arguments, _ = TRACK_FORMATS[track_format]
+    temp_path = f"{TRACK_CACHE.path}/{uuid.uuid4().hex}.tmp"
+    os.makedirs(TRACK_CACHE.path, exist_ok=True)
+    command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", path]
+    command += ["-map", "0:a:0", "-vn"] + arguments + [temp_path]
+
+    slot = TRANSCODE_SCHEDULER.acquire(owner, priority)
+    try:
+        result = PROCESSES.run(
+            command,
+            PLAYBACK_JOB if priority == PLAYBACK else PREFETCH_JOB,
+            timeout=TRACK_TIMEOUT,
+            owner=owner,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    finally:
+        slot.release()
+
+    try:
+        if result.returncode != 0:
+            log("ERROR", "TRACKS", f"Error while transcoding the track {path}")
+            return None
+        return TRACK_CACHE.put_file(key, temp_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def parse_track_ids(track_ids: str | None) -> List[int]:
+    return [
+        int(track_id)
+        for track_id in (track_ids or "").split(",")
+        if track_id.strip().isdigit()
+    ]
+
+
+def get_next_tracks(
+    track: Tracks, album_id: int | None, playlist_id: int | None
+) -> List[Tracks]:
+    """
+    Get the tracks played after a track, in its playlist or in its album
+
+    Returns:
+        List[Tracks]: The next PREFETCH_TRACKS tracks
+    """
+    # Both keep their tracks in the order they are played
+    if playlist_id is not None:
+        playlist = Playlists.query.filter_by(id=playlist_id).first()
+        track_ids = parse_track_ids(playlist.tracks if playlist else None)
+    elif album_id is not None:
+        album = Albums.query.filter_by(id=album_id).first()
+        track_ids = parse_track_ids(album.tracks if album else None)
+    else:
+        return []
+
+    if track.id not in track_ids:
+        return []
+    position = track_ids.index(track.id)
+    next_ids = track_ids[position + 1 : position + 1 + PREFETCH_TRACKS]
+    tracks = Tracks.query.filter(Tracks.id.in_(next_ids)).all()
+    return sorted(tracks, key=lambda next_track: next_ids.index(next_track.id))
+
+
+def prefetch_tracks(tracks: List[Tracks], track_format: str, owner: str) -> None:
+    """
+    Encode a batch of tracks in the background, when a slot is free
+    """
+    for track in tracks:
+        if not os.path.exists(track.slug):
+            continue
+        PREFETCHER.submit(
+            track_cache_key(track.slug, track_format),
+            partial(get_track_file, track.slug, track_format, owner, PREFETCH),
+        )
@@ -0,0 +1,272 @@
+import os
+import json
+import math
+import shutil
+import threading
+import subprocess
+
+from typing import Any, Dict, List
+
+from flask import Flask
+
+from chocolate_app import ARTEFACTS_PATH
+from chocolate_app.tables import Episodes, Movies, OthersVideos
+from chocolate_app.utils.utils import file_identity, hash_string, log
+from chocolate_app.utils.processes import PROCESSES, BACKGROUND_JOB
+from chocolate_app.transcode.probe import get_probe
+from chocolate_app.transcode.scheduler import (
+    BACKGROUND_SCHEDULER,
+    TranscodeBusy,
+    PREFETCH,
+)
+
+TRICKPLAY_PATH = f"{ARTEFACTS_PATH}/trickplay"
+TRICKPLAY_OWNER = "trickplay"
+MANIFEST_NAME = "trickplay.json"
+
+# Seconds between two thumbnails
+INTERVAL = 10
+THUMBNAIL_WIDTH = 320
+# Thumbnails in each sprite, 100 thumbnails cover 16 minutes
+COLUMNS = 10
+ROWS = 10
+
+# The whole file is decoded to take the thumbnails
+GENERATE_TIMEOUT = 3 * 60 * 60
+POLL_INTERVAL = 60
+
+
+def trickplay_directory(path: str) -> str:
+    """
+    Get the directory of the trickplay sprites of the current version of a
+    file
+
+    Args:
+        path (str): The path of the video file
+
+    Returns:
+        str: The directory of the sprites and of their manifest
+    """
+    return f"{TRICKPLAY_PATH}/{hash_string(path)}/{hash_string(file_identity(path))}"
+
+
+def has_trickplay(path: str) -> bool:
+    return os.path.exists(f"{trickplay_directory(path)}/{MANIFEST_NAME}")
+
+
+def get_trickplay(path: str) -> Dict[str, Any] | None:
+    """
+    Get the manifest of the trickplay sprites of a file
+
+    Returns:
+        Dict[str, Any] | None: The size and layout of the thumbnails, None if
+        the sprites haven't been generated or couldn't be
+    """
+    try:
+        with open(f"{trickplay_directory(path)}/{MANIFEST_NAME}", "r") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if not manifest["count"]:
+        return None
+    return manifest
+
+
+def get_sprite_path(path: str, sprite: int) -> str:
+    return f"{trickplay_directory(path)}/{sprite}.jpg"
+
+
+def write_manifest(directory: str, manifest: Dict[str, Any]) -> None:
+    with open(f"{directory}/{MANIFEST_NAME}", "w") as file:
+        json.dump(manifest, file)
+
+
+def generate_trickplay(path: str) -> bool:
+    """
+    Generate the trickplay sprites of a file, in a single decoding pass where
+    ffmpeg samples, downscales and tiles the frames
+
+    A file that can't be processed gets an empty manifest, so it isn't tried
+    again until it changes.
+
+    Args:
+        path (str): The path of the video file
+
+    Returns:
+        bool: True if the sprites have been generated
+    """
+    directory = trickplay_directory(path)
+    probe = get_probe(path)
+
+    # The sprites of the previous versions of the file are useless now
+    parent = os.path.dirname(directory)
+    if os.path.isdir(parent):
+        for name in os.listdir(parent):
+            shutil.rmtree(f"{parent}/{name}", ignore_errors=True)
+
+    if not probe.width or not probe.height or not probe.duration:
+        os.makedirs(directory, exist_ok=True)
+        write_manifest(directory, {"count": 0})
+        return False
+
+    height = round(probe.height / probe.width * THUMBNAIL_WIDTH / 2) * 2
+    temp_directory = f"{directory}.tmp"
+    os.makedirs(temp_directory, exist_ok=True)
+
+    command = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        path,
+        "-map",
+        "0:v:0",
+        "-an",
+        "-sn",
+        "-dn",
+        "-vf",
+        f"fps=1/{INTERVAL},scale={THUMBNAIL_WIDTH}:{height},tile={COLUMNS}x{ROWS}",
+        "-q:v",
+        "5",
+        "-start_number",
+        "1",
+        f"{temp_directory}/%d.jpg",
+    ]
+    result = PROCESSES.run(
+        command,
+        BACKGROUND_JOB,
+        timeout=GENERATE_TIMEOUT,
+        owner=TRICKPLAY_OWNER,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    if result.returncode != 0 or not os.path.exists(f"{temp_directory}/1.jpg"):
+        log("ERROR", "TRICKPLAY", f"Error while generating the trickplay of {path}")
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+        write_manifest(directory, {"count": 0})
+        return False
+
+    write_manifest(
+        temp_directory,
+        {
+            "interval": INTERVAL,
+            "width": THUMBNAIL_WIDTH,
+            "height": height,
+            "columns": COLUMNS,
+            "rows": ROWS,
+            "count": math.ceil(probe.duration / INTERVAL),
+            "duration": probe.duration,
+        },
+    )
+    os.replace(temp_directory, directory)
+    return True
+
+
+def format_timestamp(seconds: float) -> str:
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+
+def get_trickplay_track(manifest: Dict[str, Any], sprite_url: str) -> str:
+    """
+    Build the WebVTT thumbnail track of a file, each cue points to its
+    thumbnail in a sprite with a media fragment
+
+    Args:
+        manifest (Dict[str, Any]): The manifest of the sprites
+        sprite_url (str): The url of the sprites, with {} for their number
+
+    Returns:
+        str: The WebVTT track
+    """
+    interval = manifest["interval"]
+    width = manifest["width"]
+    height = manifest["height"]
+    per_sprite = manifest["columns"] * manifest["rows"]
+
+    content = "WEBVTT\n\n"
+    for index in range(manifest["count"]):
+        start = index * interval
+        end = min(start + interval, manifest["duration"])
+        sprite, position = divmod(index, per_sprite)
+        row, column = divmod(position, manifest["columns"])
+        content += f"{format_timestamp(start)} --> {format_timestamp(end)}\n"
+        content += f"{sprite_url.format(sprite + 1)}#xywh={column * width},{row * height},{width},{height}\n\n"
+    return content
+
+
+def get_video_paths() -> List[str]:
+    paths = []
+    for model in [Movies, Episodes, OthersVideos]:
+        paths += [slug for (slug,) in model.query.with_entities(model.slug).all()]
+    return paths
+
+
+class TrickplayGenerator:
+    """
+    Generate the missing trickplay sprites of the video libraries in the
+    background, after each scan
+
+    The files are processed one at a time in the background slot, which the
+    playback never waits for, the slot is released between two files so the
+    audio renditions get their turn. The pass is retried later when the slot
+    is busy.
+    """
+
+    def __init__(self) -> None:
+        self.worker: threading.Thread | None = None
+        self.lock = threading.Lock()
+        self.pending = threading.Event()
+
+    def start(self, app: Flask) -> None:
+        with self.lock:
+            if self.worker is not None:
+                return
+            self.pending.set()
+            self.worker = threading.Thread(target=self.run, args=(app,), daemon=True)
+            self.worker.start()
+
+    def wake(self) -> None:
+        self.pending.set()
+
+    def run(self, app: Flask) -> None:
+        while True:
+            self.pending.wait()
+            self.pending.clear()
+            with app.app_context():
+                try:
+                    finished = self.generate_missing()
+                except Exception as e:
+                    log("ERROR", "TRICKPLAY", f"Error while generating trickplay: {e}")
+                    finished = False
+            if not finished:
+                self.pending.wait(POLL_INTERVAL)
+                self.pending.set()
+
+    def generate_missing(self) -> bool:
+        """
+        Generate the sprites of the files that don't have them yet
+
+        Returns:
+            bool: False if the pass has been stopped by a busy background slot
+        """
+        for path in get_video_paths():
+            if not path or not os.path.exists(path) or has_trickplay(path):
+                continue
+            try:
+                slot = BACKGROUND_SCHEDULER.acquire(TRICKPLAY_OWNER, PREFETCH)
+            except TranscodeBusy:
+                return False
+            try:
+                generate_trickplay(path)
+            finally:
+                slot.release()
+        return True
+
+
+TRICKPLAY_GENERATOR = TrickplayGenerator()
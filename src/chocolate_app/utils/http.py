@@ -0,0 +1,206 @@
+import time
+import random
+import requests
+import threading
+
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict, Iterator
+
+# Connect and read timeouts of the requests that don't set their own
+DEFAULT_TIMEOUT = (5, 30)
+# Kept-alive connections per host
+POOL_SIZE = 16
+
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+
+class HostLimit:
+    def __init__(
+        self, rate: float | None = None, burst: int = 1, concurrency: int = 8
+    ) -> None:
+        """
+        Args:
+            rate (float | None): Requests per second, None for no limit
+            burst (int): Requests that can be sent at once after a pause
+            concurrency (int): Requests running at once
+        """
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+
+
+# The published limits of the providers, with some margin
+HOST_LIMITS = {
+    "api.themoviedb.org": HostLimit(rate=40, burst=40, concurrency=16),
+    "image.tmdb.org": HostLimit(concurrency=16),
+    "www.themoviedb.org": HostLimit(concurrency=16),
+    # 50 requests per 5 seconds
+    "api.deezer.com": HostLimit(rate=9, burst=10, concurrency=4),
+    "api.igdb.com": HostLimit(rate=4, burst=4, concurrency=8),
+    "www.igdb.com": HostLimit(rate=4, burst=4, concurrency=4),
+}
+DEFAULT_LIMIT = HostLimit()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                elapsed = now - self.updated
+                self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Host:
+    """
+    The limits and the counters of the requests to a host
+    """
+
+    def __init__(self, limit: HostLimit) -> None:
+        self.semaphore = threading.BoundedSemaphore(limit.concurrency)
+        self.bucket = TokenBucket(limit.rate, limit.burst) if limit.rate else None
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """
+        Wait for a free slot and a token of the host, and count the request
+        """
+        with self.semaphore:
+            if self.bucket:
+                self.bucket.acquire()
+            start = time.monotonic()
+            try:
+                yield
+            except Exception:
+                with self.lock:
+                    self.errors += 1
+                raise
+            finally:
+                latency = time.monotonic() - start
+                with self.lock:
+                    self.requests += 1
+                    self.latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+
+    def add_bytes(self, size: int) -> None:
+        with self.lock:
+            self.bytes += size
+
+    def add_retry(self) -> None:
+        with self.lock:
+            self.retries += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "retries": self.retries,
+                "bytes": self.bytes,
+                "average_latency": round(self.latency / max(1, self.requests), 3),
+                "max_latency": round(self.max_latency, 3),
+            }
+
+
+def get_backoff(attempt: int, retry_after: str | None = None) -> float:
+    """
+    The delay before a retry, doubled at each attempt, with a random jitter so
+    the workers failing together don't retry together
+    """
+    if retry_after and retry_after.isdigit():
+        return min(BACKOFF_MAX, int(retry_after))
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1)
+
+
+class HttpClient(requests.Session):
+    """
+    The HTTP client shared by the metadata and the artwork providers
+
+    The connections are kept alive, each host has its own concurrency and
+    rate limits, and the requests failing on the network or with a temporary
+    status are retried a few times with an exponential backoff.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self.hosts: Dict[str, Host] = {}
+        self.hosts_lock = threading.Lock()
+
+    def get_host(self, hostname: str) -> Host:
+        with self.hosts_lock:
+            host = self.hosts.get(hostname)
+            if host is None:
+                host = Host(HOST_LIMITS.get(hostname, DEFAULT_LIMIT))
+                self.hosts[hostname] = host
+            return host
+
+    @contextmanager
+    def limited(self, hostname: str) -> Iterator[None]:
+        """
+        Run a request made by another client within the limits of its host
+        """
+        with self.get_host(hostname).slot():
+            yield
+
+    def request(self, method, url, *args, **kwargs) -> requests.Response:
+        host = self.get_host(urlsplit(url).hostname or "")
+        retries = kwargs.pop("retries", MAX_RETRIES)
+        kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+
+        retry_after = None
+        for attempt in range(retries + 1):
+            if attempt:
+                host.add_retry()
+                time.sleep(get_backoff(attempt, retry_after))
+
+            try:
+                with host.slot():
+                    response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == retries:
+                    raise
+                continue
+
+            if not kwargs.get("stream"):
+                host.add_bytes(len(response.content))
+            if response.status_code not in RETRY_STATUS or attempt == retries:
+                return response
+            retry_after = response.headers.get("Retry-After")
+        return response
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self.hosts_lock:
+            hosts = dict(self.hosts)
+        return {hostname: host.get_stats() for hostname, host in hosts.items()}
+
+
+HTTP = HttpClient()
@@ -0,0 +1,143 @@
+import queue
+import threading
+import multiprocessing
+
+from flask import Flask
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, List
+
+from chocolate_app.utils.utils import log
+
+# The items waiting between two stages, so a fast stage doesn't run far ahead
+QUEUE_SIZE = 64
+# A batching stage runs with what it has after this long without a new item
+BATCH_WAIT = 2
+
+STOP = object()
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        function: Callable[[Any], Any],
+        workers: int,
+        batch_size: int | None = None,
+        drop_fails: bool = False,
+    ) -> None:
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.drop_fails = drop_fails
+        self.input: queue.Queue = queue.Queue(QUEUE_SIZE)
+        self.threads: List[threading.Thread] = []
+
+
+class Pipeline:
+    """
+    Run items through stages of worker threads connected by bounded queues
+
+    Each stage function gets an item and returns it for the next stage, or
+    None to drop it. A batching stage gets a list of items instead. An item
+    whose stage raises is logged and dropped, the other ones go on. The items
+    dropped by a stage added with drop_fails are failures too.
+
+    The threads suit the network stages, the CPU-bound work is sent to the
+    process pool of the pipeline with run_in_process. Its processes are
+    spawned, a fork would copy the locks held by the other threads.
+    """
+
+    def __init__(self, app: Flask, processes: int) -> None:
+        self.app = app
+        self.processes = processes
+        self.stages: List[Stage] = []
+        self.process_pool: ProcessPoolExecutor | None = None
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def add_stage(
+        self,
+        name: str,
+        function: Callable[[Any], Any],
+        workers: int,
+        batch_size: int | None = None,
+        drop_fails: bool = False,
+    ) -> None:
+        self.stages.append(Stage(name, function, workers, batch_size, drop_fails))
+
+    def run_in_process(self, function: Callable[..., Any], *args) -> Any:
+        """
+        Run a CPU-bound function in the process pool, and wait for its result
+        """
+        return self.process_pool.submit(function, *args).result()
+
+    def run(self, items: Iterable[Any]) -> bool:
+        """
+        Feed the items to the first stage, and wait until they went through
+        all the stages
+
+        Returns:
+            bool: False if an item failed in a stage
+        """
+        self.process_pool = ProcessPoolExecutor(
+            max(1, self.processes), mp_context=multiprocessing.get_context("spawn")
+        )
+        try:
+            for index, stage in enumerate(self.stages):
+                for _ in range(stage.workers):
+                    thread = threading.Thread(
+                        target=self.work, args=(index,), daemon=True
+                    )
+                    thread.start()
+                    stage.threads.append(thread)
+
+            for item in items:
+                self.stages[0].input.put(item)
+
+            # A stage is stopped once the stage before it is done
+            for stage in self.stages:
+                for _ in stage.threads:
+                    stage.input.put(STOP)
+                for thread in stage.threads:
+                    thread.join()
+        finally:
+            self.process_pool.shutdown(cancel_futures=True)
+        return self.failed == 0
+
+    def work(self, index: int) -> None:
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+
+        with self.app.app_context():
+            stopped = False
+            while not stopped:
+                item = stage.input.get()
+                if item is STOP:
+                    return
+
+                if stage.batch_size:
+                    item = [item]
+                    while len(item) < stage.batch_size:
+                        try:
+                            next_item = stage.input.get(timeout=BATCH_WAIT)
+                        except queue.Empty:
+                            break
+                        if next_item is STOP:
+                            stopped = True
+                            break
+                        item.append(next_item)
+
+                try:
+                    result = stage.function(item)
+                except Exception as e:
+                    log("ERROR", "SCAN", f"Error in the {stage.name} stage: {e}")
+                    with self.lock:
+                        self.failed += len(item) if stage.batch_size else 1
+                    continue
+
+                if result is None and stage.drop_fails:
+                    with self.lock:
+                        self.failed += len(item) if stage.batch_size else 1
+                elif result is not None and next_stage is not None:
+                    next_stage.input.put(result)
@@ -0,0 +1,222 @@
+import os
+import time
+import shutil
+import threading
+import subprocess
+
+from typing import Any, Dict, List
+
+from chocolate_app.utils.utils import log
+
+# The job classes, from the most to the least urgent
+PLAYBACK_JOB = "playback"
+PREFETCH_JOB = "prefetch"
+BACKGROUND_JOB = "background"
+
+# nice value, ionice class and level, Windows priority class
+JOB_PRIORITIES = {
+    PLAYBACK_JOB: (0, 2, 4, "NORMAL_PRIORITY_CLASS"),
+    PREFETCH_JOB: (5, 2, 7, "BELOW_NORMAL_PRIORITY_CLASS"),
+    BACKGROUND_JOB: (19, 3, 0, "IDLE_PRIORITY_CLASS"),
+}
+
+REAP_INTERVAL = 1
+
+
+def with_priority(
+    command: List[str], job_class: str, kwargs: Dict[str, Any]
+) -> List[str]:
+    """
+    Run a command with the CPU and IO priorities of its job class, with nice
+    and ionice when they are available, or with the priority class of the
+    process on Windows
+    """
+    nice, io_class, io_level, windows_class = JOB_PRIORITIES[job_class]
+    if os.name == "nt":
+        kwargs["creationflags"] = kwargs.get("creationflags", 0) | getattr(
+            subprocess, windows_class, 0
+        )
+        return command
+
+    prefix = []
+    if nice and shutil.which("nice"):
+        prefix += ["nice", "-n", str(nice)]
+    if job_class != PLAYBACK_JOB and shutil.which("ionice"):
+        prefix += ["ionice", "-c", str(io_class)]
+        if io_class != 3:
+            prefix += ["-n", str(io_level)]
+    return prefix + command
+
+
+def get_cpu_time(pid: int) -> float | None:
+    """
+    Get the CPU time used by a process, None if it can't be read on this
+    platform
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r") as file:
+            # The name of the program may hold spaces
+            fields = file.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class ManagedProcess:
+    def __init__(
+        self,
+        process: subprocess.Popen,
+        job_class: str,
+        timeout: float | None,
+        cpu_timeout: float | None,
+        owner: str | None,
+    ) -> None:
+        self.process = process
+        self.job_class = job_class
+        self.timeout = timeout
+        self.cpu_timeout = cpu_timeout
+        self.owner = owner
+        self.started = time.time()
+
+    def timed_out(self) -> bool:
+        if self.timeout is not None and time.time() - self.started > self.timeout:
+            return True
+        if self.cpu_timeout is not None:
+            cpu_time = get_cpu_time(self.process.pid)
+            return cpu_time is not None and cpu_time > self.cpu_timeout
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "pid": self.process.pid,
+            "command": " ".join(str(arg) for arg in self.process.args),
+            "job_class": self.job_class,
+            "owner": self.owner,
+            "started": self.started,
+            "running_time": round(time.time() - self.started, 1),
+            "cpu_time": get_cpu_time(self.process.pid),
+            "timeout": self.timeout,
+            "cpu_timeout": self.cpu_timeout,
+        }
+
+
+class ProcessManager:
+    """
+    Start and track the child processes (ffmpeg, ffprobe, ...)
+
+    The exited processes are reaped in the background, so they never stay
+    zombies, and the ones going over their wall-clock or CPU timeout are
+    killed.
+    """
+
+    def __init__(self) -> None:
+        self.processes: Dict[int, ManagedProcess] = {}
+        self.lock = threading.Lock()
+        self.reaper: threading.Thread | None = None
+
+    def popen(
+        self,
+        command: List[str],
+        job_class: str = PLAYBACK_JOB,
+        timeout: float | None = None,
+        cpu_timeout: float | None = None,
+        owner: str | None = None,
+        **kwargs,
+    ) -> subprocess.Popen:
+        """
+        Start a process, the arguments are the ones of subprocess.Popen
+
+        Args:
+            command (List[str]): The command to run
+            job_class (str): PLAYBACK_JOB, PREFETCH_JOB or BACKGROUND_JOB
+            timeout (float | None): The maximum running time, in seconds
+            cpu_timeout (float | None): The maximum CPU time, in seconds
+            owner (str | None): Who the process runs for, for the process table
+
+        Returns:
+            subprocess.Popen: The process
+        """
+        command = with_priority(command, job_class, kwargs)
+        process = subprocess.Popen(command, **kwargs)
+        with self.lock:
+            self.processes[process.pid] = ManagedProcess(
+                process, job_class, timeout, cpu_timeout, owner
+            )
+            self.start_reaper()
+        return process
+
+    def run(
+        self,
+        command: List[str],
+        job_class: str = PLAYBACK_JOB,
+        timeout: float | None = None,
+        cpu_timeout: float | None = None,
+        owner: str | None = None,
+        **kwargs,
+    ) -> subprocess.CompletedProcess:
+        """
+        Run a process until it exits or is killed, like subprocess.run
+        """
+        process = self.popen(command, job_class, timeout, cpu_timeout, owner, **kwargs)
+        try:
+            stdout, stderr = process.communicate()
+        finally:
+            self.kill(process)
+        return subprocess.CompletedProcess(
+            process.args, process.returncode, stdout, stderr
+        )
+
+    def kill(self, process: subprocess.Popen) -> None:
+        """
+        Kill a process if it still runs and stop tracking it
+        """
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        self.forget(process)
+
+    def forget(self, process: subprocess.Popen) -> None:
+        # The pid may already be reused by a newer process
+        with self.lock:
+            managed = self.processes.get(process.pid)
+            if managed is not None and managed.process is process:
+                del self.processes[process.pid]
+
+    def kill_pid(self, pid: int) -> bool:
+        with self.lock:
+            managed = self.processes.get(pid)
+        if managed is None:
+            return False
+        self.kill(managed.process)
+        return True
+
+    def get_processes(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            processes = list(self.processes.values())
+        return [managed.to_dict() for managed in processes]
+
+    def start_reaper(self) -> None:
+        if self.reaper is not None:
+            return
+        self.reaper = threading.Thread(target=self.reap, daemon=True)
+        self.reaper.start()
+
+    def reap(self) -> None:
+        while True:
+            time.sleep(REAP_INTERVAL)
+            with self.lock:
+                processes = list(self.processes.values())
+
+            for managed in processes:
+                if managed.process.poll() is not None:
+                    self.forget(managed.process)
+                elif managed.timed_out():
+                    log(
+                        "ERROR",
+                        "PROCESSES",
+                        f"Killing the process {managed.process.pid} after its timeout",
+                    )
+                    self.kill(managed.process)
+
+
+PROCESSES = ProcessManager()
@@ -0,0 +1,104 @@
+import threading
+
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class Flight:
+    """
+    A call in flight, the callers joining it wait for its result
+    """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Wait for the end of the call
+
+        Returns:
+            bool: False if the call didn't end in time
+        """
+        return self.done.wait(timeout)
+
+
+class SingleFlight:
+    """
+    Coalesce the concurrent calls of an expensive operation
+
+    The calls are keyed by the signature of the operation (the file, the
+    segment, the size of the image...), the first caller runs it and the ones
+    arriving while it runs wait for it and share its result, or its exception.
+    Nothing is kept once the call has ended, the caching is left to the caller.
+    """
+
+    def __init__(self) -> None:
+        self.flights: Dict[Hashable, Flight] = {}
+        self.lock = threading.Lock()
+
+    def join(self, key: Hashable) -> Tuple[Flight, bool]:
+        """
+        Join the call in flight for a key, or start a new one
+
+        Args:
+            key (Hashable): The signature of the operation
+
+        Returns:
+            Tuple[Flight, bool]: The call, and True if the caller leads it and
+            must end it with finish
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = Flight()
+            self.flights[key] = flight
+            return flight, True
+
+    def finish(
+        self,
+        key: Hashable,
+        result: Any = None,
+        error: BaseException | None = None,
+        flight: Flight | None = None,
+    ) -> None:
+        """
+        End the call of a key and wake up the callers waiting for it. With a
+        flight, the call is only ended if it is still the one in flight
+        """
+        with self.lock:
+            if flight is not None and self.flights.get(key) is not flight:
+                return
+            flight = self.flights.pop(key, None)
+        if flight is None:
+            return
+        flight.result = result
+        flight.error = error
+        flight.done.set()
+
+    def do(self, key: Hashable, function: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run an operation, or wait for the same one already running
+
+        Args:
+            key (Hashable): The signature of the operation
+            function (Callable[..., Any]): The operation
+
+        Returns:
+            Any: The result of the operation
+        """
+        flight, leader = self.join(key)
+        if not leader:
+            flight.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, error=e)
+            raise
+        self.finish(key, result)
+        return result
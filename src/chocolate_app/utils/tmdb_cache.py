@@ -0,0 +1,196 @@
+import re
+import time
+import sqlite3
+import requests
+import threading
+
+from typing import Any, Dict, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from chocolate_app import ARTEFACTS_PATH, TMDB_URL
+from chocolate_app.utils.http import HTTP
+from chocolate_app.utils.utils import log
+
+TMDB_API_URL = "https://api.themoviedb.org/3"
+TMDB_CACHE_PATH = f"{ARTEFACTS_PATH}/tmdb_cache.db"
+
+DAY = 24 * 60 * 60
+# How long a response is fresh, by endpoint, the first match is used
+TTLS = [
+    (re.compile(r"^/search/"), DAY),
+    (re.compile(r"^/person/"), 30 * DAY),
+    # The running shows get new seasons and episodes
+    (re.compile(r"^/tv/\d+$"), DAY),
+    (re.compile(r"^/tv/\d+/season/"), DAY),
+    (re.compile(r"^/movie/"), 7 * DAY),
+    (re.compile(r"^/tv/"), 7 * DAY),
+]
+DEFAULT_TTL = DAY
+# A response this much older than its TTL is still sent while it's refreshed
+# in the background, and whenever TMDb can't be reached
+STALE_TTL = 30 * DAY
+
+# Only the successful responses are kept, the others are tried again
+CACHED_STATUS = 200
+
+
+def get_ttl(path: str) -> int:
+    for pattern, ttl in TTLS:
+        if pattern.match(path):
+            return ttl
+    return DEFAULT_TTL
+
+
+class TMDbCache:
+    """
+    An on-disk cache of the TMDb API responses, shared by all the scanners
+
+    The responses are keyed by endpoint, parameters and language, without the
+    API key, and expire after the TTL of their endpoint.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, path TEXT, content_type TEXT, "
+                "body BLOB, fetched_at REAL)"
+            )
+            self.connection.commit()
+
+    def get(self, key: str) -> Tuple[str, bytes, float] | None:
+        """
+        Returns:
+            Tuple[str, bytes, float] | None: The content type, the body and the
+            time of the response, None if it isn't cached
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT content_type, body, fetched_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+    def put(self, key: str, path: str, content_type: str, body: bytes) -> None:
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, path, content_type, body, time.time()),
+            )
+            self.connection.commit()
+
+    def purge(self, path: str | None = None) -> int:
+        """
+        Remove the cached responses, all of them or those of an endpoint
+
+        Args:
+            path (str | None): The start of the endpoints to purge, like
+            /movie/550 or /search
+
+        Returns:
+            int: The number of responses removed
+        """
+        with self.lock:
+            if path:
+                cursor = self.connection.execute(
+                    "DELETE FROM responses WHERE substr(path, 1, ?) = ?",
+                    (len(path), path),
+                )
+            else:
+                cursor = self.connection.execute("DELETE FROM responses")
+            self.connection.commit()
+            return cursor.rowcount
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            count, size = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM responses"
+            ).fetchone()
+        return {"responses": count, "size": size}
+
+
+class CachedSession(requests.Session):
+    """
+    The session of tmdbv3api, answering the GET requests from the cache
+
+    An expired response is sent as is while it's refreshed in the background,
+    until it's older than its TTL plus STALE_TTL. The requests are sent to
+    TMDB_URL, so a local stand-in of TMDb can be used, through the shared
+    HTTP client and its limits.
+    """
+
+    def __init__(self, cache: TMDbCache) -> None:
+        super().__init__()
+        self.cache = cache
+        self.refreshing: set = set()
+        self.refreshing_lock = threading.Lock()
+
+    def request(self, method, url, *args, **kwargs) -> requests.Response:
+        if url.startswith(TMDB_API_URL):
+            url = TMDB_URL + url[len(TMDB_API_URL) :]
+        if method.upper() != "GET" or not url.startswith(TMDB_URL):
+            return HTTP.request(method, url, *args, **kwargs)
+
+        parts = urlsplit(url)
+        path = parts.path[len(urlsplit(TMDB_URL).path) :]
+        params = [(k, v) for k, v in parse_qsl(parts.query) if k != "api_key"]
+        key = f"{path}?{urlencode(sorted(params))}"
+
+        cached = self.cache.get(key)
+        if cached:
+            content_type, body, fetched_at = cached
+            age = time.time() - fetched_at
+            ttl = get_ttl(path)
+            if age < ttl:
+                return build_response(url, content_type, body)
+            if age < ttl + STALE_TTL:
+                self.refresh(key, path, method, url, args, kwargs)
+                return build_response(url, content_type, body)
+
+        try:
+            return self.fetch(key, path, method, url, *args, **kwargs)
+        except requests.RequestException:
+            if cached:
+                log("ERROR", "TMDB", f"Can't reach TMDb, cached {path} sent")
+                return build_response(url, cached[0], cached[1])
+            raise
+
+    def fetch(self, key: str, path: str, method, url, *args, **kwargs):
+        response = HTTP.request(method, url, *args, **kwargs)
+        if response.status_code == CACHED_STATUS:
+            content_type = response.headers.get("Content-Type", "application/json")
+            self.cache.put(key, path, content_type, response.content)
+        return response
+
+    def refresh(self, key: str, path: str, method, url, args, kwargs) -> None:
+        with self.refreshing_lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def run() -> None:
+            try:
+                self.fetch(key, path, method, url, *args, **kwargs)
+            except requests.RequestException as e:
+                log("ERROR", "TMDB", f"Error while refreshing {path}: {e}")
+            finally:
+                with self.refreshing_lock:
+                    self.refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+def build_response(url: str, content_type: str, body: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = CACHED_STATUS
+    response.url = url
+    response.headers["Content-Type"] = content_type
+    response.encoding = "utf-8"
+    response._content = body
+    return response
+
+
+TMDB_CACHE = TMDbCache(TMDB_CACHE_PATH)
+TMDB_SESSION = CachedSession(TMDB_CACHE)
@@ -1,11 +1,9 @@
 import hashlib
 import os
-import time
 import json
 import base64
 import requests
 import datetime
-import subprocess
 
 from enum import Enum
 from io import BytesIO
@@ -14,6 +12,7 @@ from flask import Request, Response, abort, jsonify
 from PIL import Image, UnidentifiedImageError
 
 from chocolate_app.tables import Users, Libraries
+from chocolate_app.utils.http import HTTP
 from chocolate_app import all_auth_tokens, get_dir_path, LOG_PATH, get_language_file
 
 dir_path = get_dir_path()
@@ -63,6 +62,8 @@ class Codes(Enum):
 
     INVALID_METHOD = 261
 
+    TRANSCODE_BUSY = 271
+
 
 def generate_log(request: Request, component: str) -> None:
     """
@@ -230,18 +231,39 @@ def user_in_lib(user_id, lib):
 
 
 def save_image(url, path) -> str | None:
-    image_requests = requests.Session()
     if not os.path.exists(f"{path}.webp"):
-        with open(f"{path}.png", "wb") as f:
-            try:
-                f.write(image_requests.get(url).content)
-            except Exception:
-                time.sleep(0.5)
-                return save_image(url, path)
+        download_image(url, path)
+    return convert_image(path)
+
+
+def download_image(url, path) -> None:
+    """
+    Download an image to path.png, unless it has already been converted
+    """
+    if os.path.exists(f"{path}.webp"):
+        return
+    try:
+        response = HTTP.get(url)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        log("ERROR", "IMAGE", f"Can't download {url}: {e}")
+        return
+    with open(f"{path}.png", "wb") as f:
+        f.write(response.content)
+
 
+def convert_image(path) -> str | None:
+    """
+    Convert a downloaded image to path.webp, the network isn't used so it can
+    run in a process pool
+
+    Returns:
+        str | None: The path of the WebP image, None if it isn't an image
+    """
+    if not os.path.exists(f"{path}.webp"):
         try:
             image = Image.open(f"{path}.png")
-        except UnidentifiedImageError:
+        except (UnidentifiedImageError, FileNotFoundError):
             return None
 
         image.save(f"{path}.webp", "webp", optimize=True)
@@ -445,22 +467,18 @@ def hash_string(string: str) -> str:
     return hashlib.md5(string.encode()).hexdigest()
 
 
-def length_video(path: str) -> float:
-    seconds = subprocess.run(
-        [
-            "ffprobe",
-            "-v",
-            "error",
-            "-show_entries",
-            "format=duration",
-            "-of",
-            "default=noprint_wrappers=1:nokey=1",
-            path,
-        ],
-        stdout=subprocess.PIPE,
-        text=True,
-    )
+def file_identity(path: str) -> str:
+    """
+    Get a string identifying the current version of a file
+
+    Args:
+        path (str): The path of the file
+
+    Returns:
+        str: The identity of the file, it changes as soon as the file is modified
+    """
     try:
-        return float(seconds.stdout)
-    except ValueError:
-        return 0.0
+        stat = os.stat(path)
+    except OSError:
+        return path
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
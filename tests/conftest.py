@@ -0,0 +1,32 @@
+import os
+import sys
+import pytest
+import tempfile
+
+# The server reads its paths from the command line when it's imported
+ROOT = tempfile.mkdtemp(prefix="chocolate_tests_")
+sys.argv = [
+    sys.argv[0],
+    "--config",
+    f"{ROOT}/config.ini",
+    "--sqlite_file",
+    f"{ROOT}/database.db",
+    "--artefacts",
+    f"{ROOT}/artefacts",
+    "-i",
+    f"{ROOT}/images",
+    "-pl",
+    f"{ROOT}/plugins",
+    "-l",
+    f"{ROOT}/server.log",
+]
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+@pytest.fixture(scope="session")
+def app():
+    from chocolate_app import app, DB
+
+    with app.app_context():
+        DB.create_all()
+        yield app
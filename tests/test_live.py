@@ -0,0 +1,108 @@
+import os
+import time
+import shutil
+import pytest
+import threading
+import subprocess
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DURATION = 120
+# The stand-in sends the stream faster than real time, so the first segments
+# of the relay are written sooner
+SPEED = 4
+CHUNK_SIZE = 16 * 1024
+
+pytestmark = pytest.mark.skipif(
+    not shutil.which("ffmpeg"), reason="ffmpeg is not installed"
+)
+
+
+class StandInStream:
+    """
+    A local IPTV stream, counting the connections made to it. It's sent in
+    Matroska, some static builds of ffmpeg crash when reading MPEG-TS
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as file:
+            self.data = file.read()
+        self.connections = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/channel.mkv"
+
+    def make_handler(self):
+        stream = self
+        delay = CHUNK_SIZE / (len(self.data) / DURATION * SPEED)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                stream.connections += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "video/x-matroska")
+                self.end_headers()
+                try:
+                    for offset in range(0, len(stream.data), CHUNK_SIZE):
+                        self.wfile.write(stream.data[offset : offset + CHUNK_SIZE])
+                        time.sleep(delay)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return Handler
+
+
+@pytest.fixture(scope="module")
+def stream(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("live") / "channel.mkv")
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"testsrc=duration={DURATION}:size=160x120:rate=25",
+            "-c:v",
+            "libx264",
+            "-g",
+            "25",
+            path,
+        ],
+        check=True,
+    )
+    stream = StandInStream(path)
+    threading.Thread(target=stream.server.serve_forever, daemon=True).start()
+    yield stream
+    stream.server.shutdown()
+
+
+def test_viewers_share_one_relay(app, stream, monkeypatch):
+    from chocolate_app.transcode import live
+
+    relays = live.LiveRelayManager()
+    try:
+        first = relays.join(1, stream.url, "first viewer")
+        second = relays.join(1, stream.url, "second viewer")
+
+        assert first is not None
+        assert second is first
+        assert stream.connections == 1
+        assert "#EXTINF" in first.get_playlist("/live/1/{}")
+
+        # The viewers stop reloading the playlist
+        monkeypatch.setattr(live, "VIEWER_TIMEOUT", 0)
+        deadline = time.time() + 20
+        while relays.get_relay(1) is not None and time.time() < deadline:
+            time.sleep(0.5)
+
+        assert relays.get_relay(1) is None
+        assert not first.is_running()
+        assert not os.path.exists(first.directory)
+    finally:
+        for relay in list(relays.relays.values()):
+            relay.stop()
@@ -0,0 +1,54 @@
+import json
+import time
+import sqlalchemy
+
+
+def test_concurrent_creation_is_an_update(app):
+    from chocolate_app import DB
+    from chocolate_app.tables import PlaybackSessions
+    from chocolate_app.transcode.playback_state import DatabasePlaybackStore
+
+    store = DatabasePlaybackStore(ttl=60)
+    # The sweep would lock the database for the other worker
+    store.last_expire = time.time()
+    created = []
+
+    # Another worker creates the session between the lookup and the insert
+    @sqlalchemy.event.listens_for(DB.session, "before_flush")
+    def create_session(session, *args) -> None:
+        if created:
+            return
+        created.append(True)
+        with DB.engine.begin() as connection:
+            connection.execute(
+                PlaybackSessions.__table__.insert().values(
+                    key="race", state=json.dumps({"quality": "720"}), last_access=0
+                )
+            )
+
+    try:
+        state = store.update("race", audio_idx=1)
+    finally:
+        sqlalchemy.event.remove(DB.session, "before_flush", create_session)
+
+    assert state == {"quality": "720", "audio_idx": 1}
+    assert store.get("race") == state
+
+
+def test_last_access_is_written_less_often(app):
+    from chocolate_app.tables import PlaybackSessions
+    from chocolate_app.transcode.playback_state import DatabasePlaybackStore
+
+    store = DatabasePlaybackStore(ttl=60)
+    store.update("throttled", video_idx=1)
+    last_access = PlaybackSessions.query.filter_by(key="throttled").first().last_access
+
+    store.update("throttled", video_idx=1)
+    assert (
+        PlaybackSessions.query.filter_by(key="throttled").first().last_access
+        == last_access
+    )
+
+    # A new value is always written
+    assert store.update("throttled", video_idx=2) == {"video_idx": 2}
+    assert store.get("throttled") == {"video_idx": 2}
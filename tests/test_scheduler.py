@@ -0,0 +1,27 @@
+import pytest
+
+
+@pytest.fixture
+def scheduler(app):
+    from chocolate_app.transcode.scheduler import TranscodeScheduler
+
+    return TranscodeScheduler(slots=1, user_slots=1)
+
+
+def test_playback_shares_its_slot(scheduler):
+    from chocolate_app.transcode.scheduler import TranscodeBusy
+
+    segmenter = scheduler.acquire("viewer", group="viewer-movie-1")
+    # The audio chunks of the same playback don't wait for the segmenter
+    audio = scheduler.acquire("viewer", timeout=0, group="viewer-movie-1")
+    assert scheduler.total == 1
+
+    with pytest.raises(TranscodeBusy):
+        scheduler.acquire("other viewer", timeout=0, group="other-movie-1")
+
+    segmenter.release()
+    assert scheduler.total == 1
+    audio.release()
+    assert scheduler.total == 0
+
+    scheduler.acquire("other viewer", timeout=0, group="other-movie-1").release()
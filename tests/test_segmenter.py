@@ -0,0 +1,84 @@
+import os
+import shutil
+import pytest
+import subprocess
+
+from typing import List
+
+FPS = 24
+SEGMENTS = [(start, min(40.0, start + 3.0)) for start in range(0, 40, 3)]
+
+pytestmark = pytest.mark.skipif(
+    not shutil.which("ffmpeg") or not shutil.which("ffprobe"),
+    reason="ffmpeg is not installed",
+)
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory) -> str:
+    # A keyframe every second, the segments are cut on every third one
+    path = str(tmp_path_factory.mktemp("video") / "video.mkv")
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"testsrc=duration=40:size=160x120:rate={FPS}",
+            "-c:v",
+            "libx264",
+            "-g",
+            str(FPS),
+            "-sc_threshold",
+            "0",
+            path,
+        ],
+        check=True,
+    )
+    return path
+
+
+def run_segmenter(video: str, quality: str, start_idx: int, directory: str) -> str:
+    from chocolate_app.transcode.segmenter import video_segmenter_command
+
+    os.makedirs(directory)
+    command = video_segmenter_command(video, quality, SEGMENTS, start_idx, directory)
+    subprocess.run(command, check=True)
+    return directory
+
+
+def get_packet_times(path: str) -> List[float]:
+    output = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v",
+            "-show_entries",
+            "packet=pts_time",
+            "-of",
+            "csv=p=0",
+            path,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return sorted(float(line.split(",")[0]) for line in output.split())
+
+
+@pytest.mark.parametrize("quality", ["copy", "default"])
+def test_resumed_session_keeps_the_segments(app, video, tmp_path, quality):
+    first = run_segmenter(video, quality, 1, str(tmp_path / "first"))
+    resumed = run_segmenter(video, quality, 5, str(tmp_path / "resumed"))
+
+    for idx in range(5, 9):
+        start, end = SEGMENTS[idx - 1]
+        times = get_packet_times(f"{resumed}/{idx}.ts")
+        assert len(times) == round((end - start) * FPS)
+        # On the same timeline as the segment of a session started at 0
+        assert times == get_packet_times(f"{first}/{idx}.ts")
+        assert times[0] >= start
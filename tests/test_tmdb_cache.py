@@ -0,0 +1,108 @@
+import json
+import time
+import pytest
+import threading
+
+from typing import List
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOVIE_URL = "https://api.themoviedb.org/3/movie/550?language=en-US"
+
+
+class StandInTMDb:
+    """
+    A local TMDb, numbering its responses so a cached one can be told apart
+    """
+
+    def __init__(self) -> None:
+        self.requests: List[str] = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/3"
+
+    def make_handler(self):
+        tmdb = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                tmdb.requests.append(self.path)
+                body = json.dumps(
+                    {"id": 550, "title": "Fight Club", "response": len(tmdb.requests)}
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json;charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def tmdb(app, monkeypatch):
+    from chocolate_app.utils import tmdb_cache
+
+    tmdb = StandInTMDb()
+    threading.Thread(target=tmdb.server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(tmdb_cache, "TMDB_URL", tmdb.url)
+    yield tmdb
+    tmdb.server.shutdown()
+
+
+@pytest.fixture
+def session(app, tmp_path):
+    from chocolate_app.utils.tmdb_cache import CachedSession, TMDbCache
+
+    return CachedSession(TMDbCache(str(tmp_path / "tmdb_cache.db")))
+
+
+def set_age(session, seconds: float) -> None:
+    with session.cache.lock:
+        session.cache.connection.execute(
+            "UPDATE responses SET fetched_at = ?", (time.time() - seconds,)
+        )
+        session.cache.connection.commit()
+
+
+def test_second_lookup_is_cached(tmdb, session):
+    first = session.get(f"{MOVIE_URL}&api_key=first")
+    # The API key isn't part of the cache key
+    second = session.get(f"{MOVIE_URL}&api_key=second")
+
+    assert len(tmdb.requests) == 1
+    assert first.json() == {"id": 550, "title": "Fight Club", "response": 1}
+    assert second.json() == first.json()
+
+
+def test_expired_lookup_is_fetched_again(tmdb, session):
+    from chocolate_app.utils.tmdb_cache import STALE_TTL, get_ttl
+
+    session.get(MOVIE_URL)
+    set_age(session, get_ttl("/movie/550") + STALE_TTL + 1)
+
+    assert session.get(MOVIE_URL).json()["response"] == 2
+    assert len(tmdb.requests) == 2
+    # The new response is cached in turn
+    assert session.get(MOVIE_URL).json()["response"] == 2
+
+
+def test_stale_lookup_is_refreshed_in_the_background(tmdb, session):
+    from chocolate_app.utils.tmdb_cache import get_ttl
+
+    session.get(MOVIE_URL)
+    set_age(session, get_ttl("/movie/550") + 1)
+
+    assert session.get(MOVIE_URL).json()["response"] == 1
+
+    deadline = time.time() + 10
+    while len(tmdb.requests) < 2 and time.time() < deadline:
+        time.sleep(0.1)
+    # Until the refresh is stored, the stale response is still sent
+    while session.get(MOVIE_URL).json()["response"] != 2 and time.time() < deadline:
+        time.sleep(0.1)
+
+    assert len(tmdb.requests) == 2
+    assert session.get(MOVIE_URL).json()["response"] == 2